@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   cpi_imagedump.py
+#
+# Purpose:
+#   Make CPI particle collages from Hawkeye-CPI (*roi) files, one PNG per
+#   minute (or per hour), without IDL. Python version of cpi_imagedump.pro:
+#   same page layout (header, 1 mm scale, numcolumns x numrows panels of
+#   xpanelsize x ypanelsize pixels, one panel every 'rate' seconds), same
+#   focus test (max Sobel > 150), 'jailbars' correction and 'pack' options,
+#   and the same 'standard'/'GHRC' file names. The roi files are read
+#   through the memory-mapped block index and sidecar particle index of
+#   ../hawkeye-cpi-scripts/hawkeye_roi.py (the imageblock, house, house2
+#   and roiblock layouts of cpi_imagedump.pro), and every page is rendered
+#   by its own worker process.
+#
+# Syntax:
+#   ./cpi_imagedump.py ../../Hawkeye-CPI_Data/*.roi -res 2.3 -rate 5 \
+#       -xpanelsize 2400 -ypanelsize 2000 -project IMPACTS
+#
+#   ./cpi_imagedump.py *.roi -numcolumns 4 -xpanelsize 1200 -project IMPACTS \
+#       -naming_convention GHRC -outdir collages/
+#
+#   Options (all optional, defaults as in cpi_imagedump.pro):
+#       -res                : probe resolution for the scale bar (2.3 microns)
+#       -rate               : seconds per panel (minutes with -hourly) (5)
+#       -numcolumns         : panel columns per page (4)
+#       -xpanelsize, -ypanelsize : panel size in pixels (1200, 1000)
+#       -pack               : 0 = every particle in the panel corner,
+#                             1 = height map packing (default),
+#                             2 = shelf, 3 = skyline, 4 = maxrects
+#                             (smallest or largest first, whichever
+#                             drops fewer particles; see cpi_packing.py)
+#       -jailbars           : correct dark vertical streaks (IMPACTS failure)
+#       -hourly             : one page per hour instead of per minute
+#       -project, -outdir, -naming_convention (standard, GHRC), -version
+#       -nproc              : worker processes (default: all cores)
+#
+#   Output Files:
+#       20230115_191300_CPI.png                      (standard)
+#       IMPACTS_CPI-P3_20230115-191300_images_v01.png (GHRC)
+#
+# Modification History:
+#   2026/10/18
+#     Written, based on cpi_imagedump.pro (AB 7/2020). Unlike the IDL
+#     version the last page of the run is also written.
+#     Panel packing moved to cpi_packing.py; added shelf, skyline and
+#     maxrects packing (-pack 2-4) and the dropped particle count and
+#     panel fill efficiency in the summary.
+#     Num Written stays 0 with -pack 0 as in cpi_imagedump.pro; the fill
+#     efficiency counts overlapping particles once.
+#     -pack 2-4 pack smallest first when that drops fewer particles.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import argparse
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from scipy import ndimage
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hawkeye-cpi-scripts'))
+from hawkeye_roi import RoiFile, particle_index
+from cpi_packing import PACK_METHODS, pack as pack_panel
+
+PAD = 25                 # White space between panels
+PANEL_BACKGROUND = 150   # Panel background color
+FOCUS_THRESHOLD = 150    # Particles need max(sobel(roi)) above this
+CHARSIZE_PIXELS = 12     # Text height (pixels) of an IDL charsize of 1
+
+# TrueType fonts tried for the text (cgtext uses helvetica)
+FONT_NAMES = ('Helvetica.ttf', 'LiberationSans-Regular.ttf', 'Arial.ttf', 'DejaVuSans.ttf')
+
+
+class CollageLayout:
+    """Page and panel geometry of cpi_imagedump.pro."""
+
+    def __init__(self, rate=5, numcolumns=4, xpanelsize=1200, ypanelsize=1000, hourly=False):
+        self.rate = rate
+        self.hourly = hourly
+        self.numcolumns = numcolumns
+        self.xpanelsize = xpanelsize
+        self.ypanelsize = ypanelsize
+        self.numpanels = 60 // rate
+        self.numrows = self.numpanels // numcolumns
+        self.headerpad = ypanelsize * self.numrows * 0.1
+        self.imwidth = xpanelsize * numcolumns + (numcolumns + 1) * PAD
+        self.imheight = int(ypanelsize * self.numrows + self.numrows * PAD + self.headerpad)
+
+    def panel_origin(self, ipanel):
+        """Top left (x, y) pixel of panel 'ipanel' on the page (None if not shown)."""
+        icolumn, irow = ipanel % self.numcolumns, ipanel // self.numcolumns
+        if irow >= self.numrows:
+            return None
+        x = icolumn * (self.xpanelsize + PAD) + PAD
+        bottom = int(self.imheight - self.headerpad - self.ypanelsize - irow * (self.ypanelsize + PAD))
+        return x, self.imheight - bottom - self.ypanelsize
+
+
+def millimeter_scale(res):
+    """1 mm scale bar image (top row first) for a probe resolution in microns."""
+    scw = 1000. / res + 1
+    sch = scw / 20
+    scale = np.full((int(sch), int(scw)), 255, dtype=np.uint8)
+    scale[int(sch / 2 - 2):int(sch / 2 + 2) + 1, :] = 0                        # Main bar
+    scale[:, 0:3] = 0                                                          # Left tick
+    scale[:, -3:] = 0                                                          # Right tick
+    ticks = (np.arange(10) * scw / 10).astype(int)
+    scale[int(sch / 2 - sch / 4):int(sch / 2 + sch / 4) + 1, ticks] = 0        # Minor ticks
+    return scale[::-1]
+
+
+def sobel_focus(roi):
+    """max(sobel(roi)) as computed by IDL (|Gx| + |Gy|, edge pixels zero)."""
+    if min(roi.shape) < 3:
+        return 0
+    r = roi.astype(np.int32)
+    gx = ((r[:-2, 2:] + 2 * r[1:-1, 2:] + r[2:, 2:])
+          - (r[:-2, :-2] + 2 * r[1:-1, :-2] + r[2:, :-2]))
+    gy = ((r[2:, :-2] + 2 * r[2:, 1:-1] + r[2:, 2:])
+          - (r[:-2, :-2] + 2 * r[:-2, 1:-1] + r[:-2, 2:]))
+    return int((np.abs(gx) + np.abs(gy)).max())
+
+
+def fix_jailbars(roi):
+    """
+    Fill the void vertical stripes of the IMPACTS 'jailbars' failure: zero
+    pixels take the larger neighbour (IDL one-dimensional shift), then a
+    5x5 median, keeping all original non-zero pixels.
+    """
+    flat = roi.ravel()
+    filled = np.maximum(np.maximum(flat, np.roll(flat, 1)), np.roll(flat, -1)).reshape(roi.shape)
+    original = roi != 0
+    filled[original] = roi[original]
+    smoothed = filled.copy()
+    if min(roi.shape) >= 5:
+        # IDL median leaves the 2 pixel edge unchanged
+        smoothed[2:-2, 2:-2] = ndimage.median_filter(filled, size=5)[2:-2, 2:-2]
+    smoothed[original] = roi[original]
+    return smoothed
+
+
+def page_codes(table, year, month, hourly=False):
+    """Page of each particle as an integer YYYYMMDDHHMM (minute 0 if hourly)."""
+    minute = 0 if hourly else table['minute'].astype(np.int64)
+    return (((int(year) * 100 + int(month)) * 100 + table['day'].astype(np.int64)) * 10000
+            + table['hour'].astype(np.int64) * 100 + minute)
+
+
+def page_time(code):
+    """Page time string as in cpi_imagedump.pro (20230115_191300)."""
+    return f'{code // 10000:08d}_{code % 10000:04d}00'
+
+
+def page_filename(imagetime, project='project', naming_convention='standard', version='v01'):
+    if naming_convention == 'GHRC':
+        # GHRC need dash instead of underscore
+        return f"{project}_CPI-P3_{imagetime.replace('_', '-')}_images_{version}.png"
+    return f'{imagetime}_CPI.png'
+
+
+def load_font(size):
+    for name in FONT_NAMES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def collage_pages(filenames, hourly=False):
+    """
+    Split the particles of a list of roi files into pages. Returns a list of
+    (page code, [(roi filename, particle table rows), ...]) in time order,
+    particles in file order within each page.
+    """
+    codes, parts = [], []
+    for filename in filenames:
+        with RoiFile(filename) as roi_file:
+            header = roi_file.header
+            table = particle_index(filename, roi_file)
+        table = table[table['valid']]
+        codes.append(page_codes(table, header['year'], header['month'], hourly))
+        parts.append(table)
+    if not codes:
+        return []
+    codes = np.concatenate(codes)
+    file_number = np.repeat(np.arange(len(parts)), [len(table) for table in parts])
+    row = np.concatenate([np.arange(len(table)) for table in parts])
+    order = np.argsort(codes, kind='stable')
+    pages = []
+    unique_codes, starts = np.unique(codes[order], return_index=True)
+    for code, members in zip(unique_codes, np.split(order, starts[1:])):
+        files = []
+        for number in np.unique(file_number[members]):
+            rows = row[members[file_number[members] == number]]
+            files.append((filenames[number], parts[number][rows]))
+        pages.append((int(code), files))
+    return pages
+
+
+def render_page(page, layout, res=2.3, project='project', pack=1, jailbars=False, outdir='',
+                naming_convention='standard', version='v01'):
+    """
+    Render one collage page and write it. Returns (png file, particles,
+    written, dropped, fill efficiency of each shown panel).
+    """
+    code, files = page
+    imagetime = page_time(code)
+    pngfile = os.path.join(outdir, page_filename(imagetime, project, naming_convention, version))
+    print('Writing ' + pngfile)
+
+    # Focused particles of each panel, in arrival order
+    panel_particles = [[] for _ in range(layout.numpanels)]
+    nparticles = 0
+    for filename, table in files:
+        with RoiFile(filename) as roi_file:
+            for particle in roi_file.particles(table):
+                nparticles += 1
+                roi = fix_jailbars(particle.image) if jailbars else particle.image.copy()
+                panelind = (particle.minute if layout.hourly else particle.second) // layout.rate
+                if panelind < layout.numpanels and sobel_focus(roi) > FOCUS_THRESHOLD:
+                    panel_particles[panelind].append(roi)
+
+    panels = np.full((layout.numpanels, layout.ypanelsize, layout.xpanelsize), PANEL_BACKGROUND, dtype=np.uint8)
+    nwritten = ndropped = 0
+    fill_efficiency = []
+    # As in cpi_imagedump.pro, only packed particles count as written, not
+    # those stacked in the corner (pack 0)
+    count_written = PACK_METHODS.get(pack, pack) != 'corner'
+    for panelind, rois in enumerate(panel_particles):
+        if not rois:
+            continue
+        result = pack_panel([roi.shape[1] for roi in rois], [roi.shape[0] for roi in rois],
+                            layout.xpanelsize, layout.ypanelsize, pack)
+        for roi, x, y in zip(rois, result.x.tolist(), result.y.tolist()):
+            if x >= 0:
+                panels[panelind, y:y + roi.shape[0], x:x + roi.shape[1]] = roi
+        if count_written:
+            nwritten += result.placed
+        ndropped += result.dropped
+        if layout.panel_origin(panelind) is not None:
+            fill_efficiency.append(result.fill_efficiency)
+
+    # Page: white background, panels, scale bar, then the text
+    page_image = np.full((layout.imheight, layout.imwidth), 255, dtype=np.uint8)
+    for ipanel in range(layout.numpanels):
+        origin = layout.panel_origin(ipanel)
+        if origin is not None:
+            x, y = origin
+            page_image[y:y + layout.ypanelsize, x:x + layout.xpanelsize] = panels[ipanel]
+    scale = millimeter_scale(res)
+    sch, scw = scale.shape
+    scale_x = int(layout.imwidth - (1000. / res + 1) - 2 * PAD)
+    scale_bottom = int(layout.imheight - (1000. / res + 1) / 20 - 2 * PAD)
+    scale_y = layout.imheight - scale_bottom - sch
+    page_image[scale_y:scale_y + sch, scale_x:scale_x + scw] = scale
+
+    image = Image.fromarray(page_image, 'L')
+    draw = ImageDraw.Draw(image)
+    headerpad = layout.headerpad
+    header_font = load_font(max(int(CHARSIZE_PIXELS * headerpad / 70), 1))
+    label_font = load_font(max(int(CHARSIZE_PIXELS * headerpad / 100), 1))
+    unit = 'minute' if not layout.hourly else 'hour'
+    step = 'seconds' if not layout.hourly else 'minutes'
+    timestr = f'{imagetime[0:4]}/{imagetime[4:6]}/{imagetime[6:8]} {imagetime[9:11]}:{imagetime[11:13]}:{imagetime[13:15]}'
+    lines = [
+        (0.3, 'Date/time: ' + timestr),
+        (0.5, f'Project: {project}  Probe: CPI   Resolution: {res:.2g} microns'),
+        (0.7, f'This image represents one {unit} of flight time, one panel every {layout.rate} {step}.'),
+        (0.9, 'Many more images are not shown.  Contact PI or see raw data for complete imagery.'),
+    ]
+    for fraction, text in lines:
+        draw.text((2 * PAD, fraction * headerpad), text, fill=0, font=header_font, anchor='ls')
+    draw.text((layout.imwidth - scw / 2 - 2 * PAD, sch + 4 * PAD), '1 mm', fill=0, font=label_font, anchor='ms')
+    for ipanel in range(layout.numpanels):
+        origin = layout.panel_origin(ipanel)
+        if origin is not None:
+            x, y = origin
+            draw.text((x + 10, y + 35), str(layout.rate * ipanel), fill=255, font=label_font, anchor='ls')
+
+    image.save(pngfile)
+    return pngfile, nparticles, nwritten, ndropped, fill_efficiency
+
+
+def cpi_imagedump(fn, jailbars=False, res=2.3, rate=5, numcolumns=4, xpanelsize=1200, ypanelsize=1000,
+                  project='project', pack=1, outdir='', naming_convention='standard', hourly=False,
+                  version='v01', nproc=None):
+    """
+    Write the collage pages of the roi files 'fn' (list, in time order),
+    one page per worker. Returns (number of particles, number written,
+    number of focused particles that did not fit in their panel).
+    """
+    if pack not in PACK_METHODS:
+        raise ValueError(f'Unknown pack option {pack}, use one of {sorted(PACK_METHODS)}')
+    layout = CollageLayout(rate, numcolumns, xpanelsize, ypanelsize, hourly)
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    pages = collage_pages(list(fn), hourly)
+    render = partial(render_page, layout=layout, res=res, project=project, pack=pack, jailbars=jailbars,
+                     outdir=outdir, naming_convention=naming_convention, version=version)
+    nparticles = nwritten = ndropped = 0
+    fill_efficiency = []
+    with Pool(nproc) as pool:
+        for _, particles, written, dropped, efficiency in pool.imap_unordered(render, pages):
+            nparticles += particles
+            nwritten += written
+            ndropped += dropped
+            fill_efficiency.extend(efficiency)
+    print('Num Particles: ', nparticles, '   Num Written:', nwritten, '   Num Dropped:', ndropped)
+    if fill_efficiency:
+        print(f'Panel fill efficiency: mean {np.mean(fill_efficiency):.3f}, min {np.min(fill_efficiency):.3f}')
+    return nparticles, nwritten, ndropped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Make CPI particle collages (one PNG per minute or hour) from roi files.")
+    parser.add_argument("fn", nargs='+', help="roi files, in time order.")
+    parser.add_argument("-res", type=float, default=2.3, help="Probe resolution in microns, for the scale bar.")
+    parser.add_argument("-rate", type=int, default=5, help="Seconds between panels (minutes with -hourly).")
+    parser.add_argument("-numcolumns", type=int, default=4, help="Panel columns per page.")
+    parser.add_argument("-xpanelsize", type=int, default=1200, help="Panel width in pixels.")
+    parser.add_argument("-ypanelsize", type=int, default=1000, help="Panel height in pixels.")
+    parser.add_argument("-project", type=str, default='project', help="Project name for the header and GHRC file names.")
+    parser.add_argument("-pack", type=int, default=1, choices=sorted(PACK_METHODS), help="Particle packing in the panels: 0 corner, 1 height map, 2 shelf, 3 skyline, 4 maxrects.")
+    parser.add_argument("-outdir", type=str, default='', help="Output directory.")
+    parser.add_argument("-naming_convention", type=str, default='standard', choices=['standard', 'GHRC'], help="Output file names.")
+    parser.add_argument("-hourly", action="store_true", help="One page per hour rather than per minute.")
+    parser.add_argument("-jailbars", action="store_true", help="Correct the rare 'jailbars' failure (dark vertical streaks).")
+    parser.add_argument("-version", type=str, default='v01', help="Version in GHRC file names.")
+    parser.add_argument("-nproc", type=int, default=os.cpu_count(), help="Number of worker processes (default: all CPU cores).")
+    args = parser.parse_args()
+
+    cpi_imagedump(args.fn, jailbars=args.jailbars, res=args.res, rate=args.rate, numcolumns=args.numcolumns,
+                  xpanelsize=args.xpanelsize, ypanelsize=args.ypanelsize, project=args.project, pack=args.pack,
+                  outdir=args.outdir, naming_convention=args.naming_convention, hourly=args.hourly,
+                  version=args.version, nproc=args.nproc)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   cpi_packing.py
+#
+# Purpose:
+#   2-D rectangle packing of particle images into collage panels (the 'pack'
+#   option of cpi_imagedump.py / cpi_imagedump.pro). Takes the bounding box
+#   sizes of the particles of one panel (e.g. endx - startx + 1 and
+#   endy - starty + 1 from the hawkeye_roi particle index) and returns the
+#   top left position of every particle, the number that did not fit and
+#   how much of the panel is covered.
+#
+#   Methods (pack number in cpi_imagedump), n particles per panel:
+#     0 corner     every particle in the top left corner, on top of each
+#                  other and of the label (cpi_imagedump.pro)
+#     1 heightmap  column height map, online, in arrival order
+#                  (cpi_imagedump.pro 'homebrew' method), O(n * width)
+#     2 shelf      first fit shelves, O(n log n + n * shelves)
+#     3 skyline    bottom-left skyline, O(n * segments)
+#     4 maxrects   maximal free rectangles, best short side fit
+#                  (slowest), O(n * F^2) for F free rectangles
+#                  (containment pruning)
+#   Methods 2-4 sort the particles (shelf and skyline by height, maxrects
+#   by area), so they are packed as a whole panel rather than in arrival
+#   order. The 'order' of pack() chooses the sort:
+#     smallest     smallest first, the most particles in a full panel
+#     largest      largest first, the most covered area
+#     count        both, keeping the one that drops fewer particles
+#                  (largest first on ties); the default, twice the cost
+#   With largest first a few big particles fill a dense panel and many
+#   small ones are dropped. On dense synthetic panels (40-600 particles
+#   with a median size of 40-150 pixels in 1200 x 1000) smallest first
+#   skyline and maxrects placed more particles than heightmap; largest
+#   first placed fewer with every method. Skyline and maxrects scan plain
+#   lists, so no search structure is kept for the segments and free
+#   rectangles; smallest first leaves more free rectangles, which makes
+#   maxrects slow for the largest panels (about 1 s for 600 particles).
+#   Methods 1-4 keep the top left LABEL_WIDTH x LABEL_HEIGHT pixels free
+#   for the panel's seconds label.
+#
+#   The fill efficiency counts the panel pixels covered by at least one
+#   particle, so overlapping particles (corner, the one row overlap of
+#   heightmap) are not counted twice and it is at most 1.
+#
+# Syntax:
+#   from cpi_packing import pack
+#
+#   result = pack(widths, heights, 1200, 1000, method='skyline', order='count')
+#   result.x, result.y          # position of each particle (-1 if dropped)
+#   result.dropped              # number of particles that did not fit
+#   result.fill_efficiency      # covered area / panel area
+#
+# Modification History:
+#   2026/10/18
+#     Written, corner and height map packing moved from cpi_imagedump.py.
+#     Fill efficiency from the covered area (overlaps counted once).
+#     Smallest first and count (best of smallest and largest first) orders;
+#     count is the default, largest first dropped most particles of dense
+#     panels.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+from collections import namedtuple
+import numpy as np
+from scipy import ndimage
+
+# Top left of each panel is kept free for the seconds label
+LABEL_WIDTH = 61
+LABEL_HEIGHT = 40
+
+PackingResult = namedtuple('PackingResult', [
+    'x', 'y', 'placed', 'dropped', 'placed_area', 'fill_efficiency', 'used_height', 'density'
+])
+PackingResult.__doc__ = """Positions (x, y, -1 for dropped particles) in input order,
+number placed/dropped, total placed particle area, covered area (overlaps
+counted once) over panel area, lowest row used and covered area over the used
+part of the panel (width x used_height)."""
+
+
+def pack_corner(widths, heights, panel_width, panel_height):
+    """
+    pack=0: every particle that fits goes in the top left corner, over the
+    label and the particles before it (only the last one stays visible).
+    """
+    fits = (widths <= panel_width) & (heights <= panel_height)
+    x = np.where(fits, 0, -1)
+    return x, x.copy()
+
+
+def pack_heightmap(widths, heights, panel_width, panel_height):
+    """
+    pack=1: keep the filled height of every panel column and put each
+    particle, in arrival order, at the lowest height where it fits without
+    any column to its right (up to one past its width) being higher. Does
+    not shift particles left over open gaps, tends to make 'towers'. As in
+    cpi_imagedump.pro consecutive particles overlap by one row.
+    """
+    x_out = np.full(len(widths), -1, dtype=np.int64)
+    y_out = np.full(len(widths), -1, dtype=np.int64)
+    yy = np.zeros(panel_width, dtype=np.int64)
+    yy[:LABEL_WIDTH] = LABEL_HEIGHT
+    for i, (w, h) in enumerate(zip(widths.tolist(), heights.tolist())):
+        n = panel_width - w  # candidate columns x: x + w < panel_width
+        if n <= 0:
+            continue
+        # Highest column in yy[x:x + w + 1] for every candidate x
+        window_max = ndimage.maximum_filter1d(yy, size=w + 1)[(w + 1) // 2:(w + 1) // 2 + n]
+        fits = np.zeros(panel_width, dtype=bool)
+        fits[:n] = (yy[:n] + h < panel_height) & (window_max <= yy[:n])
+        # Search from the lowest height up (ties: leftmost first)
+        order = np.argsort(yy, kind='stable')
+        candidates = order[fits[order]]
+        if len(candidates) == 0:
+            continue
+        x = int(candidates[0])
+        y = int(yy[x])
+        yy[x:x + w] = y + h - 1
+        x_out[i], y_out[i] = x, y
+    return x_out, y_out
+
+
+def pack_shelf(widths, heights, panel_width, panel_height, order=None):
+    """
+    pack=2: first fit shelves. Particles are taken in 'order' (default
+    tallest first) and each goes on the first shelf with room left and
+    tall enough; a new shelf is opened below the last one when none has.
+    The first shelf starts right of the label.
+    """
+    x_out = np.full(len(widths), -1, dtype=np.int64)
+    y_out = np.full(len(widths), -1, dtype=np.int64)
+    shelf_y, shelf_used, shelf_height = [], [], []
+    next_y = 0
+    if order is None:
+        order = np.argsort(-heights, kind='stable')
+    for i in order.tolist():
+        w, h = int(widths[i]), int(heights[i])
+        if w > panel_width:
+            continue
+        for s in range(len(shelf_y)):
+            if shelf_used[s] + w <= panel_width and h <= shelf_height[s]:
+                break
+        else:
+            s = None
+            if next_y + h <= panel_height and (next_y > 0 or LABEL_WIDTH + w <= panel_width):
+                shelf_y.append(next_y)
+                shelf_used.append(LABEL_WIDTH if next_y == 0 else 0)
+                # Shelves are as tall as their first particle
+                shelf_height.append(max(h, LABEL_HEIGHT) if next_y == 0 else h)
+                next_y += shelf_height[-1]
+                s = len(shelf_y) - 1
+        if s is None:
+            continue
+        x_out[i], y_out[i] = shelf_used[s], shelf_y[s]
+        shelf_used[s] += w
+    return x_out, y_out
+
+
+def pack_skyline(widths, heights, panel_width, panel_height, order=None):
+    """
+    pack=3: bottom-left skyline. The filled outline of the panel is kept as
+    segments (x, y, width); each particle (in 'order', default tallest
+    first) goes where its bottom edge would be highest on the page (lowest
+    y), leftmost on ties, and the segments it covers are replaced by its
+    bottom edge.
+    """
+    x_out = np.full(len(widths), -1, dtype=np.int64)
+    y_out = np.full(len(widths), -1, dtype=np.int64)
+    skyline = [[0, LABEL_HEIGHT, LABEL_WIDTH], [LABEL_WIDTH, 0, panel_width - LABEL_WIDTH]]
+    if order is None:
+        order = np.argsort(-heights, kind='stable')
+    for i in order.tolist():
+        w, h = int(widths[i]), int(heights[i])
+        best = None
+        for s in range(len(skyline)):
+            x = skyline[s][0]
+            if x + w > panel_width:
+                break
+            # Resting height: highest segment under [x, x + w)
+            y, covered, t = 0, 0, s
+            while covered < w:
+                y = max(y, skyline[t][1])
+                covered += skyline[t][2] if t > s else skyline[t][0] + skyline[t][2] - x
+                t += 1
+            if y + h <= panel_height and (best is None or y < best[1]):
+                best = (x, y, s)
+        if best is None:
+            continue
+        x, y, s = best
+        x_out[i], y_out[i] = x, y
+        # Replace the covered segments by the new bottom edge
+        new_skyline = skyline[:s] + [[x, y + h, w]]
+        for segment_x, segment_y, segment_w in skyline[s:]:
+            end = segment_x + segment_w
+            if end <= x + w:
+                continue
+            start = max(segment_x, x + w)
+            new_skyline.append([start, segment_y, end - start])
+        # Merge neighbours at the same height
+        skyline = [new_skyline[0]]
+        for segment in new_skyline[1:]:
+            if segment[1] == skyline[-1][1]:
+                skyline[-1][2] += segment[2]
+            else:
+                skyline.append(segment)
+    return x_out, y_out
+
+
+def _split_free(free, placed):
+    """Split maximal free rectangles (x, y, w, h) around a placed rectangle."""
+    px, py, pw, ph = placed
+    result = []
+    for fx, fy, fw, fh in free:
+        if px >= fx + fw or px + pw <= fx or py >= fy + fh or py + ph <= fy:
+            result.append((fx, fy, fw, fh))
+            continue
+        if px > fx:
+            result.append((fx, fy, px - fx, fh))
+        if px + pw < fx + fw:
+            result.append((px + pw, fy, fx + fw - px - pw, fh))
+        if py > fy:
+            result.append((fx, fy, fw, py - fy))
+        if py + ph < fy + fh:
+            result.append((fx, py + ph, fw, fy + fh - py - ph))
+    # Drop rectangles contained in another one
+    result = sorted(set(result), key=lambda r: -r[2] * r[3])
+    pruned = []
+    for r in result:
+        if not any(r[0] >= q[0] and r[1] >= q[1] and r[0] + r[2] <= q[0] + q[2]
+                   and r[1] + r[3] <= q[1] + q[3] for q in pruned):
+            pruned.append(r)
+    return pruned
+
+
+def pack_maxrects(widths, heights, panel_width, panel_height, order=None):
+    """
+    pack=4: maximal rectangles. Free space is kept as the list of maximal
+    free rectangles; each particle (in 'order', default largest area first)
+    goes in the free rectangle that leaves the shortest leftover side
+    (top/left first on ties).
+    """
+    x_out = np.full(len(widths), -1, dtype=np.int64)
+    y_out = np.full(len(widths), -1, dtype=np.int64)
+    free = _split_free([(0, 0, panel_width, panel_height)], (0, 0, LABEL_WIDTH, LABEL_HEIGHT))
+    if order is None:
+        order = np.argsort(-(widths.astype(np.int64) * heights), kind='stable')
+    for i in order.tolist():
+        w, h = int(widths[i]), int(heights[i])
+        best = None
+        for fx, fy, fw, fh in free:
+            if w <= fw and h <= fh:
+                score = (min(fw - w, fh - h), max(fw - w, fh - h), fy, fx)
+                if best is None or score < best[0]:
+                    best = (score, fx, fy)
+        if best is None:
+            continue
+        _, x, y = best
+        x_out[i], y_out[i] = x, y
+        free = _split_free(free, (x, y, w, h))
+    return x_out, y_out
+
+
+def covered_area(x, y, widths, heights, panel_width, panel_height):
+    """Panel pixels covered by at least one placed particle (2-D difference array)."""
+    placed = x >= 0
+    x0, y0 = x[placed], y[placed]
+    x1 = np.minimum(x0 + widths[placed], panel_width)
+    y1 = np.minimum(y0 + heights[placed], panel_height)
+    counts = np.zeros((panel_height + 1, panel_width + 1), dtype=np.int32)
+    np.add.at(counts, (y0, x0), 1)
+    np.add.at(counts, (y0, x1), -1)
+    np.add.at(counts, (y1, x0), -1)
+    np.add.at(counts, (y1, x1), 1)
+    return int(np.count_nonzero(counts.cumsum(axis=0).cumsum(axis=1)[:panel_height, :panel_width]))
+
+
+METHODS = {
+    'corner': pack_corner,
+    'heightmap': pack_heightmap,
+    'shelf': pack_shelf,
+    'skyline': pack_skyline,
+    'maxrects': pack_maxrects,
+}
+
+# cpi_imagedump 'pack' numbers
+PACK_METHODS = {0: 'corner', 1: 'heightmap', 2: 'shelf', 3: 'skyline', 4: 'maxrects'}
+
+# Sort key of the methods that pack a whole panel
+SORT_KEYS = {
+    'shelf': lambda widths, heights: heights,
+    'skyline': lambda widths, heights: heights,
+    'maxrects': lambda widths, heights: widths * heights,
+}
+
+ORDERS = ('count', 'smallest', 'largest')
+
+
+def place(widths, heights, panel_width, panel_height, method, order='count'):
+    """Positions (x, y) of the particles with 'method' and sort 'order' (see ORDERS)."""
+    if order not in ORDERS:
+        raise ValueError(f'Unknown packing order {order}, use one of {list(ORDERS)}')
+    if method not in SORT_KEYS:
+        return METHODS[method](widths, heights, panel_width, panel_height)
+    key = SORT_KEYS[method](widths, heights)
+    if order != 'smallest':
+        x, y = METHODS[method](widths, heights, panel_width, panel_height,
+                               order=np.argsort(-key, kind='stable'))
+        if order == 'largest':
+            return x, y
+    small_x, small_y = METHODS[method](widths, heights, panel_width, panel_height,
+                                       order=np.argsort(key, kind='stable'))
+    if order == 'smallest' or np.count_nonzero(small_x >= 0) > np.count_nonzero(x >= 0):
+        return small_x, small_y
+    return x, y
+
+
+def pack(widths, heights, panel_width, panel_height, method='heightmap', order='count'):
+    """
+    Place particles of the given bounding box sizes in one panel with
+    'method' (a METHODS name or a PACK_METHODS number) and, for the methods
+    that sort the particles, 'order' (see ORDERS). Returns a PackingResult;
+    positions are in input order.
+    """
+    method = PACK_METHODS.get(method, method)
+    if method not in METHODS:
+        raise ValueError(f'Unknown packing method {method}, use one of {sorted(METHODS)}')
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+    x, y = place(widths, heights, panel_width, panel_height, method, order)
+
+    placed = x >= 0
+    placed_area = int((widths[placed] * heights[placed]).sum())
+    covered = covered_area(x, y, widths, heights, panel_width, panel_height)
+    used_height = int((y[placed] + heights[placed]).max()) if placed.any() else 0
+    return PackingResult(
+        x, y, int(placed.sum()), int((~placed).sum()), placed_area,
+        covered / float(panel_width * panel_height),
+        used_height,
+        covered / float(panel_width * used_height) if used_height else 0.0,
+    )
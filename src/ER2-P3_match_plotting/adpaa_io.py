@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   adpaa_io.py
+#
+# Purpose:
+#   Fast readers for ADPAA (NASA Ames 1001 style) flat files such as the
+#   Hawkeye-CPI particle classification files (*.HawkeyeCPI.classify.merged.raw).
+#   The header gives the number of header lines, the missing value of each
+#   column and the column names (last header line); the data are parsed with
+#   the pandas C parser into typed columns and cached as a .npz file next to
+#   the source, so loading the same file again takes milliseconds. The cache
+#   is rebuilt whenever the source file's size or modification time changes.
+#
+# Syntax:
+#   from adpaa_io import read_classify
+#
+#   data_cpi_pd = read_classify('22_01_19_123000-125225.HawkeyeCPI.classify.merged.raw')
+#       DataFrame with 'sfm' (float64), habit flags such as 'ChainAgg' and
+#       'CappedColumn' as uint8 (0/1, missing -> 0) and the other columns as
+#       float64 (missing -> NaN).
+#
+#   campaign = read_classify_files(filenames)
+#       All files in one table, with a 'flight' column.
+#
+#   table = read_flat_file('file.raw', flags=None, time=False)
+#       Any ADPAA flat file, or comma separated ICARTT (.ict) file; all
+#       columns float64 unless listed in 'flags'. time=True adds a 'time'
+#       column (datetime64[ns]) from the first column (seconds from
+#       midnight) and the date of the data on header line 7.
+#
+#   hvps = read_hvps('22_01_19_12_00_00.HVPS3_Horizontal.conc.1Hz')
+#       All columns of an HVPS-3 1 Hz concentration file, 'time' and the
+#       'Mean_Diameter' (um) and 'N_Conc' (# m-3) columns (0 -> NaN).
+#
+#   nav = read_nav('IMPACTS_MetNav_P3B_20220119_R0.ict')
+#       P-3 MetNav ICARTT file with a 'time' column.
+#
+#   The number of header lines is the first number of the file; when the
+#   first line does not start with it, the header is taken to end at the
+#   first line of numbers that the following lines match in field count.
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#     Added header length detection, the 'time' column, read_hvps and
+#     read_nav.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import os
+import re
+import numpy as np
+import pandas as pd
+from time_align import sfm_to_datetime64
+
+CACHE_SUFFIX = '.cache.npz'
+CACHE_VERSION = 1
+
+# Used when a header does not give its own missing values
+MISSING_VALUE = 99999.999
+
+# Column names of the Hawkeye-CPI classification files, used when the file
+# header does not list them
+CLASSIFY_COLUMNS = ['sfm', 'ImageNum', 'Plate', 'Skeleton_Plate', 'Sectored_Plate', 'SidePlane', 'Dendrite',
+                    'Column', 'Hollow_Column', 'Sheath', 'CappedColumn', 'Needle', 'Frozen_droplet', 'Bullet_rosette',
+                    'Graupel', 'Irregular', 'Droplet', 'Aggregate', 'Rimed', 'Pristine', 'Shattering', 'Multiple', 'Cutoff',
+                    'Elongated', 'ChainAgg', 'Sublimating', 'Empty', 'ConfidenceLevel', 'InterestingFlag']
+
+# Classification columns that are values rather than 0/1 habit flags
+CLASSIFY_VALUE_COLUMNS = ('sfm', 'ImageNum', 'ConfidenceLevel')
+
+# Column positions in the HVPS-3 1 Hz concentration files
+HVPS_MEAN_DIAMETER = -7
+HVPS_CONCENTRATION = -9
+
+# Data lines checked when looking for the end of a header without a line count
+HEADER_CHECK_LINES = 3
+
+
+def split_fields(line):
+    """Fields of a header line, comma (ICARTT) or white space (ADPAA) separated."""
+    if ',' in line:
+        return [field.strip() for field in line.split(',')]
+    return line.split()
+
+
+def is_data_line(line):
+    """True for a line of numbers only."""
+    fields = split_fields(line)
+    try:
+        [float(field) for field in fields]
+    except ValueError:
+        return False
+    return len(fields) > 0
+
+
+def detect_header_length(filename):
+    """
+    Number of header lines of a flat file without a line count: lines before
+    the first line of numbers that is followed by HEADER_CHECK_LINES - 1
+    lines of numbers with the same number of fields.
+    """
+    with open(filename, 'r', errors='replace') as file:
+        lines = [line.rstrip('\n') for line in file]
+    for i, line in enumerate(lines):
+        if not is_data_line(line):
+            continue
+        count = len(split_fields(line))
+        following = lines[i + 1:i + HEADER_CHECK_LINES]
+        if all(is_data_line(other) and len(split_fields(other)) == count for other in following):
+            return i
+    raise ValueError(f'No data lines found in {filename}')
+
+
+def header_length(filename, first):
+    """Header length from the first line ('NLHEAD FFI'), else detected from the data."""
+    fields = [field for field in re.split(r'[,\s]+', first.strip()) if field]
+    try:
+        nlhead = int(fields[0])
+        if nlhead > 0 and len(fields) <= 3:
+            return nlhead
+    except (IndexError, ValueError):
+        pass
+    return detect_header_length(filename)
+
+
+def header_date(header):
+    """Date of the data (header line 7, 'YYYY MM DD ...') as datetime64[D], or None."""
+    try:
+        year, month, day = (int(float(field)) for field in split_fields(header['lines'][6])[:3])
+        return np.datetime64(f'{year:04d}-{month:02d}-{day:02d}')
+    except (IndexError, ValueError):
+        return None
+
+
+def read_header(filename, nlhead=None):
+    """
+    Parse the header of an ADPAA/Ames 1001 or ICARTT flat file. Returns a
+    dict with 'nlhead' (number of header lines), 'lines' (the header lines),
+    'names' (fields of the last header line), 'missing' (missing value of
+    each dependent variable, or None if the header has none) and
+    'delimiter' (',' for ICARTT files, None for white space).
+    """
+    with open(filename, 'r', errors='replace') as file:
+        first = file.readline()
+        if nlhead is None:
+            nlhead = header_length(filename, first)
+        lines = [first.rstrip('\n')] + [file.readline().rstrip('\n') for _ in range(nlhead - 1)] if nlhead else []
+
+    missing = None
+    try:
+        # Ames 1001: line 10 is the number of variables, line 12 their missing values
+        nv = int(split_fields(lines[9])[0])
+        missing = [float(value) for value in split_fields(lines[11])]
+        if len(missing) != nv:
+            missing = None
+    except (IndexError, ValueError):
+        pass
+    return {'nlhead': nlhead, 'lines': lines, 'names': split_fields(lines[-1]) if lines else [], 'missing': missing,
+            'delimiter': ',' if ',' in first else None}
+
+
+def cache_filename(filename):
+    """Cache path for a flat file (file.raw.cache.npz)."""
+    return filename + CACHE_SUFFIX
+
+
+def cache_options(names=None, nlhead=None, flags=None, time=False):
+    """Reader options stored with a cache; a cache is only used for the same options."""
+    return repr((list(names) if names is not None else None, nlhead, sorted(flags or ()), bool(time)))
+
+
+def read_cache(filename, options=''):
+    """
+    DataFrame stored in the cache of 'filename', or None if there is no cache,
+    it was written with other reader options or it no longer matches the
+    source's size and modification time.
+    """
+    try:
+        status = os.stat(filename)
+        with np.load(cache_filename(filename)) as cache:
+            if (int(cache['cache_version']) != CACHE_VERSION
+                    or int(cache['source_size']) != status.st_size
+                    or int(cache['source_mtime_ns']) != status.st_mtime_ns
+                    or str(cache['options']) != options):
+                return None
+            columns = [str(name) for name in cache['columns']]
+            return pd.DataFrame({name: cache[f'column_{i}'] for i, name in enumerate(columns)})
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def write_cache(filename, table, options=''):
+    """Write a DataFrame as the columnar .npz cache of 'filename'."""
+    status = os.stat(filename)
+    cache = cache_filename(filename)
+    temporary = cache + '.tmp'
+    with open(temporary, 'wb') as file:
+        np.savez(file, cache_version=CACHE_VERSION, source_size=status.st_size,
+                 source_mtime_ns=status.st_mtime_ns, options=options, columns=np.asarray(table.columns, dtype=str),
+                 **{f'column_{i}': table[name].to_numpy() for i, name in enumerate(table.columns)})
+    os.replace(temporary, cache)
+
+
+def parse_flat_file(filename, names=None, nlhead=None, flags=None, time=False):
+    """
+    Read an ADPAA flat file (no cache). Column names come from the last
+    header line, or from 'names' when the header does not have the right
+    number. Missing values become NaN; columns in 'flags' are stored as
+    uint8 0/1 (missing -> 0). time=True adds the 'time' column.
+    """
+    header = read_header(filename, nlhead)
+    if header['delimiter']:
+        data = pd.read_csv(filename, sep=header['delimiter'], skipinitialspace=True, header=None,
+                           skiprows=header['nlhead'], dtype=np.float64, engine='c')
+    else:
+        data = pd.read_csv(filename, sep=r'\s+', header=None, skiprows=header['nlhead'],
+                           dtype=np.float64, engine='c')
+    ncols = data.shape[1]
+    if len(header['names']) == ncols:
+        columns = header['names']
+    elif names is not None and len(names) == ncols:
+        columns = list(names)
+    else:
+        columns = [f'column_{i}' for i in range(ncols)]
+    data.columns = columns
+
+    # One missing value per dependent variable (not the independent first column)
+    if header['missing'] is not None and len(header['missing']) == ncols - 1:
+        missing = [None] + header['missing']
+    else:
+        missing = [None] + [MISSING_VALUE] * (ncols - 1)
+
+    flags = set(flags or ())
+    table = {}
+    for name, missing_value in zip(columns, missing):
+        values = data[name].to_numpy()
+        # Exact match: both come from the same decimal text
+        is_missing = values == missing_value if missing_value is not None else np.zeros(len(values), bool)
+        if name in flags:
+            table[name] = ((values == 1) & ~is_missing).astype(np.uint8)
+        else:
+            table[name] = np.where(is_missing, np.nan, values)
+
+    if time:
+        date = header_date(header)
+        if date is None:
+            raise ValueError(f'No date on header line 7 of {filename}')
+        table['time'] = sfm_to_datetime64(table[columns[0]], date)
+    return pd.DataFrame(table)
+
+
+def read_flat_file(filename, names=None, nlhead=None, flags=None, cache=True, time=False):
+    """
+    Read an ADPAA flat file (see parse_flat_file), from its .npz cache when
+    that is up to date, otherwise parsed and then cached for next time.
+    """
+    options = cache_options(names, nlhead, flags, time)
+    if cache:
+        table = read_cache(filename, options)
+        if table is not None:
+            return table
+    table = parse_flat_file(filename, names, nlhead, flags, time)
+    if cache:
+        try:
+            write_cache(filename, table, options)
+        except OSError as error:
+            print(f"Could not write cache for {filename}: {error}")
+    return table
+
+
+def read_classify(filename, cache=True):
+    """
+    Read a Hawkeye-CPI classification file (*.HawkeyeCPI.classify.merged.raw).
+    Habit columns are uint8 0/1 flags, 'sfm', 'ImageNum' and
+    'ConfidenceLevel' are float64 with NaN for missing values.
+    """
+    # Header names are used when present, else CLASSIFY_COLUMNS
+    names = set(read_header(filename)['names']) | set(CLASSIFY_COLUMNS)
+    flags = [name for name in names if name not in CLASSIFY_VALUE_COLUMNS]
+    return read_flat_file(filename, names=CLASSIFY_COLUMNS, flags=flags, cache=cache)
+
+
+def read_classify_files(filenames, cache=True):
+    """
+    Read several classification files into one table, with a 'flight'
+    column (categorical, the file name up to the first '.') saying which
+    file each particle came from.
+    """
+    tables = []
+    for filename in filenames:
+        table = read_classify(filename, cache=cache)
+        table['flight'] = os.path.basename(filename).split('.')[0]
+        tables.append(table)
+    table = pd.concat(tables, ignore_index=True)
+    table['flight'] = table['flight'].astype('category')
+    return table
+
+
+def read_hvps(filename, cache=True):
+    """
+    Read an HVPS-3 1 Hz concentration file (*.HVPS3_Horizontal.conc.1Hz):
+    all columns, 'time', and 'Mean_Diameter' (um) and 'N_Conc' (# m-3)
+    taken from their column positions, with 0 and negative diameters as NaN.
+    """
+    table = read_flat_file(filename, cache=cache, time=True)
+    columns = [name for name in table.columns if name != 'time']
+    diameter = table[columns[HVPS_MEAN_DIAMETER]].to_numpy()
+    concentration = table[columns[HVPS_CONCENTRATION]].to_numpy()
+    table['Mean_Diameter'] = np.where(diameter > 0, diameter, np.nan)
+    table['N_Conc'] = np.where(concentration == 0, np.nan, concentration)
+    return table
+
+
+def read_nav(filename, cache=True):
+    """Read a P-3 MetNav ICARTT file (*.ict), all columns and 'time'."""
+    return read_flat_file(filename, cache=cache, time=True)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   cpi_habits.py
+#
+# Purpose:
+#   Derived habit categories for Hawkeye-CPI classification tables (from
+#   adpaa_io.read_classify). Each category is a named expression over the
+#   0/1 habit flag columns, evaluated on the whole table at once (no row
+#   loop), so the categories of every flight can be derived in one pass over
+#   a table holding all flights. Categories are tried in order and, when
+#   exclusive, a particle belongs to the first category it matches only:
+#
+#     Chain_Aggregate      ChainAgg == 1
+#     Generic_Aggregate    Aggregate == 1 (and not a chain aggregate)
+#     Individual_CapCol    CappedColumn == 1 (and not in any aggregate)
+#
+#   Each category adds a uint8 0/1 column; 'Habit_Category' holds the index
+#   of the category of each particle (-1 for none).
+#
+#   This changes Individual_CapCol from the row loop of the original match
+#   script, which counted a capped column as individual unless it was
+#   flagged as both a chain aggregate and an aggregate. Capped columns in a
+#   generic aggregate (Aggregate only) or flagged ChainAgg only were
+#   individual there and are not here; Chain_Aggregate and Generic_Aggregate
+#   were the raw ChainAgg and Aggregate flags. LEGACY_CATEGORIES with
+#   exclusive=False gives the old counts, to regenerate past results.
+#
+# Syntax:
+#   from cpi_habits import derive_habits
+#
+#   data_cpi_pd = derive_habits(read_classify(filename))
+#   campaign = derive_habits(read_classify_files(filenames))
+#
+#   Other categories, in a text file with one 'name = expression' per line
+#   (pandas.DataFrame.eval syntax, '#' starts a comment):
+#     categories = read_habit_categories('habits.txt')
+#     data_cpi_pd = derive_habits(data_cpi_pd, categories)
+#
+#   Categories of the original match script:
+#     data_cpi_pd = derive_habits(data_cpi_pd, LEGACY_CATEGORIES, exclusive=False)
+#
+# Modification History:
+#   2026/10/18
+#     Written, replaces the row loop computing Individual_CapCol in
+#     CRS-vel-dbz_CPL_P3-micro_match_20250422.py.
+#     Added LEGACY_CATEGORIES, the categories of that loop.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import numpy as np
+
+# (name, expression) in priority order
+HABIT_CATEGORIES = [
+    ('Chain_Aggregate', 'ChainAgg == 1'),
+    ('Generic_Aggregate', 'Aggregate == 1'),
+    ('Individual_CapCol', 'CappedColumn == 1'),
+]
+
+# The original match script (use with exclusive=False): raw flags, and a
+# capped column is individual unless flagged both ChainAgg and Aggregate
+LEGACY_CATEGORIES = [
+    ('Chain_Aggregate', 'ChainAgg == 1'),
+    ('Generic_Aggregate', 'Aggregate == 1'),
+    ('Individual_CapCol', '(CappedColumn == 1) & ~((ChainAgg == 1) & (Aggregate == 1))'),
+]
+
+CATEGORY_COLUMN = 'Habit_Category'
+
+
+def read_habit_categories(filename):
+    """Read 'name = expression' lines into a category list."""
+    categories = []
+    with open(filename) as file:
+        for line in file:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            name, separator, expression = line.partition('=')
+            if not separator or not name.strip() or not expression.strip():
+                raise ValueError(f"Bad habit category line in {filename}: '{line}'")
+            categories.append((name.strip(), expression.strip()))
+    return categories
+
+
+def derive_habits(table, categories=HABIT_CATEGORIES, exclusive=True):
+    """
+    Add a uint8 0/1 column per category and the 'Habit_Category' index
+    column to 'table' (modified in place and returned). With exclusive=False
+    every category is evaluated independently and 'Habit_Category' is the
+    first match.
+    """
+    claimed = np.zeros(len(table), dtype=bool)
+    codes = np.full(len(table), -1, dtype=np.int8)
+    for k, (name, expression) in enumerate(categories):
+        match = np.array(table.eval(expression), dtype=bool)
+        if exclusive:
+            match &= ~claimed
+        codes[match & (codes < 0)] = k
+        claimed |= match
+        table[name] = match.astype(np.uint8)
+    table[CATEGORY_COLUMN] = codes
+    return table
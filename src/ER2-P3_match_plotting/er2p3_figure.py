@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   er2p3_figure.py
+#
+# Purpose:
+#   The six panel ER-2/P-3 match figure, for one case
+#   (CRS-vel-dbz_CPL_P3-micro_match_20250422.py) or as quicklooks of many
+#   coordinated legs in one process:
+#
+#     HVPS-3B mean diameter and concentration   CRS Doppler velocity (P-3 temperature)
+#     CPL log10(beta 532)                       CRS reflectivity
+#     CPL depolarization ratio                  CRS linear depolarization ratio
+#
+#   with the P-3 track and the chain aggregate percentage (5 s around each
+#   P-3 point) over the CPL and CRS reflectivity/LDR panels. MatchFigure
+#   builds the proplot figure, axes, titles, tick formatting and colorbars
+#   once; for every case only the data artists are replaced (curtains) or
+#   updated in place (lines, scatters) before the figure is saved, so the
+#   figure setup, fonts and colormaps are paid for once per run.
+#
+# Syntax:
+#   ./er2p3_figure.py cases.txt -outdir figures -formats png pdf \
+#       -er2_dir /data/IMPACTS/ER2_Data -p3_dir /data/IMPACTS/aircraft_data
+#
+#   from er2p3_figure import MatchFigure, case_panels
+#
+#   figure = MatchFigure()
+#   for case in read_cases('cases.txt'):
+#       figure.update(case_panels(case))
+#       figure.save('figures', ('png', 'pdf'))
+#   figure.save_as('leg.png')
+#
+#   Options:
+#       -outdir  : figure directory (figures); files are
+#                  <YYYYMMDD_HHMMSS-HHMMSS>_CRS-CPL-P3_match.<format>
+#       -formats : figure formats (png)
+#       -dpi     : resolution (300)
+#       -er2_dir, -p3_dir, -cache_dir, -format : as er2p3_match.py
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#     HVPS read with adpaa_io.read_hvps (cached).
+#     Chain aggregate overlay counted with window_counts.WindowCounts.
+#     Also draws the single case figure of the match script (case_panels
+#     takes an existing match and -refresh, save_as).
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import argparse
+import glob
+import os
+import sys
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import matplotlib.axes
+import matplotlib.dates as mdates
+import matplotlib.ticker as ticker
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.ticker import LogLocator, LogFormatterMathtext
+from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+import proplot as pplt
+from adpaa_io import read_classify_files, read_hvps
+from er2p3_match import (CACHE_SUFFIXES, ER2_DIR, IMPACTS_TOOLS, MATCH_PARAMETERS, P3_DIR, match_case,
+                         read_cases, subset_height)
+from time_align import TimeAxis
+from window_counts import WindowCounts
+from xsection_render import draw_xsection
+
+FIGURE_SUFFIX = '_CRS-CPL-P3_match'
+
+RC = dict(
+    suptitlesize=16, suptitleweight='bold', fontsize=14, ticklabelsize=14,
+    ticklen=8, ticklenratio=0.5, colorbarwidth='1em',
+    figurefacecolor='w', savefigtransparent=False
+)
+
+# Curtain panels: axes (row, column), plot keywords (levels, colormap and
+# colorbar), title and whether the P-3 track and chain aggregate overlay are
+# drawn on it
+Curtain = namedtuple('Curtain', ['position', 'keywords', 'title', 'overlay'])
+CURTAINS = {
+    'cpl_atb_532': Curtain((1, 0), dict(
+        levels=np.linspace(-4, 0, 41), cmap='radar_NWSRefEnhanced', cmap_kw={'left': 0.2, 'right': 0.9},
+        colorbar_kw={'pad': '0em', 'ticks': 1}), r'CPL log$_{10}$($\beta_{532}$ [km$^{-1}$ sr$^{-1}$])', True),
+    'cpl_dpol_1064': Curtain((2, 0), dict(
+        levels=np.linspace(0, 0.8, 400), cmap='jet', cmap_kw={'left': 0, 'right': 1},
+        colorbar_kw={'pad': '0em', 'ticks': np.linspace(0, 0.8, 5)}), 'CPL Depolarization Ratio [δ]', True),
+    'crs_vel': Curtain((0, 1), dict(
+        levels=np.linspace(-1.5, 1.5, 100), cmap='BuRd', cmap_kw={'left': 0, 'right': 1},
+        colorbar_kw={'pad': '0em', 'ticks': np.linspace(-1.5, 1.5, 3)}), r"CRS Doppler Velocity [m s$^{-1}$]", False),
+    'crs_dbz': Curtain((1, 1), dict(
+        levels=np.linspace(-30, 15, 100), cmap='viridis', cmap_kw={'left': 0, 'right': 1},
+        colorbar_kw={'pad': '0em', 'ticks': np.linspace(-30, 15, 6)}), 'CRS Reflectivity [dBZe]', True),
+    'crs_ldr': Curtain((2, 1), dict(
+        levels=np.linspace(-25, -17, 100), cmap='jet', cmap_kw={'left': 0, 'right': 1},
+        colorbar_kw={'pad': '0em', 'ticks': np.linspace(-25, -17, 5)}), 'CRS Linear Depolarization Ratio [db]', True),
+}
+
+# Chain aggregate overlay: colors, window around each P-3 point, colorbar ticks
+OVERLAY_COLORS = ["black", 'red', "blue", "magenta"]
+OVERLAY_WINDOW = '5s'
+OVERLAY_TICKS = [0, 10, 20, 30, 40, 50]
+OVERLAY_TICK_LABELS = ['0%', '10%', '20%', '30%', '40%', '>50%']
+
+# Data of one case for the figure: curtains {name: (times, heights km,
+# values (height, time))}, HVPS (DataFrame, Mean_Diameter and N_Conc_m3 at
+# the P-3 times), P-3 track times, altitude (km) and temperature, chain
+# aggregate overlay (DataFrame, percentage_chainagg and alt_gps km)
+CasePanels = namedtuple('CasePanels', ['case', 'curtains', 'hvps', 'track_time', 'track_alt',
+                                       'temperature', 'overlay'])
+
+
+def hvps_panel(filename):
+    """HVPS-3B 1 Hz mean diameter (um) and concentration (# m-3), indexed by time."""
+    hvps = read_hvps(filename)
+    return pd.DataFrame({'Mean_Diameter': hvps['Mean_Diameter'].to_numpy(), 'N_Conc_m3': hvps['N_Conc'].to_numpy()},
+                        index=pd.DatetimeIndex(hvps['time'], name='time'))
+
+
+def chain_percentages(data_cpi_pd, date, axis, altitude, window=OVERLAY_WINDOW):
+    """
+    Particles, chain aggregates and their percentage in 'window' around each
+    axis time (times without particles left out), with the P-3 altitude.
+    """
+    counts = WindowCounts(data_cpi_pd['sfm'].to_numpy(), date,
+                          {'chainagg_particles': data_cpi_pd['ChainAgg'].to_numpy()})
+    per_window = counts.around(axis, window)[['total_particles', 'chainagg_particles', 'percentage_chainagg']]
+    per_window['alt_gps'] = altitude
+    return per_window[per_window['total_particles'] > 0]
+
+
+def case_panels(case, er2_dir=ER2_DIR, p3_dir=P3_DIR, cache_dir='match_cache', fmt='netcdf', refresh=False,
+                matched=None):
+    """
+    Match (or read the cached match of) a case and collect the figure data;
+    'matched' is a match_case result already at hand.
+    """
+    if matched is None:
+        matched = match_case(case, er2_dir=er2_dir, p3_dir=p3_dir, cache_dir=cache_dir, fmt=fmt, refresh=refresh)
+    bottom, top = MATCH_PARAMETERS['plot_height_range']
+    cpl_l1b = subset_height(matched.cpl_l1b, bottom, top).load()
+    cpl_l2pro = subset_height(matched.cpl_l2pro, bottom, top).load()
+    crs = subset_height(matched.crs, bottom, top).load()
+
+    dbz = crs.dbz.values
+    dpol = cpl_l2pro.dpol_1064.values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        atb_532 = np.log10(np.where(np.isnan(dpol) | (dpol == 0), np.nan, cpl_l1b.atb_532.values))
+    crs_times, crs_heights = crs.time.values, crs.height.values / 1000.
+    curtains = {
+        'cpl_atb_532': (cpl_l1b.time.values, cpl_l1b.height.values / 1000., atb_532),
+        'cpl_dpol_1064': (cpl_l2pro.time.values, cpl_l2pro.height.values / 1000., dpol),
+        'crs_vel': (crs_times, crs_heights, crs.vel.values),
+        'crs_dbz': (crs_times, crs_heights, dbz),
+        'crs_ldr': (crs_times, crs_heights, np.where(np.isnan(dbz) | (dbz == 0), np.nan, crs.ldr.values)),
+    }
+
+    track_time = matched.match_crs.time_radar.values
+    track_alt = matched.match_cpl.alt_gps.values / 1000. # km
+    axis = TimeAxis(track_time, unique=True)
+
+    date = pd.Timestamp(case.date)
+    cpi_files = sorted(glob.glob(os.path.join(p3_dir, date.strftime('%y_%m_%d') + '_*.HawkeyeCPI.classify.merged.raw')))
+    if cpi_files:
+        overlay = chain_percentages(read_classify_files(cpi_files), date, axis, track_alt[axis.positions])
+    else:
+        print(f"{case.name}: no CPI classification files, no chain aggregate overlay")
+        overlay = pd.DataFrame({'percentage_chainagg': [], 'alt_gps': []}, index=pd.DatetimeIndex([]))
+
+    hvps_files = sorted(glob.glob(os.path.join(p3_dir, case.datestr, 'HVPS3B_Data',
+                                               date.strftime('%y_%m_%d') + '_*.HVPS3_Horizontal.conc.1Hz')))
+    if hvps_files:
+        hvps = axis.join(hvps_panel(hvps_files[0]), tolerance=0, how='inner')
+    else:
+        print(f"{case.name}: no HVPS file, no HVPS panel data")
+        hvps = pd.DataFrame({'Mean_Diameter': [], 'N_Conc_m3': []}, index=pd.DatetimeIndex([]))
+
+    return CasePanels(case, curtains, hvps, track_time, track_alt, matched.p3nav.temp.values, overlay)
+
+
+def plain(method, ax):
+    """matplotlib's own Axes method bound to 'ax' (skips proplot's data wrappers)."""
+    return getattr(matplotlib.axes.Axes, method).__get__(ax)
+
+
+def date_numbers(times):
+    """Times as matplotlib date numbers."""
+    return mdates.date2num(np.asarray(times, dtype='datetime64[ns]'))
+
+
+class MatchFigure:
+    """
+    The six panel ER-2/P-3 match figure, built once and updated with the
+    data of each case (update) before saving (save).
+    """
+
+    def __init__(self, dpi=300):
+        sys.path.append(IMPACTS_TOOLS)
+        from impacts_tools import radar_cmaps # registers the radar colormaps
+
+        pplt.rc.update(RC)
+        self.dpi = dpi
+        self.case = None
+        self.fig, self.axs = pplt.subplots(nrows=3, ncols=2, refwidth=5, refaspect=2.5,
+                                           sharey=False, sharex=False, dpi=dpi)
+        self.hvps_axes()
+
+        # Curtains: colorbars from a placeholder drawing, whose cmap and norm
+        # are reused for the data of every case
+        self.curtains, self.tracks, self.overlays = {}, [], []
+        overlay_cmap = LinearSegmentedColormap.from_list('high_contrast', OVERLAY_COLORS, N=100)
+        placeholder = (np.array(['2000-01-01T00:00:00', '2000-01-01T00:00:01'], dtype='datetime64[ns]'),
+                       np.array([8., 4.]), np.full((2, 2), np.nan))
+        for name, curtain in CURTAINS.items():
+            ax = self.axs[curtain.position]
+            mappable = draw_xsection(ax, *placeholder, rasterized=True, colorbar='r', **curtain.keywords)
+            self.curtains[name] = {'cmap': mappable.get_cmap(), 'norm': mappable.norm, 'artist': mappable}
+            ax.xaxis_date()
+            ax.set_ylim(4, 8)
+            ax.format(urtitle=curtain.title, titleweight='bold')
+            if curtain.overlay:
+                # Base flight track (thin black line) and the chain aggregate percentages
+                self.tracks.append(plain('plot', ax)([], [], color='black', linewidth=0.7, alpha=0.7, zorder=5)[0])
+                self.overlays.append(plain('scatter', ax)(
+                    [], [], c=[], s=[], cmap=overlay_cmap, vmin=0, vmax=50,
+                    edgecolors='black', linewidths=0.3, zorder=10
+                ))
+        for ax in (self.axs[1, 0], self.axs[2, 0], self.axs[0, 1]):
+            ax.set_ylabel('Altitude [km]')
+        for ax in (self.axs[1, 1], self.axs[2, 1]):
+            ax.set_ylabel('')
+
+        self.temperature_axes()
+
+        cbar_sc = self.fig.colorbar(
+            self.overlays[0], loc='bottom', label='Chain Aggregates [%]', length=0.3, width=0.15,
+            ticks=OVERLAY_TICKS, ticklabelsize=14, space=4
+        )
+        cbar_sc.set_ticks(OVERLAY_TICKS)
+        cbar_sc.ax.set_xticklabels(OVERLAY_TICK_LABELS)
+
+        for ax in self.axs:
+            ax.minorticks_on()
+            ax.xaxis.set_minor_locator(ticker.AutoMinorLocator(5))
+            ax.format(xformatter=mdates.DateFormatter('%H:%M'))
+        for ax in (self.axs[0, 0], self.axs[0, 1], self.axs[1, 0], self.axs[1, 1]):
+            ax.format(xticklabels=[])
+            ax.set_xlabel('')
+        self.fig.subplots_adjust(top=0.9, bottom=0.12)
+
+    def hvps_axes(self):
+        """HVPS-3B mean diameter (left axis) and concentration (right, log) panel."""
+        ax = self.axs[0, 0]
+        ax.xaxis_date()
+        self.diameter = plain('plot', ax)([], [], color="black", linewidth=1)[0]
+        ax.set_ylabel("")
+        ax.set_ylim(200, 1200)
+
+        ax2 = ax.twinx()
+        self.concentration = plain('plot', ax2)([], [], color='blue', linewidth=1)[0]
+        ax2.set_yscale('log')
+        ax2.set_ylim(1e0, 1e6)
+        ax2.yaxis.set_major_locator(LogLocator(base=10.0, subs=[1.0], numticks=10))
+        ax2.yaxis.set_major_formatter(LogFormatterMathtext())
+        ax2.yaxis.set_minor_locator(LogLocator(base=10.0, subs=np.arange(2, 10) * 0.1, numticks=100))
+        ax2.tick_params(axis='y', which='major', length=8, width=2.0, color='blue', labelsize=14, labelcolor='blue')
+        ax2.tick_params(axis='y', which='minor', length=4, color='blue')
+        ax2.set_ylabel('')
+        self.hvps_twin = ax2
+
+        ax.text(0.98, 0.96, "HVPS-3B Mean Diameter [μm]", fontsize=16, fontweight='bold', ha='right', va='top',
+                transform=ax.transAxes, color='black')
+        ax.text(0.98, 0.85, "HVPS-3B Total Concentration [# m$^{-3}$]", fontsize=16, fontweight='bold', ha='right',
+                va='top', transform=ax.transAxes, color='blue')
+
+    def temperature_axes(self):
+        """P-3 temperature along the track on the CRS velocity panel, colorbar above it."""
+        ax = self.axs[0, 1]
+        self.temperature = plain('scatter', ax)([], [], c=[], s=4, cmap='thermal', vmin=-31.5, vmax=-29.5, zorder=10)
+        cax_temp = inset_axes(
+            ax, width="100%", height="35%", loc='lower center',
+            bbox_to_anchor=(0.0, 1.0, 1.0, 0.25), bbox_transform=ax.transAxes, borderpad=0
+        )
+        self.temperature_colorbar = self.fig.colorbar(self.temperature, cax=cax_temp, orientation='horizontal')
+        self.temperature_colorbar.ax.xaxis.set_label_position('top')
+        self.temperature_colorbar.ax.xaxis.set_ticks_position('top')
+        self.temperature_colorbar.set_label('Temperature [°C]', labelpad=5)
+        self.temperature_colorbar.ax.tick_params(labelsize=14)
+
+    def update(self, panels):
+        """Put the data of one case (CasePanels) into the figure."""
+        self.case = panels.case
+        for name, (times, heights, values) in panels.curtains.items():
+            curtain = self.curtains[name]
+            ax = self.axs[CURTAINS[name].position]
+            curtain['artist'].remove()
+            curtain['artist'] = draw_xsection(ax, times, heights, values, plain=True, rasterized=True,
+                                              cmap=curtain['cmap'], norm=curtain['norm'])
+
+        self.diameter.set_data(date_numbers(panels.hvps.index), panels.hvps["Mean_Diameter"].to_numpy())
+        self.concentration.set_data(date_numbers(panels.hvps.index), panels.hvps["N_Conc_m3"].to_numpy())
+
+        track = np.column_stack([date_numbers(panels.track_time), panels.track_alt])
+        for line in self.tracks:
+            line.set_data(track[:, 0], track[:, 1])
+
+        # Temperature colorbar over the range of the leg (0.5 degree steps)
+        temperature = np.asarray(panels.temperature, dtype=np.float64)
+        self.temperature.set_offsets(track)
+        self.temperature.set_array(temperature)
+        if np.isfinite(temperature).any():
+            low = np.floor(np.nanmin(temperature) * 2) / 2
+            high = max(np.ceil(np.nanmax(temperature) * 2) / 2, low + 0.5)
+            self.temperature.set_clim(low, high)
+            self.temperature_colorbar.set_ticks(np.linspace(low, high, 3))
+
+        overlay = panels.overlay
+        offsets = np.column_stack([date_numbers(overlay.index), overlay['alt_gps'].to_numpy()])
+        percentage = overlay['percentage_chainagg'].to_numpy()
+        sizes = np.clip((percentage / 100) ** 0.8 * 600 + 40, 40, 350)
+        for scatter in self.overlays:
+            scatter.set_offsets(offsets)
+            scatter.set_array(percentage)
+            scatter.set_sizes(sizes)
+
+        start = date_numbers([self.case.start_time])[0]
+        end = date_numbers([self.case.end_time])[0]
+        for ax in self.axs:
+            ax.set_xlim(start, end)
+        for ax in (self.axs[2, 0], self.axs[2, 1]):
+            ax.set_xlabel(f'Time [UTC]\n({self.case.date})')
+
+    def save_as(self, filename):
+        """Save the current case to 'filename' (format from the extension)."""
+        self.fig.savefig(filename, dpi=self.dpi)
+        return filename
+
+    def save(self, outdir='figures', formats=('png',)):
+        """Save the current case in each format; returns the file names."""
+        os.makedirs(outdir, exist_ok=True)
+        return [self.save_as(os.path.join(outdir, f'{self.case.name}{FIGURE_SUFFIX}.{extension}'))
+                for extension in formats]
+
+
+def make_figures(cases, outdir='figures', formats=('png',), dpi=300, er2_dir=ER2_DIR, p3_dir=P3_DIR,
+                 cache_dir='match_cache', fmt='netcdf'):
+    """Figures of all cases with one MatchFigure; returns the cases that failed."""
+    figure = MatchFigure(dpi=dpi)
+    failed = []
+    for case in cases:
+        try:
+            figure.update(case_panels(case, er2_dir=er2_dir, p3_dir=p3_dir, cache_dir=cache_dir, fmt=fmt))
+        except (OSError, ValueError, KeyError) as error:
+            print(f"{case.name}: {error}")
+            failed.append(case)
+            continue
+        print(' '.join(figure.save(outdir, formats)))
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ER-2/P-3 match figures of many cases in one process.")
+    parser.add_argument("cases", help="Case file, one 'YYYY-MM-DD HH:MM:SS HH:MM:SS' per line.")
+    parser.add_argument("-outdir", type=str, default='figures', help="Figure directory.")
+    parser.add_argument("-formats", type=str, nargs='+', default=['png'], help="Figure formats (e.g. png pdf).")
+    parser.add_argument("-dpi", type=int, default=300, help="Figure resolution.")
+    parser.add_argument("-er2_dir", type=str, default=ER2_DIR, help="ER-2 data directory.")
+    parser.add_argument("-p3_dir", type=str, default=P3_DIR, help="P-3 data directory.")
+    parser.add_argument("-cache_dir", type=str, default='match_cache', help="Match cache directory.")
+    parser.add_argument("-format", type=str, default='netcdf', choices=sorted(CACHE_SUFFIXES), help="Cache file format.")
+    args = parser.parse_args()
+
+    failed = make_figures(read_cases(args.cases), outdir=args.outdir, formats=args.formats, dpi=args.dpi,
+                          er2_dir=args.er2_dir, p3_dir=args.p3_dir, cache_dir=args.cache_dir, fmt=args.format)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   er2p3_match.py
+#
+# Purpose:
+#   ER-2/P-3 matching of CPL and CRS data for a list of cases (date, start
+#   and end time of a coordinated leg), as done for one hard coded case in
+#   CRS-vel-dbz_CPL_P3-micro_match_20250422.py. The input files of a case are
+#   found by name under the ER-2 and P-3 data directories. The time subset
+#   CPL L1B (with cloud top properties, on the L2 profile times), CPL L2
+#   profile, CRS and P-3 navigation datasets and the matched CPL and CRS
+#   datasets are cached as NetCDF (or Zarr) files. The cache key covers the
+#   case, the input files (name, size, modification time) and the match
+#   parameters, so a rerun with the same inputs and parameters only reads
+#   the cache; impacts_tools is only imported when matching has to be done.
+#
+#   Only the gates that are plotted or can be matched are kept: the CPL and
+#   CRS data are cut to the plotted heights (4-8 km) plus the P-3 altitude
+#   range of the leg widened by the match distance threshold, before the
+#   nearest neighbour time alignment and the matching. Cached datasets are
+#   opened lazily (dask backed when dask is installed), so only the parts
+#   used, e.g. after subset_height(), are read into memory.
+#
+# Syntax:
+#   from er2p3_match import MatchCase, match_case
+#
+#   matched = match_case(MatchCase('2022-01-19', '12:31:00', '12:51:00'))
+#   matched.cpl_l1b, matched.cpl_l2pro, matched.crs, matched.p3nav,
+#   matched.match_cpl, matched.match_crs         (xarray Datasets, lazy)
+#   crs = subset_height(matched.crs, 4000., 8000.)
+#
+#   ./er2p3_match.py cases.txt -er2_dir /data/IMPACTS/ER2_Data \
+#       -p3_dir /data/IMPACTS/aircraft_data -cache_dir match_cache
+#
+#   cases.txt has one case per line ('#' starts a comment):
+#       2022-01-19 12:31:00 12:51:00
+#
+#   Options:
+#       -er2_dir   : ER-2 data, <er2_dir>/YYYYMMDD/CPL_Data and CRS_Data
+#       -p3_dir    : P-3 data with the MetNav ICARTT files
+#       -cache_dir : cache directory (match_cache)
+#       -format    : netcdf (default) or zarr
+#       -refresh   : redo the matching even if the cache is up to date
+#
+# Modification History:
+#   2026/10/18
+#     Written, matching moved from CRS-vel-dbz_CPL_P3-micro_match_20250422.py.
+#     CPL/CRS cut to the plotted and matchable heights before matching,
+#     nearest time alignment by index instead of interp, lazy cache reads.
+#     Nearest time alignment with time_align.TimeAxis.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+from collections import namedtuple
+import numpy as np
+import xarray as xr
+from time_align import TimeAxis
+
+IMPACTS_TOOLS = os.environ.get('IMPACTS_TOOLS', '/home/chains/Documents/phd/github_repos/impacts_tools/src')
+
+ER2_DIR = '/home/chains/Documents/phd/data/IMPACTS/ER2_Data'
+P3_DIR = '/home/chains/Documents/phd/data/IMPACTS/aircraft_data'
+
+# Input file name patterns ({datestr} = YYYYMMDD, {year} = YYYY); the last
+# match (highest version) is used
+INPUT_PATTERNS = {
+    'cpl_l1b': ('er2', '{datestr}/CPL_Data/IMPACTS_CPL_ATB_L1_{datestr}*.hdf5'),
+    'cpl_l2lay': ('er2', '{datestr}/CPL_Data/IMPACTS_CPL_L2_*_01kmLay_{datestr}*.hdf5'),
+    'cpl_l2pro': ('er2', '{datestr}/CPL_Data/IMPACTS_CPL_L2_*_01kmPro_{datestr}*.hdf5'),
+    'crs': ('er2', '{datestr}/CRS_Data/IMPACTS{year}_CRS_L1B_*_{datestr}*.h5'),
+    'p3nav': ('p3', 'IMPACTS_MetNav_P3B_{datestr}_*.ict'),
+}
+
+# Everything passed to er2.*, p3.P3 and match.*; part of the cache key
+MATCH_PARAMETERS = {
+    'p3_tres': '5S',
+    'crs_dbz_sigma': 1,
+    'crs_vel_sigma': 1,
+    'cpl_l1b': {'query_k': 30, 'dist_thresh': 5000., 'time_thresh': 600., 'qc': True},
+    'cpl_l2pro': {'query_k': 15, 'dist_thresh': 5000., 'time_thresh': 600., 'qc': False},
+    'crs': {'query_k': 30, 'dist_thresh': 5000., 'time_thresh': 600., 'qc': True},
+    'n_workers': 4,
+    # Heights kept for the plots (m); gates within the largest dist_thresh of
+    # the P-3 altitude range are also kept for the matching
+    'plot_height_range': [4000., 8000.],
+}
+
+DATASETS = ('cpl_l1b', 'cpl_l2pro', 'crs', 'p3nav', 'match_cpl', 'match_crs')
+
+# Bump when the matching code changes the cached datasets
+CACHE_VERSION = 2
+CACHE_SUFFIXES = {'netcdf': '.nc', 'zarr': '.zarr'}
+
+# Lazy cache reads: dask chunks if available, else xarray's lazy indexing
+CHUNKS = {} if importlib.util.find_spec('dask') else None
+
+MatchedCase = namedtuple('MatchedCase', ['case', 'key'] + list(DATASETS))
+
+
+class MatchCase(namedtuple('MatchCase', ['date', 'start', 'end'])):
+    """A coordinated leg: date 'YYYY-MM-DD', start and end 'HH:MM:SS' (UTC)."""
+
+    @property
+    def datestr(self):
+        return self.date.replace('-', '')
+
+    @property
+    def start_time(self):
+        return np.datetime64(f'{self.date}T{self.start}')
+
+    @property
+    def end_time(self):
+        end = np.datetime64(f'{self.date}T{self.end}')
+        # Legs past midnight
+        return end + np.timedelta64(1, 'D') if end <= self.start_time else end
+
+    @property
+    def name(self):
+        return f"{self.datestr}_{self.start.replace(':', '')}-{self.end.replace(':', '')}"
+
+
+def read_cases(filename):
+    """Cases from a text file, one 'YYYY-MM-DD HH:MM:SS HH:MM:SS' per line."""
+    cases = []
+    with open(filename) as file:
+        for line in file:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 3:
+                raise ValueError(f"Bad case line in {filename}: '{line.strip()}'")
+            cases.append(MatchCase(*fields))
+    return cases
+
+
+def find_case_files(case, er2_dir=ER2_DIR, p3_dir=P3_DIR):
+    """Input file of each INPUT_PATTERNS entry for a case."""
+    roots = {'er2': er2_dir, 'p3': p3_dir}
+    inputs, missing = {}, []
+    for name, (root, pattern) in INPUT_PATTERNS.items():
+        pattern = os.path.join(roots[root], pattern.format(datestr=case.datestr, year=case.date[:4]))
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            inputs[name] = matches[-1]
+        else:
+            missing.append(pattern)
+    if missing:
+        raise FileNotFoundError(f'No input files for {case.name}: ' + ', '.join(missing))
+    return inputs
+
+
+def cache_key(case, inputs, parameters=MATCH_PARAMETERS):
+    """Hash of the case, input files (name, size, mtime) and parameters."""
+    files = {}
+    for name, path in sorted(inputs.items()):
+        status = os.stat(path)
+        files[name] = [os.path.basename(path), status.st_size, status.st_mtime_ns]
+    description = json.dumps({'version': CACHE_VERSION, 'case': list(case), 'inputs': files,
+                              'parameters': parameters}, sort_keys=True)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def cache_path(cache_dir, case, key, name, fmt='netcdf'):
+    return os.path.join(cache_dir, f'{case.name}_{key}_{name}{CACHE_SUFFIXES[fmt]}')
+
+
+def read_cached(cache_dir, case, key, fmt='netcdf'):
+    """Cached datasets of a case (dict, opened lazily), or None if any is missing."""
+    paths = {name: cache_path(cache_dir, case, key, name, fmt) for name in DATASETS}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    engine = 'zarr' if fmt == 'zarr' else None
+    return {name: xr.open_dataset(path, engine=engine, chunks=CHUNKS) for name, path in paths.items()}
+
+
+def subset_height(dataset, bottom, top):
+    """
+    Gates of a CPL (1-D 'height') or CRS (2-D 'height' over range and time)
+    dataset between bottom and top (m), selected by index so lazy data stay
+    lazy.
+    """
+    if 'height' not in dataset:
+        return dataset
+    height = dataset['height']
+    inside = (height >= bottom) & (height <= top)
+    if height.ndim == 1:
+        dim = height.dims[0]
+    else:
+        dim = [d for d in height.dims if d != 'time'][0]
+        inside = inside.any('time')
+    return dataset.isel({dim: inside.values})
+
+
+def nearest_times(dataset, times):
+    """
+    'dataset' at the nearest of its times to 'times' (NaN further than one
+    time step away), an index lookup replacing interp(method='nearest').
+    """
+    step = np.median(np.diff(dataset.time.values))
+    axis = TimeAxis(times)
+    index = axis.nearest(dataset.time.values, tolerance=step)
+    aligned = dataset.isel(time=np.maximum(index, 0)).assign_coords(time=axis.times)
+    return aligned.where(xr.DataArray(index >= 0, coords={'time': axis.times}, dims='time'))
+
+
+def write_cached(cache_dir, case, key, datasets, fmt='netcdf'):
+    """Cache the datasets of a case and remove caches of the case with other keys."""
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, dataset in datasets.items():
+        path = cache_path(cache_dir, case, key, name, fmt)
+        temporary = path + '.tmp'
+        if fmt == 'zarr':
+            shutil.rmtree(temporary, ignore_errors=True)
+            dataset.to_zarr(temporary, mode='w')
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            dataset.to_netcdf(temporary)
+        os.replace(temporary, path)
+    for old in glob.glob(os.path.join(cache_dir, f'{case.name}_*')):
+        if f'_{key}_' not in os.path.basename(old):
+            if os.path.isdir(old):
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.remove(old)
+
+
+def run_match(case, inputs, parameters=MATCH_PARAMETERS):
+    """Read the case's inputs and match CPL and CRS to the P-3 (impacts_tools)."""
+    sys.path.append(IMPACTS_TOOLS)
+    from impacts_tools import p3, er2, match
+
+    start, end = case.start_time, case.end_time
+    n_workers = parameters['n_workers']
+
+    # CPL L1B, L2 layer (cloud top properties) and L2 profile data
+    cpl_l1b = er2.Cpl(inputs['cpl_l1b'], start_time=start, end_time=end)
+    cpl_l2lay = er2.Cpl(inputs['cpl_l2lay'], l1b_trim_ref=cpl_l1b, start_time=start, end_time=end)
+    cpl_l2pro = er2.Cpl(
+        inputs['cpl_l2pro'], l1b_trim_ref=cpl_l1b, l2_cloudtop_ref=cpl_l2lay,
+        l2_qc_ref=cpl_l2lay, start_time=start, end_time=end
+    )
+    p3nav = p3.P3(inputs['p3nav'], case.date, start_time=start, end_time=end, tres=parameters['p3_tres'], fmt='ames')
+
+    crs = er2.Crs(
+        inputs['crs'], start_time=start, end_time=end, dataset=case.date[:4],
+        dbz_sigma=parameters['crs_dbz_sigma'], vel_sigma=parameters['crs_vel_sigma']
+    )
+
+    # Keep the plotted heights and every gate that can be within dist_thresh of the P-3
+    margin = max(parameters[name]['dist_thresh'] for name in ('cpl_l1b', 'cpl_l2pro', 'crs'))
+    bottom, top = parameters['plot_height_range']
+    bottom = min(bottom, float(p3nav.data.alt_gps.min()) - margin)
+    top = max(top, float(p3nav.data.alt_gps.max()) + margin)
+    cpl_l2pro.data = subset_height(cpl_l2pro.data, bottom, top)
+    crs.data = subset_height(crs.data, bottom, top)
+
+    # add cloud top properties to the L1B dataset, on the L2 times (nearest neighbor)
+    cpl_l1b.data = subset_height(cpl_l1b.get_cloudtop_properties(cpl_l2lay), bottom, top)
+    cpl_l1b.data = nearest_times(cpl_l1b.data, cpl_l2pro.data.time)
+
+    match_cpl_l1b = match.Cpl(cpl_l1b.data, p3nav.data, ref_coords=None, n_workers=n_workers,
+                              **parameters['cpl_l1b']).data
+    match_cpl_l2pro = match.Cpl(cpl_l2pro.data, p3nav.data, ref_coords=None, n_workers=n_workers,
+                                **parameters['cpl_l2pro']).data
+    match_cpl = xr.merge(
+        [match_cpl_l1b, match_cpl_l2pro, p3nav.data.temp, p3nav.data.alt_gps],
+        compat='override', combine_attrs='drop_conflicts'
+    )
+    match_cpl = match_cpl.where(match_cpl.pbsc_355) # drop pixels if no 355-nm data (optional)
+
+    match_crs = match.Crs(crs.data, p3nav.data, ref_coords=None, n_workers=n_workers, **parameters['crs']).data
+    match_crs = xr.merge(
+        [match_crs, p3nav.data.temp, p3nav.data.alt_gps],
+        compat='override', combine_attrs='drop_conflicts'
+    )
+    return {'cpl_l1b': cpl_l1b.data, 'cpl_l2pro': cpl_l2pro.data, 'crs': crs.data, 'p3nav': p3nav.data,
+            'match_cpl': match_cpl, 'match_crs': match_crs}
+
+
+def match_case(case, er2_dir=ER2_DIR, p3_dir=P3_DIR, cache_dir='match_cache', parameters=MATCH_PARAMETERS,
+               fmt='netcdf', refresh=False):
+    """Matched datasets of a case (MatchedCase), from the cache when it is up to date."""
+    inputs = find_case_files(case, er2_dir, p3_dir)
+    key = cache_key(case, inputs, parameters)
+    datasets = None if refresh else read_cached(cache_dir, case, key, fmt)
+    if datasets is None:
+        datasets = run_match(case, inputs, parameters)
+        try:
+            write_cached(cache_dir, case, key, datasets, fmt)
+        except (OSError, ValueError, TypeError) as error:
+            print(f'Could not cache {case.name}: {error}')
+    return MatchedCase(case, key, **datasets)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Match ER-2 CPL/CRS data to the P-3 for a list of cases, with a cache.")
+    parser.add_argument("cases", help="Case file, one 'YYYY-MM-DD HH:MM:SS HH:MM:SS' per line.")
+    parser.add_argument("-er2_dir", type=str, default=ER2_DIR, help="ER-2 data directory (YYYYMMDD/CPL_Data, CRS_Data).")
+    parser.add_argument("-p3_dir", type=str, default=P3_DIR, help="P-3 data directory (MetNav .ict files).")
+    parser.add_argument("-cache_dir", type=str, default='match_cache', help="Cache directory.")
+    parser.add_argument("-format", type=str, default='netcdf', choices=sorted(CACHE_SUFFIXES), help="Cache file format.")
+    parser.add_argument("-refresh", action="store_true", help="Redo the matching even if the cache is up to date.")
+    args = parser.parse_args()
+
+    for case in read_cases(args.cases):
+        matched = match_case(case, er2_dir=args.er2_dir, p3_dir=args.p3_dir, cache_dir=args.cache_dir,
+                             fmt=args.format, refresh=args.refresh)
+        print(f'{case.name}: {matched.key}')
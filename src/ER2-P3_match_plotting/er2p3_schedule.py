@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   er2p3_schedule.py
+#
+# Purpose:
+#   Run the ER-2/P-3 matching (er2p3_match.match_case) and optionally the
+#   match figure (CRS-vel-dbz_CPL_P3-micro_match_20250422.py) for many
+#   coordinated legs at once. Every attempt of a case runs in its own
+#   process, at most 'nproc' at a time, with an optional memory limit
+#   (address space, GB) and time limit per case. Failed cases (error,
+#   memory limit, killed, time limit) are retried up to 'retries' times.
+#   A progress line is printed as each case finishes and a timing report
+#   (wall time, time per case, peak memory per case, failures) at the end.
+#
+# Syntax:
+#   ./er2p3_schedule.py cases.txt -nproc 7 -memory_limit 16 -retries 2 \
+#       -er2_dir /data/IMPACTS/ER2_Data -p3_dir /data/IMPACTS/aircraft_data
+#
+#   ./er2p3_schedule.py cases.txt -figures -outdir figures
+#
+#   from er2p3_schedule import match_job, schedule
+#   results = schedule(read_cases('cases.txt'), match_job, nproc=7, memory_limit=16)
+#
+#   Options:
+#       -nproc        : cases run at the same time (default: CPU cores divided
+#                       by the n_workers each match uses)
+#       -memory_limit : address space limit per case in GB (none)
+#       -timeout      : time limit per case attempt in seconds (none)
+#       -retries      : extra attempts for failed cases (1)
+#       -figures      : also make the match figure of every case (in -outdir)
+#       -er2_dir, -p3_dir, -cache_dir, -format : as er2p3_match.py
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#     Figure jobs use the match cache format (-format); a timeout kills the
+#     figure script of the attempt too.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import argparse
+import multiprocessing
+import os
+import resource
+import signal
+import subprocess
+import sys
+import time
+import traceback
+from collections import deque, namedtuple
+from multiprocessing.connection import wait
+from er2p3_match import CACHE_SUFFIXES, ER2_DIR, MATCH_PARAMETERS, P3_DIR, match_case, read_cases
+
+FIGURE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CRS-vel-dbz_CPL_P3-micro_match_20250422.py')
+
+# Status, attempts used, seconds of the last attempt, peak memory (MB) and
+# error message of a case
+CaseResult = namedtuple('CaseResult', ['case', 'status', 'attempts', 'seconds', 'peak_mb', 'error'])
+
+
+def match_job(case, er2_dir=ER2_DIR, p3_dir=P3_DIR, cache_dir='match_cache', fmt='netcdf'):
+    """Match a case (fills the cache); returns the cache key."""
+    return match_case(case, er2_dir=er2_dir, p3_dir=p3_dir, cache_dir=cache_dir, fmt=fmt).key
+
+
+def figure_job(case, outdir='figures', er2_dir=ER2_DIR, p3_dir=P3_DIR, cache_dir='match_cache', fmt='netcdf'):
+    """Match a case and make its figure with the match script; returns the figure file."""
+    key = match_job(case, er2_dir, p3_dir, cache_dir, fmt)
+    os.makedirs(outdir, exist_ok=True)
+    outfile = os.path.join(outdir, f'{case.name}_CRS-CPL-P3_match.png')
+    # Same cache and format as the match above, so the script reads it instead of matching again
+    subprocess.run([sys.executable, FIGURE_SCRIPT, '-date', case.date, '-start', case.start, '-end', case.end,
+                    '-er2_dir', er2_dir, '-p3_dir', p3_dir, '-cache_dir', cache_dir, '-format', fmt,
+                    '-outfile', outfile],
+                   check=True, env=dict(os.environ, MPLBACKEND='Agg'))
+    return f'{key} {outfile}'
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process and its finished children (MB)."""
+    return max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) / 1024.
+
+
+def kill_attempt(process):
+    """Kill an attempt process and everything it started (its process group)."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        # Not (yet) a group of its own
+        if process.is_alive():
+            process.terminate()
+        return
+    process.join(5)
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _run_attempt(job, case, options, memory_limit, connection):
+    """
+    Worker process: apply the memory limit, run the job and send back the
+    outcome. The worker leads its own process group, so subprocesses of the
+    job (the figure script) are killed with it on a timeout.
+    """
+    os.setpgid(0, 0)
+    if memory_limit:
+        limit = int(memory_limit * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        result = job(case, **options)
+        connection.send(('done', str(result), peak_memory_mb()))
+    except MemoryError:
+        connection.send(('memory', 'memory limit exceeded', peak_memory_mb()))
+    except BaseException:
+        connection.send(('failed', traceback.format_exc(limit=-3), peak_memory_mb()))
+    finally:
+        connection.close()
+
+
+def schedule(cases, job, nproc=None, memory_limit=None, timeout=None, retries=1, **options):
+    """
+    Run job(case, **options) for every case in separate processes; returns
+    a CaseResult per case, in case order.
+    """
+    nproc = nproc or max(os.cpu_count() // MATCH_PARAMETERS['n_workers'], 1)
+    pending = deque((i, 1) for i in range(len(cases)))
+    running = {}
+    results = [None] * len(cases)
+    finished = 0
+    wall_start = time.time()
+
+    while pending or running:
+        while pending and len(running) < nproc:
+            i, attempt = pending.popleft()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_run_attempt, args=(job, cases[i], options, memory_limit, sender))
+            process.start()
+            sender.close()
+            running[process.sentinel] = (process, receiver, i, attempt, time.time())
+
+        wait([entry[1] for entry in running.values()] + list(running), timeout=1 if timeout else None)
+        now = time.time()
+        for sentinel, (process, receiver, i, attempt, started) in list(running.items()):
+            if receiver.poll():
+                try:
+                    status, message, peak_mb = receiver.recv()
+                except EOFError:
+                    status, message, peak_mb = 'killed', 'worker exited without a result', 0.
+                process.join()
+            elif not process.is_alive():
+                process.join()
+                kill_attempt(process)
+                status, message, peak_mb = 'killed', f'worker exit code {process.exitcode}', 0.
+            elif timeout and now - started > timeout:
+                kill_attempt(process)
+                process.join()
+                status, message, peak_mb = 'timeout', f'over {timeout} s', 0.
+            else:
+                continue
+            receiver.close()
+            del running[sentinel]
+
+            seconds = now - started
+            if status != 'done' and attempt <= retries:
+                print(f'{cases[i].name}: {status} (attempt {attempt}), retrying: {message.strip().splitlines()[-1]}')
+                pending.append((i, attempt + 1))
+                continue
+            results[i] = CaseResult(cases[i], status, attempt, seconds, peak_mb, '' if status == 'done' else message)
+            finished += 1
+            print(f'[{finished}/{len(cases)}] {cases[i].name} {status} in {seconds:.1f} s '
+                  f'(attempt {attempt}, peak {peak_mb:.0f} MB)')
+
+    report(results, time.time() - wall_start)
+    return results
+
+
+def report(results, wall_seconds):
+    """Print the timing report of a schedule() run."""
+    done = [result for result in results if result.status == 'done']
+    failed = [result for result in results if result.status != 'done']
+    case_seconds = sum(result.seconds for result in results)
+    print(f'{len(done)} of {len(results)} cases done in {wall_seconds:.1f} s wall time '
+          f'({case_seconds:.1f} s case time, {case_seconds / max(wall_seconds, 1e-9):.1f}x parallel)')
+    if done:
+        slowest = max(done, key=lambda result: result.seconds)
+        largest = max(done, key=lambda result: result.peak_mb)
+        print(f'  mean {sum(result.seconds for result in done) / len(done):.1f} s per case, slowest {slowest.case.name} '
+              f'{slowest.seconds:.1f} s, largest {largest.case.name} {largest.peak_mb:.0f} MB')
+    for result in failed:
+        print(f'  FAILED {result.case.name} ({result.status} after {result.attempts} attempts): '
+              f'{result.error.strip().splitlines()[-1] if result.error else ""}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Match (and plot) many ER-2/P-3 cases in parallel.")
+    parser.add_argument("cases", help="Case file, one 'YYYY-MM-DD HH:MM:SS HH:MM:SS' per line.")
+    parser.add_argument("-nproc", type=int, default=None, help="Cases at the same time (default: cores / match n_workers).")
+    parser.add_argument("-memory_limit", type=float, default=None, help="Memory (address space) limit per case in GB.")
+    parser.add_argument("-timeout", type=float, default=None, help="Time limit per case attempt in seconds.")
+    parser.add_argument("-retries", type=int, default=1, help="Extra attempts for failed cases.")
+    parser.add_argument("-figures", action="store_true", help="Also make the match figure of every case.")
+    parser.add_argument("-outdir", type=str, default='figures', help="Figure directory (with -figures).")
+    parser.add_argument("-er2_dir", type=str, default=ER2_DIR, help="ER-2 data directory.")
+    parser.add_argument("-p3_dir", type=str, default=P3_DIR, help="P-3 data directory.")
+    parser.add_argument("-cache_dir", type=str, default='match_cache', help="Match cache directory.")
+    parser.add_argument("-format", type=str, default='netcdf', choices=sorted(CACHE_SUFFIXES), help="Cache file format.")
+    args = parser.parse_args()
+
+    options = {'er2_dir': args.er2_dir, 'p3_dir': args.p3_dir, 'cache_dir': args.cache_dir, 'fmt': args.format}
+    if args.figures:
+        options['outdir'] = args.outdir
+    results = schedule(read_cases(args.cases), figure_job if args.figures else match_job, nproc=args.nproc,
+                       memory_limit=args.memory_limit, timeout=args.timeout, retries=args.retries, **options)
+    sys.exit(0 if all(result.status == 'done' for result in results) else 1)
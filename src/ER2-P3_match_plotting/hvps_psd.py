@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   hvps_psd.py
+#
+# Purpose:
+#   Particle size distributions (PSD) from all size bins of the HVPS-3 1 Hz
+#   concentration files (*.HVPS3_Horizontal.conc.1Hz, read with
+#   adpaa_io.read_hvps). The bin columns and their size ranges come from the
+#   variable names in the file header ('... (150-300 um) ...'), or are given.
+#   Everything is computed on (time, bin) arrays at once, without loops over
+#   seconds or windows:
+#
+#     N(D) = N_i / dD_i                       [# m-3 um-1]
+#     M_k  = sum N_i D_i^k                    [# m-3 um^k]
+#     N_total = M0, D_mean = M1/M0, D_eff = M3/M2, D_m = M4/M3 [um]
+#     D_mvd: median volume diameter (half of M3 below it), interpolated
+#            within the bin it falls in [um]
+#     normalized N(D) (Testud et al. 2001): N(D)/N0* against D/D_m with
+#            N0* = 4^4/6 M3^5/M4^4        [# m-3 um-1]
+#
+#   Spectra are averaged (over the seconds with data) into arbitrary time
+#   windows, windows aligned to midnight, or windows centred on matched P-3
+#   points (time_align.TimeAxis) from cumulative sums over the sorted times.
+#
+# Syntax:
+#   from hvps_psd import read_psd, psd_properties, window_psd, psd_along
+#
+#   psd = read_psd('22_01_19_12_00_00.HVPS3_Horizontal.conc.1Hz')
+#   properties = psd_properties(psd)            DataFrame indexed by time
+#   psd_5s = fixed_window_psd(psd, 5)           5 s means (aligned to midnight)
+#   psd_p3 = psd_along(psd, TimeAxis(p3_times), '5s')
+#   x, y = normalized_psd(psd)
+#
+#   ./hvps_psd.py *.HVPS3_Horizontal.conc.1Hz -window 5 -outdir hvps_psd
+#       writes <file>.psd_5s.csv with the properties of every window
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import argparse
+import os
+import re
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from adpaa_io import read_header, read_hvps
+from time_align import sorted_times, to_timedelta64
+
+# Size range in a variable name: '(150-300 um)', '150.0 to 300.0 microns'
+BIN_RANGE = re.compile(r'(\d+(?:\.\d*)?)\s*(?:-|to)\s*(\d+(?:\.\d*)?)\s*(?:um|µm|micron)', re.IGNORECASE)
+
+MOMENTS = (0, 1, 2, 3, 4, 6)
+
+# Spectra: times (datetime64[ns]), bin lower and upper sizes (um), number
+# concentration per bin (time, bin) [# m-3] and seconds of data averaged
+# per time (1 for 1 Hz data)
+Psd = namedtuple('Psd', ['time', 'lower', 'upper', 'concentration', 'seconds'])
+
+
+def header_bins(header):
+    """
+    Bin columns (file column index) and size ranges (um) from the variable
+    names of an ADPAA header; empty lists when the names give no sizes.
+    """
+    nv = len(header['missing']) if header['missing'] is not None else 0
+    columns, lower, upper = [], [], []
+    # Ames 1001: variable names on the lines after the missing values
+    for k, line in enumerate(header['lines'][12:12 + nv]):
+        match = BIN_RANGE.search(line)
+        if match:
+            columns.append(k + 1)
+            lower.append(float(match.group(1)))
+            upper.append(float(match.group(2)))
+    return columns, lower, upper
+
+
+def read_psd(filename, edges=None, cache=True):
+    """
+    All size bins of an HVPS-3 1 Hz concentration file. Without 'edges'
+    (bin edges in um, bins in columns 1 to len(edges) - 1) the bins and
+    sizes come from the header.
+    """
+    table = read_hvps(filename, cache=cache)
+    columns = [name for name in table.columns if name not in ('time', 'Mean_Diameter', 'N_Conc')]
+    if edges is None:
+        bins, lower, upper = header_bins(read_header(filename))
+        if not bins:
+            raise ValueError(f'No bin sizes in the header of {filename}, give the bin edges')
+    else:
+        edges = np.asarray(edges, dtype=np.float64)
+        bins, lower, upper = list(range(1, len(edges))), edges[:-1], edges[1:]
+    concentration = table[[columns[i] for i in bins]].to_numpy(dtype=np.float64)
+    time = table['time'].to_numpy()
+    return Psd(time, np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64),
+               concentration, np.ones(len(time), dtype=np.int64))
+
+
+def bin_sizes(psd):
+    """Bin mid sizes and widths (um)."""
+    return (psd.lower + psd.upper) / 2, psd.upper - psd.lower
+
+
+def size_distribution(psd):
+    """N(D) = N_i / dD_i [# m-3 um-1], (time, bin)."""
+    return psd.concentration / bin_sizes(psd)[1]
+
+
+def moments(psd, orders=MOMENTS):
+    """Moments M_k = sum N_i D_i^k [# m-3 um^k] as {k: array (time)}; NaN bins count as empty."""
+    diameter = bin_sizes(psd)[0]
+    concentration = np.nan_to_num(psd.concentration)
+    empty = np.isnan(psd.concentration).all(axis=1)
+    result = {}
+    for k in orders:
+        result[k] = concentration @ diameter ** k
+        result[k][empty] = np.nan
+    return result
+
+
+def median_volume_diameter(psd):
+    """Diameter (um) with half of M3 in smaller particles, interpolated within its bin."""
+    diameter = bin_sizes(psd)[0]
+    volume = np.nan_to_num(psd.concentration) * diameter ** 3
+    cumulative = np.cumsum(volume, axis=1)
+    total = cumulative[:, -1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = cumulative / total
+    # First bin reaching half the volume and the fraction below it
+    j = np.argmax(fraction >= 0.5, axis=1)
+    rows = np.arange(len(j))
+    below = np.where(j > 0, fraction[rows, np.maximum(j - 1, 0)], 0.)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = (0.5 - below) / (fraction[rows, j] - below)
+    mvd = psd.lower[j] + weight * (psd.upper[j] - psd.lower[j])
+    mvd[~(total[:, 0] > 0)] = np.nan
+    return mvd
+
+
+def psd_properties(psd):
+    """Bulk properties of every spectrum, a DataFrame indexed by time."""
+    m = moments(psd)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        properties = {
+            'seconds': psd.seconds,
+            'N_total': m[0],
+            'D_mean': m[1] / m[0],
+            'D_eff': m[3] / m[2],
+            'D_m': m[4] / m[3],
+            'D_mvd': median_volume_diameter(psd),
+            'N0_star': 4 ** 4 / 6 * m[3] ** 5 / m[4] ** 4,
+        }
+    for k in MOMENTS:
+        properties[f'M{k}'] = m[k]
+    return pd.DataFrame(properties, index=pd.DatetimeIndex(psd.time, name='time'))
+
+
+def normalized_psd(psd):
+    """Normalized spectra: D/D_m (time, bin) and N(D)/N0* (time, bin)."""
+    m = moments(psd, (3, 4))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dm = m[4] / m[3]
+        n0 = 4 ** 4 / 6 * m[3] ** 5 / m[4] ** 4
+        return bin_sizes(psd)[0] / dm[:, None], size_distribution(psd) / n0[:, None]
+
+
+def window_psd(psd, starts, stops):
+    """
+    Mean spectra of the seconds with data in [start, stop) windows
+    (datetime64); the window start is the time of each mean.
+    """
+    times, order = sorted_times(psd.time)
+    concentration = psd.concentration if order is None else psd.concentration[order]
+    seconds = psd.seconds if order is None else psd.seconds[order]
+    # Seconds with data (all bins NaN: missing) and their weighted spectra
+    valid = ~np.isnan(concentration).all(axis=1)
+    weights = np.where(valid, seconds, 0)
+    summed = np.vstack([np.zeros((1, concentration.shape[1])),
+                        np.cumsum(np.nan_to_num(concentration) * weights[:, None], axis=0)])
+    counted = np.concatenate([[0], np.cumsum(weights)])
+
+    start = np.searchsorted(times, np.asarray(starts, dtype='datetime64[ns]'), side='left')
+    stop = np.searchsorted(times, np.asarray(stops, dtype='datetime64[ns]'), side='left')
+    count = counted[stop] - counted[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (summed[stop] - summed[start]) / count[:, None]
+    mean[count == 0] = np.nan
+    return Psd(np.asarray(starts, dtype='datetime64[ns]'), psd.lower, psd.upper, mean, count)
+
+
+def fixed_window_psd(psd, seconds=5):
+    """Mean spectra in 'seconds' windows aligned to midnight (as resample), windows with data only."""
+    width = to_timedelta64(seconds)
+    times = psd.time[~np.isnat(psd.time)]
+    day = times.min().astype('datetime64[D]').astype('datetime64[ns]')
+    first = day + (times.min() - day) // width * width
+    starts = np.unique(first + (times - first) // width * width)
+    return window_psd(psd, starts, starts + width)
+
+
+def psd_along(psd, axis, width='5s'):
+    """Mean spectra in 'width' centred on each time of a time_align.TimeAxis (e.g. matched P-3 points)."""
+    half = to_timedelta64(width) / 2
+    means = window_psd(psd, axis.times - half, axis.times + half)
+    return means._replace(time=axis.times)
+
+
+def psd_files(filenames, seconds=5, outdir='hvps_psd', edges=None):
+    """Properties of 'seconds' window mean spectra of each file, written as CSV; returns the file names."""
+    os.makedirs(outdir, exist_ok=True)
+    written = []
+    for filename in filenames:
+        properties = psd_properties(fixed_window_psd(read_psd(filename, edges=edges), seconds))
+        output = os.path.join(outdir, f'{os.path.basename(filename)}.psd_{seconds}s.csv')
+        properties.to_csv(output)
+        written.append(output)
+        print(f'Wrote {output} ({len(properties)} windows)')
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HVPS-3 size distribution properties in time windows.")
+    parser.add_argument("files", nargs='+', help="HVPS-3 1 Hz concentration files (*.HVPS3_Horizontal.conc.1Hz).")
+    parser.add_argument("-window", type=int, default=5, help="Seconds per window (aligned to midnight).")
+    parser.add_argument("-outdir", type=str, default='hvps_psd', help="Output directory.")
+    parser.add_argument("-edges", type=float, nargs='+', default=None,
+                        help="Bin edges in um when the header does not give the bin sizes.")
+    args = parser.parse_args()
+
+    psd_files(args.files, seconds=args.window, outdir=args.outdir, edges=args.edges)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   time_align.py
+#
+# Purpose:
+#   Time alignment of instrument streams (CPI, HVPS, MetNav, CRS, CPL) to a
+#   common time axis, usually the P-3 times of an ER-2/P-3 match. The axis
+#   keeps its times sorted once; every stream is then joined to it with
+#   np.searchsorted, so a join costs one pass over the axis and the stream
+#   and every stream is aligned with the same rules:
+#
+#     nearest : the stream sample nearest each axis time (earlier one on a
+#               tie), none if further than 'tolerance' away; tolerance 0
+#               keeps exact time matches only (as index.isin(times)).
+#     window  : sum of the stream samples in [t - width/2, t + width/2) around
+#               each axis time, from cumulative sums (e.g. CPI particle
+#               counts in the 5 s around each P-3 point).
+#
+#   Axis times that are NaT are dropped; 'positions' gives the position of
+#   each axis time in the times it was made from, to pick values that go
+#   with them (e.g. the P-3 altitude).
+#
+# Syntax:
+#   from time_align import TimeAxis, sfm_to_datetime64
+#
+#   axis = TimeAxis(match_crs.time_radar.values, unique=True)
+#   hvps_matched = axis.join(data_hvps_pd, tolerance=0, how='inner')
+#   chain_per_5s = axis.window_sum(chain_per, '5s')
+#   alt_gps = match_cpl.alt_gps.values[axis.positions]
+#   index = axis.nearest(cpl_l1b.time.values, tolerance='1s')   (-1: no match)
+#
+#   times = sfm_to_datetime64(data_cpi_pd['sfm'], '2022-01-19')
+#
+# Modification History:
+#   2026/10/18
+#     Written, replaces the interp/isin/reindex/round matching of
+#     CRS-vel-dbz_CPL_P3-micro_match_20250422.py.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import numpy as np
+import pandas as pd
+
+TIME_UNIT = 'datetime64[ns]'
+
+
+def to_datetime64(times):
+    """Times (datetime64, pandas or datetime values) as a datetime64[ns] array."""
+    return np.asarray(pd.to_datetime(np.asarray(times).ravel()), dtype=TIME_UNIT)
+
+
+def to_timedelta64(value):
+    """Tolerance or width ('5s', seconds, timedelta) as timedelta64[ns]; None stays None."""
+    if value is None:
+        return None
+    # np.timedelta64 is an np.integer subclass
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, np.timedelta64):
+        value = pd.Timedelta(seconds=float(value))
+    return pd.Timedelta(value).to_timedelta64().astype('timedelta64[ns]')
+
+
+def sfm_to_datetime64(sfm, date):
+    """Seconds from midnight (UTC) of 'date' as datetime64[ns] times."""
+    sfm = np.asarray(sfm, dtype=np.float64)
+    nanoseconds = np.round(sfm * 1e9)
+    times = np.datetime64(pd.Timestamp(date).normalize().to_datetime64(), 'ns') \
+        + np.nan_to_num(nanoseconds).astype('timedelta64[ns]')
+    times[np.isnan(sfm)] = np.datetime64('NaT')
+    return times
+
+
+def sorted_times(times):
+    """Stream times as datetime64[ns] and the order sorting them (None if already sorted)."""
+    times = to_datetime64(times)
+    if len(times) > 1 and not (times[1:] >= times[:-1]).all():
+        order = np.argsort(times, kind='stable')
+        return times[order], order
+    return times, None
+
+
+class TimeAxis:
+    """
+    A common time axis (e.g. the P-3 times of a match) that instrument
+    streams are joined to; results follow the order of 'times'.
+    """
+
+    def __init__(self, times, unique=False):
+        times = to_datetime64(times)
+        keep = ~np.isnat(times)
+        if unique:
+            first = np.zeros(len(times), dtype=bool)
+            first[np.unique(times, return_index=True)[1]] = True
+            keep &= first
+        self.positions = np.flatnonzero(keep)
+        self.times = times[keep]
+        self.order = np.argsort(self.times, kind='stable')
+        self.sorted = self.times[self.order]
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def index(self):
+        """The axis times as a pandas DatetimeIndex."""
+        return pd.DatetimeIndex(self.times, name='time')
+
+    def nearest(self, times, tolerance=None):
+        """
+        Index into 'times' of the sample nearest each axis time (earlier one
+        on a tie), -1 where none is within 'tolerance'.
+        """
+        stream, order = sorted_times(times)
+        valid = ~np.isnat(stream)
+        if not valid.all():
+            # NaT sorts last
+            stream = stream[valid]
+            order = order[valid] if order is not None else None
+        index = np.full(len(self), -1, dtype=np.intp)
+        if len(stream) == 0:
+            return index
+
+        after = np.searchsorted(stream, self.sorted, side='left')
+        before = np.clip(after - 1, 0, len(stream) - 1)
+        after = np.clip(after, 0, len(stream) - 1)
+        use_after = np.abs(stream[after] - self.sorted) < np.abs(self.sorted - stream[before])
+        nearest = np.where(use_after, after, before)
+
+        tolerance = to_timedelta64(tolerance)
+        if tolerance is not None:
+            found = np.abs(stream[nearest] - self.sorted) <= tolerance
+        else:
+            found = np.ones(len(nearest), dtype=bool)
+        if order is not None:
+            nearest = order[nearest]
+        index[self.order[found]] = nearest[found]
+        return index
+
+    def join(self, frame, tolerance=None, how='left'):
+        """
+        Rows of 'frame' (DatetimeIndex) nearest each axis time, indexed by
+        the axis times. how='left' keeps every axis time (NaN where no row is
+        within tolerance), how='inner' only the matched ones.
+        """
+        index = self.nearest(frame.index, tolerance)
+        found = index >= 0
+        if how == 'inner':
+            joined = frame.iloc[index[found]].set_axis(self.index[found])
+        elif how == 'left':
+            if len(frame) == 0:
+                return frame.reindex(self.index)
+            joined = frame.iloc[np.maximum(index, 0)].set_axis(self.index)
+            joined = joined.where(pd.Series(found, index=self.index), axis=0)
+        else:
+            raise ValueError(f"how must be 'left' or 'inner', not '{how}'")
+        return joined
+
+    def window_bounds(self, times, width):
+        """
+        Sorted stream times and the [start, stop) range of them within
+        [t - width/2, t + width/2) of each (sorted) axis time, with the stream
+        order (None if already sorted).
+        """
+        stream, order = sorted_times(times)
+        half = to_timedelta64(width) / 2
+        start = np.searchsorted(stream, self.sorted - half, side='left')
+        stop = np.searchsorted(stream, self.sorted + half, side='left')
+        return stream, start, stop, order
+
+    def window_sum(self, frame, width, count=None):
+        """
+        Sums of the numeric columns of 'frame' (DatetimeIndex) in a window of
+        'width' centred on each axis time, indexed by the axis times. With
+        'count' set, a column of that name holds the number of rows summed.
+        """
+        _, start, stop, order = self.window_bounds(frame.index, width)
+        values = frame.select_dtypes('number').to_numpy(dtype=np.float64)
+        if order is not None:
+            values = values[order]
+        values = np.nan_to_num(values)
+        cumulative = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+        sums = np.empty((len(self), values.shape[1]))
+        sums[self.order] = cumulative[stop] - cumulative[start]
+        result = pd.DataFrame(sums, index=self.index, columns=frame.select_dtypes('number').columns)
+        if count is not None:
+            counts = np.empty(len(self), dtype=np.int64)
+            counts[self.order] = stop - start
+            result[count] = counts
+        return result
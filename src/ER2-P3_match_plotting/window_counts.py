@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   window_counts.py
+#
+# Purpose:
+#   Particle counts, fractions and totals of Hawkeye-CPI particles (all
+#   particles, chain aggregates, derived habit categories) in time windows of
+#   any width, for many widths at once. One pass over the particles bins them
+#   per second (np.bincount) and turns the per second counts into cumulative
+#   (prefix) sums; the counts of any window of whole seconds are then the
+#   difference of two prefix rows. Building costs O(particles + seconds) and
+#   every window O(1), so a table for each of 1, 5, 10, 30 and 60 s windows
+#   (or a sweep over the averaging window) costs O(particles + windows)
+#   instead of a groupby/resample per window width.
+#
+#   Windows are either aligned to midnight (as resample('5S')) or centred on
+#   the times of a time_align.TimeAxis, taking the seconds starting in
+#   [t - width/2, t + width/2) as TimeAxis.window_sum does. Per second values
+#   such as temperature and altitude can be added and are averaged (NaN
+#   ignoring) over the same windows.
+#
+# Syntax:
+#   from window_counts import WindowCounts
+#
+#   counts = WindowCounts(data_cpi_pd['sfm'], date, {'chainagg_particles': data_cpi_pd['ChainAgg'],
+#                                                    'Chain_Aggregate': data_cpi_pd['Chain_Aggregate']})
+#   counts.add_mean('temperature', temperature_per_second)
+#   per_5s = counts.fixed(5)                    windows aligned to midnight
+#   tables = counts.stats((1, 5, 10, 30, 60))   {width: table}
+#   around_p3 = counts.around(TimeAxis(p3_times), 5)
+#
+#   Tables have 'time' and 'sfm' (window start, or the axis time), the
+#   counts (total_particles and each column), 'percentage_<name>' of each
+#   column (chainagg_particles: percentage_chainagg; 0 without particles)
+#   and the window means.
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import numpy as np
+import pandas as pd
+from time_align import sfm_to_datetime64, to_datetime64, to_timedelta64
+
+# Window widths (s) of a default table set
+WINDOWS = (1, 5, 10, 30, 60)
+
+TOTAL = 'total_particles'
+
+
+def percentage_name(name):
+    """Name of the percentage column of a count column (chainagg_particles: percentage_chainagg)."""
+    return 'percentage_' + (name[:-len('_particles')] if name.endswith('_particles') else name)
+
+
+class WindowCounts:
+    """
+    Per second particle counts of a flight as prefix sums, for counts in
+    windows of whole seconds. 'sfm' are the particle times (seconds from
+    midnight of 'date'), 'columns' per particle weights ({name: values},
+    e.g. 0/1 habit flags) counted besides all particles.
+    """
+
+    def __init__(self, sfm, date, columns=None):
+        sfm = np.asarray(sfm, dtype=np.float64)
+        valid = np.isfinite(sfm)
+        seconds = np.floor(sfm[valid]).astype(np.int64)
+        self.date = np.datetime64(pd.Timestamp(date).normalize().to_datetime64(), 'ns')
+        self.first = int(seconds.min()) if len(seconds) else 0
+        self.nseconds = int(seconds.max()) - self.first + 1 if len(seconds) else 0
+        index = seconds - self.first
+
+        columns = columns or {}
+        self.names = [TOTAL] + list(columns)
+        counts = np.empty((self.nseconds, len(self.names)), dtype=np.float64)
+        counts[:, 0] = np.bincount(index, minlength=self.nseconds)
+        for k, name in enumerate(columns, start=1):
+            weights = np.nan_to_num(np.asarray(columns[name], dtype=np.float64)[valid])
+            counts[:, k] = np.bincount(index, weights=weights, minlength=self.nseconds)
+        self.prefix = np.vstack([np.zeros((1, len(self.names))), np.cumsum(counts, axis=0)])
+        # Columns of whole counts (0/1 flags) are returned as integers
+        self.integer = np.all(counts == np.round(counts), axis=0)
+        self.means = {}
+
+    @property
+    def sfm(self):
+        """Seconds from midnight of every second from the first to the last particle."""
+        return self.first + np.arange(self.nseconds)
+
+    def add_mean(self, name, values):
+        """Per second values (one per self.sfm, NaN: none) averaged over the windows of every table."""
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values)
+        self.means[name] = (np.concatenate([[0.], np.cumsum(np.where(valid, values, 0.))]),
+                            np.concatenate([[0], np.cumsum(valid)]))
+
+    def rows(self, start, stop):
+        """Prefix rows of the seconds [start, stop) (sfm, clipped to the flight)."""
+        start = np.clip(np.asarray(start, dtype=np.int64) - self.first, 0, self.nseconds)
+        stop = np.clip(np.asarray(stop, dtype=np.int64) - self.first, 0, self.nseconds)
+        return start, np.maximum(stop, start)
+
+    def table(self, start, stop, sfm=None):
+        """Counts, percentages and means of the seconds [start, stop) of each window, at 'sfm' (default start)."""
+        start, stop = self.rows(start, stop)
+        sums = self.prefix[stop] - self.prefix[start]
+        sfm = self.first + start if sfm is None else np.asarray(sfm)
+        stats = {'time': sfm_to_datetime64(sfm, self.date), 'sfm': sfm}
+        for k, name in enumerate(self.names):
+            stats[name] = np.round(sums[:, k]).astype(np.int64) if self.integer[k] else sums[:, k]
+        total = sums[:, 0]
+        for k, name in enumerate(self.names[1:], start=1):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stats[percentage_name(name)] = np.where(total > 0, sums[:, k] / total * 100, 0.0)
+        for name, (summed, counted) in self.means.items():
+            count = counted[stop] - counted[start]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stats[name] = np.where(count > 0, (summed[stop] - summed[start]) / count, np.nan)
+        return pd.DataFrame(stats)
+
+    def fixed(self, window=5):
+        """Table of 'window' second windows aligned to midnight, covering the flight."""
+        window = int(window)
+        if self.nseconds == 0:
+            return self.table(np.empty(0), np.empty(0))
+        starts = np.arange(self.first // window * window, self.first + self.nseconds, window)
+        return self.table(starts, starts + window, sfm=starts)
+
+    def around(self, axis, window=5):
+        """Table of 'window' windows centred on each time of a time_align.TimeAxis, indexed by the axis times."""
+        half = to_timedelta64(window) / 2
+        times = to_datetime64(axis.times)
+        # Seconds starting in [t - half, t + half)
+        second = np.timedelta64(1, 's')
+        start = -((self.date - (times - half)) // second)
+        stop = -((self.date - (times + half)) // second)
+        table = self.table(start, stop, sfm=(times - self.date) / second)
+        return table.set_axis(axis.index)
+
+    def stats(self, windows=WINDOWS, axis=None):
+        """Tables {width: table} for several window widths, aligned to midnight or centred on 'axis'."""
+        if axis is None:
+            return {window: self.fixed(window) for window in windows}
+        return {window: self.around(axis, window) for window in windows}
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   xsection_render.py
+#
+# Purpose:
+#   Drawing of ER-2 CRS/CPL time-height cross sections at the resolution of
+#   the output. Before drawing, the data are block averaged (NaN aware) down
+#   to about one profile per output pixel column and, for a regular grid,
+#   one gate per pixel row, so the drawing cost follows the panel size in
+#   pixels rather than the number of profiles and gates. A regular grid
+#   (evenly spaced times, the same evenly spaced heights for every profile,
+#   e.g. CPL) is drawn as an image (imshow); other grids (CRS heights that
+#   follow the aircraft) with pcolormesh on a cell edge mesh. Meshes are
+#   built from the 1-D times with broadcasting (no np.tile) and cached, so
+#   panels and datasets on the same grid (CPL L1B and L2 profile, the CRS
+#   panels) share one mesh.
+#
+# Syntax:
+#   from xsection_render import draw_xsection
+#
+#   c = draw_xsection(ax, crs_data.time.values, crs_data.height.values / 1000.,
+#                     crs_data.dbz.values, cmap='viridis', levels=np.linspace(-30, 15, 100))
+#       values are (height, time); keywords go to imshow/pcolormesh. The
+#       output size defaults to the axes size in figure pixels, pixels=(nx, ny)
+#       sets it. plain=True draws with matplotlib's own imshow/pcolormesh,
+#       skipping wrappers such as proplot's (e.g. to reuse the cmap and norm
+#       of an existing colorbar).
+#
+#   X, Y = xsection_grid(x_grid, y_grid)     pcolormesh cell edges (as before)
+#
+# Modification History:
+#   2026/10/18
+#     Written, xsection_grid moved from CRS-vel-dbz_CPL_P3-micro_match_20250422.py.
+#     Added plain drawing for figure templates (er2p3_figure.py).
+#     Averaged cells of a regular grid keep the extent of their original cells.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import hashlib
+from collections import OrderedDict, namedtuple
+import numpy as np
+import matplotlib.axes
+import matplotlib.dates as mdates
+
+# Meshes kept (least recently used dropped first)
+MESH_CACHE_SIZE = 16
+
+# Relative spread of the time steps and heights allowed for a regular grid
+REGULAR_TOLERANCE = 0.01
+
+# Block averaged cross section: times (ntime), heights (nheight or
+# (nheight, ntime)), values (nheight, ntime), the averaging factors, whether
+# the grid is regular and, for a regular grid, the (time, height) edges of
+# the averaged cells (None otherwise)
+Section = namedtuple('Section', ['times', 'heights', 'values', 'factors', 'regular', 'edges'])
+
+_mesh_cache = OrderedDict()
+
+
+def xsection_grid(x_grid, y_grid):
+    '''
+    Adds an extra element in the time/distance and height dimension to conform to newer mpl pcolormesh() function.
+    Useful for plotting ER-2 radar cross sections.
+    Parameters
+    ----------
+    x_grid: 2D time or distance field created from er2read() or resample() subroutines.
+    y_grid: 2D height field created from er2read() or resample() subroutines.
+    '''
+    # Work with x coordinate (time/distance) first
+    xdelta = x_grid[0, -1] - x_grid[0, -2] # should work on time and float dtypes
+    vals_to_append = np.atleast_2d(np.tile(x_grid[0,-1] + xdelta, x_grid.shape[0])).T
+    x_regrid = np.hstack((x_grid, vals_to_append)) # add column
+    x_regrid = np.vstack((np.atleast_2d(x_regrid[0,:]), x_regrid)) # add row
+
+    # Now do the y coordinate (height)
+    ydelta = y_grid[0, :] - y_grid[1, :] # height difference between first and second gates
+    vals_to_append = np.atleast_2d(y_grid[0,:] + ydelta)
+    y_regrid = np.vstack((vals_to_append, y_grid)) # add row
+    y_regrid = np.hstack((y_regrid, np.atleast_2d(y_regrid[:,-1]).T))
+    return x_regrid, y_regrid
+
+
+def time_edges(times):
+    """Cell edges of 1-D times as xsection_grid: each time starts a cell, one step added at the end."""
+    return np.append(times, times[-1] + (times[-1] - times[-2]))
+
+
+def height_edges(heights):
+    """
+    Cell edges of heights (ngate or (ngate, ntime)) as xsection_grid: one
+    gate step added before the first gate and, for 2-D heights, the last
+    profile repeated.
+    """
+    first = heights[:1] + (heights[:1] - heights[1:2])
+    edges = np.concatenate([first, heights], axis=0)
+    if edges.ndim == 2:
+        edges = np.hstack([edges, edges[:, -1:]])
+    return edges
+
+
+def block_edges(edges, factor):
+    """Edges of blocks of 'factor' cells: every factor-th edge and the last one."""
+    if factor <= 1:
+        return edges
+    reduced = edges[::factor]
+    if (len(edges) - 1) % factor:
+        reduced = np.append(reduced, edges[-1:])
+    return reduced
+
+
+def block_mean(values, factor, axis):
+    """NaN ignoring mean of blocks of 'factor' elements along 'axis' (last block may be shorter)."""
+    if factor <= 1:
+        return values
+    starts = np.arange(0, values.shape[axis], factor)
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.), starts, axis=axis)
+    counts = np.add.reduceat(valid.astype(np.int32), starts, axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def is_regular(times, heights):
+    """True for evenly spaced times and the same evenly spaced heights for every profile."""
+    if len(times) < 2 or heights.shape[0] < 2:
+        return False
+    steps = np.diff(times).astype(np.float64)
+    if np.abs(steps - np.median(steps)).max() > REGULAR_TOLERANCE * abs(np.median(steps)):
+        return False
+    if heights.ndim == 2:
+        column = heights[:, 0]
+        if np.isnan(heights).any() or not np.allclose(heights, column[:, None], rtol=0,
+                                                      atol=REGULAR_TOLERANCE * abs(column[1] - column[0])):
+            return False
+        heights = column
+    gates = np.diff(heights)
+    return np.abs(gates - np.median(gates)).max() <= REGULAR_TOLERANCE * abs(np.median(gates))
+
+
+def axes_pixels(ax):
+    """Size of an axes in figure pixels (width, height)."""
+    bbox = ax.get_window_extent()
+    return max(int(bbox.width), 1), max(int(bbox.height), 1)
+
+
+def reduce_xsection(times, heights, values, pixels):
+    """
+    Block average values (height, time) to about one profile per pixel
+    column and, on a regular grid, one gate per pixel row.
+    """
+    times = np.asarray(times)
+    heights = np.asarray(heights, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    regular = is_regular(times, heights)
+    if regular and heights.ndim == 2:
+        heights = heights[:, 0]
+
+    time_factor = max(len(times) // max(pixels[0], 1), 1)
+    gate_factor = max(heights.shape[0] // max(pixels[1], 1), 1) if regular else 1
+    # Averaged cells span the original cells of their block (xsection_grid edges)
+    edges = None
+    if regular:
+        edges = (block_edges(time_edges(times), time_factor), block_edges(height_edges(heights), gate_factor))
+    if time_factor > 1:
+        values = block_mean(values, time_factor, axis=1)
+        times = times[::time_factor]
+        if heights.ndim == 2:
+            heights = block_mean(heights, time_factor, axis=1)
+    if gate_factor > 1:
+        values = block_mean(values, gate_factor, axis=0)
+        heights = heights[::gate_factor]
+    return Section(times, heights, values, (time_factor, gate_factor), regular, edges)
+
+
+def mesh_key(times, heights):
+    """Cache key of a grid: shapes and a hash of the times and heights."""
+    digest = hashlib.sha1(np.ascontiguousarray(times).view(np.uint8))
+    digest.update(np.ascontiguousarray(heights).view(np.uint8))
+    return (times.shape, heights.shape, digest.hexdigest())
+
+
+def cached_mesh(times, heights):
+    """pcolormesh cell edges (X datetime64, Y) of a grid, built once per grid."""
+    key = mesh_key(times, heights)
+    if key in _mesh_cache:
+        _mesh_cache.move_to_end(key)
+        return _mesh_cache[key]
+    x = time_edges(times)
+    y = height_edges(heights)
+    if y.ndim == 1:
+        y = y[:, None]
+    shape = (y.shape[0], len(x))
+    mesh = (np.broadcast_to(x, shape), np.broadcast_to(y, shape))
+    _mesh_cache[key] = mesh
+    if len(_mesh_cache) > MESH_CACHE_SIZE:
+        _mesh_cache.popitem(last=False)
+    return mesh
+
+
+def clear_mesh_cache():
+    """Drop all cached meshes."""
+    _mesh_cache.clear()
+
+
+def draw_xsection(ax, times, heights, values, pixels=None, plain=False, **kwargs):
+    """
+    Draw a time-height cross section (values (height, time)) on 'ax' at
+    the output resolution; returns the imshow/pcolormesh mappable.
+    """
+    section = reduce_xsection(times, heights, values, pixels or axes_pixels(ax))
+    imshow = matplotlib.axes.Axes.imshow.__get__(ax) if plain else ax.imshow
+    pcolormesh = matplotlib.axes.Axes.pcolormesh.__get__(ax) if plain else ax.pcolormesh
+    if section.regular:
+        x = mdates.date2num(section.edges[0])
+        y = section.edges[1]
+        # Row 0 is the first gate: at the top when heights decrease
+        origin = 'upper' if y[0] > y[-1] else 'lower'
+        extent = (x[0], x[-1], min(y[0], y[-1]), max(y[0], y[-1]))
+        mappable = imshow(section.values, extent=extent, origin=origin, aspect='auto',
+                             interpolation='nearest', **kwargs)
+        ax.xaxis_date()
+        return mappable
+    X, Y = cached_mesh(section.times, section.heights)
+    return pcolormesh(X, Y, section.values, **kwargs)
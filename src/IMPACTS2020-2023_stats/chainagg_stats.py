@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   chainagg_stats.py
+#
+# Purpose:
+#   Campaign chain aggregate statistics from the Hawkeye-CPI classification
+#   files (*.HawkeyeCPI.classify.merged.raw) of every flight. Flights are
+#   processed in parallel, one worker per flight (all files of a date are
+#   one flight). For each flight it computes the particles, chain aggregates,
+#   the counts of the derived habit categories of
+#   ../ER2-P3_match_plotting/cpi_habits.py and their percentages per second
+#   and per 'window' seconds (as in CRS-vel-dbz_CPL_P3-micro_match_20250422.py)
+#   and, with the P-3 MetNav files, the temperature and altitude of every
+#   second. All window widths come from one set of per second prefix sums
+#   (../ER2-P3_match_plotting/window_counts.py), so several widths cost
+#   little more than one.
+#   From these it writes temperature binned summaries and flight, year and
+#   campaign totals (seconds with chain aggregates, temperature and altitude
+#   range and mean where chain aggregates were seen).
+#
+# Syntax:
+#   ./chainagg_stats.py /data/IMPACTS/aircraft_data -nav_dir /data/IMPACTS/MetNav \
+#       -outdir chainagg_stats
+#
+#   Inputs are classification files or directories searched for them.
+#
+#   Options:
+#       -nav_dir  : directory searched for the P-3 MetNav ICARTT files
+#                   (*YYYYMMDD*.ict) giving Static_Air_Temp and GPS_Altitude
+#       -outdir   : output directory (chainagg_stats)
+#       -window   : seconds per averaging window, one or several (5;
+#                   e.g. -window 5 1 10 30 60, the first goes in the workbooks)
+#       -tbin     : temperature bin width in degrees C (2)
+#       -habits   : derived habit category file (see cpi_habits.py)
+#       -legacy_habits : habit categories of the original match script
+#                   (cpi_habits.LEGACY_CATEGORIES, not exclusive), to
+#                   regenerate past statistics
+#       -nproc    : worker processes (default: all cores)
+#
+#   Output Files (in -outdir):
+#       IMPACTS2020_ChainAggs.ods          per year: flight summary, temperature
+#                                          bins and one 'window' s table per flight
+#       IMPACTS2020-2023_StatsSheet.xlsx   year and campaign totals, all flights,
+#                                          temperature bins per year
+#       flights/20200118_ChainAggs_1s.csv  per second table of each flight
+#       flights/20200118_ChainAggs_5s.csv  per window table of each flight
+#                                          (one per -window width)
+#   Writing .ods/.xlsx needs odfpy/openpyxl; without them each sheet is
+#   written as a CSV file (IMPACTS2020_ChainAggs_Summary.csv, ...). The
+#   hand written notes in this directory are not touched (separate -outdir).
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#     Counts of any window widths from window_counts.WindowCounts, with
+#     percentages of every habit category.
+#     -legacy_habits: Individual_CapCol as in the original match script
+#     (capped columns in generic aggregates counted as individual).
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import argparse
+import glob
+import os
+import re
+import sys
+from collections import defaultdict
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ER2-P3_match_plotting'))
+from adpaa_io import read_classify, read_flat_file
+from cpi_habits import HABIT_CATEGORIES, LEGACY_CATEGORIES, derive_habits, read_habit_categories
+from window_counts import WindowCounts
+
+CLASSIFY_PATTERN = '*.HawkeyeCPI.classify.merged.raw'
+
+# P-3 MetNav ICARTT columns
+NAV_TIME = 'Time_Start'
+NAV_TEMPERATURE = 'Static_Air_Temp'   # deg C
+NAV_ALTITUDE = 'GPS_Altitude'         # m
+
+PROJECT = 'IMPACTS'
+
+
+def flight_date(filename):
+    """Flight date (YYYYMMDD) of a classification file ('22_01_19_123000-125225.HawkeyeCPI...')."""
+    name = os.path.basename(filename)
+    match = re.match(r'(\d\d)_(\d\d)_(\d\d)_', name)
+    if match:
+        return '20' + ''.join(match.groups())
+    match = re.search(r'(20\d{6})', name)
+    if match:
+        return match.group(1)
+    raise ValueError(f'No flight date in file name {filename}')
+
+
+def find_classify_files(inputs):
+    """Classification files given directly or found under input directories."""
+    filenames = []
+    for path in inputs:
+        if os.path.isdir(path):
+            filenames.extend(glob.glob(os.path.join(path, '**', CLASSIFY_PATTERN), recursive=True))
+        else:
+            filenames.append(path)
+    return sorted(set(filenames))
+
+
+def find_nav_file(nav_dir, date):
+    """MetNav ICARTT file of a flight date, or None."""
+    if not nav_dir:
+        return None
+    candidates = sorted(glob.glob(os.path.join(nav_dir, '**', f'*{date}*.ict'), recursive=True))
+    # Prefer MetNav over other P-3 ICARTT products of the same day
+    candidates.sort(key=lambda name: 'metnav' not in os.path.basename(name).lower())
+    return candidates[0] if candidates else None
+
+
+def flight_tasks(inputs, nav_dir=None):
+    """(date, classification files, nav file) for every flight, in date order."""
+    files = defaultdict(list)
+    for filename in find_classify_files(inputs):
+        files[flight_date(filename)].append(filename)
+    return [(date, files[date], find_nav_file(nav_dir, date)) for date in sorted(files)]
+
+
+def flight_counts(table, date, categories=HABIT_CATEGORIES, nav=None):
+    """
+    Particles, chain aggregates and the derived habit categories of a flight
+    as window_counts.WindowCounts (every second from the first to the last
+    particle) and, with 'nav', its temperature (deg C) and altitude (km) per
+    second, averaged over the windows.
+    """
+    columns = {'chainagg_particles': table['ChainAgg'].to_numpy()}
+    columns.update({name: table[name].to_numpy() for name, _ in categories})
+    counts = WindowCounts(table['sfm'].to_numpy(), date, columns)
+
+    temperature = np.full(counts.nseconds, np.nan)
+    altitude = np.full(counts.nseconds, np.nan)
+    if nav is not None:
+        nav_seconds = np.floor(nav[NAV_TIME].to_numpy()).astype(np.int64) - counts.first
+        inside = (nav_seconds >= 0) & (nav_seconds < counts.nseconds)
+        temperature[nav_seconds[inside]] = nav[NAV_TEMPERATURE].to_numpy()[inside]
+        altitude[nav_seconds[inside]] = nav[NAV_ALTITUDE].to_numpy()[inside] / 1000.
+    counts.add_mean('temperature', temperature)
+    counts.add_mean('altitude', altitude)
+    return counts
+
+
+def per_second_stats(table, date, categories=HABIT_CATEGORIES, nav=None):
+    """
+    Per second table of a flight (every second from the first to the last
+    particle): particles, chain aggregates, the count of each derived habit
+    category, their percentages and, with 'nav', temperature (deg C) and
+    altitude (km).
+    """
+    return flight_counts(table, date, categories, nav).fixed(1)
+
+
+def count_columns(table):
+    """Count columns of a per second or per window table (summed over seconds)."""
+    return [name for name in table.columns
+            if name not in ('time', 'sfm', 'temperature', 'altitude') and not name.startswith('percentage_')]
+
+
+def chain_summary(per_second):
+    """Totals, seconds with chain aggregates and their temperature/altitude range and mean."""
+    chains = per_second[per_second['chainagg_particles'] > 0]
+    total = int(per_second['total_particles'].sum())
+    chainagg = int(per_second['chainagg_particles'].sum())
+    return {
+        'total_particles': total,
+        'chainagg_particles': chainagg,
+        'percentage_chainagg': chainagg / total * 100 if total else np.nan,
+        'seconds_with_chains': len(chains),
+        'minutes_with_chains': len(chains) / 60.,
+        'Tmin [C]': chains['temperature'].min(),
+        'Tmax [C]': chains['temperature'].max(),
+        'Tmean [C]': chains['temperature'].mean(),
+        'Zmin [km]': chains['altitude'].min(),
+        'Zmax [km]': chains['altitude'].max(),
+        'Zmean [km]': chains['altitude'].mean(),
+    }
+
+
+def temperature_bins(per_second, tbin=2.0):
+    """Counts per temperature bin (lower edge, deg C) over the seconds with a temperature."""
+    with_temperature = per_second[np.isfinite(per_second['temperature'])]
+    counts = count_columns(with_temperature)
+    edges = np.floor(with_temperature['temperature'].to_numpy() / tbin) * tbin
+    grouped = with_temperature.groupby(edges)
+    binned = grouped[counts].sum()
+    binned.insert(0, 'seconds', grouped.size())
+    binned.insert(1, 'seconds_with_chains', grouped['chainagg_particles'].apply(lambda c: int((c > 0).sum())))
+    binned['percentage_chainagg'] = binned['chainagg_particles'] / binned['total_particles'] * 100
+    binned.index.name = 'T bin [C]'
+    return binned.reset_index()
+
+
+def flight_stats(task, windows=(5,), categories=HABIT_CATEGORIES, exclusive=True):
+    """Worker: per second table, {width: table} of the 'windows' and the summary of one flight."""
+    date, filenames, nav_file = task
+    table = pd.concat([read_classify(filename) for filename in filenames], ignore_index=True)
+    derive_habits(table, categories, exclusive)
+    nav = read_flat_file(nav_file) if nav_file else None
+    counts = flight_counts(table, date, categories, nav)
+    per_second = counts.fixed(1)
+    summary = {'date': date, 'files': len(filenames), 'nav_file': os.path.basename(nav_file) if nav_file else '',
+               'start': per_second['time'].iloc[0].strftime('%H:%M:%S'),
+               'end': per_second['time'].iloc[-1].strftime('%H:%M:%S')}
+    summary.update(chain_summary(per_second))
+    for name, _ in categories:
+        summary[name] = int(per_second[name].sum())
+    return date, per_second, counts.stats(windows), summary
+
+
+def write_workbook(filename, sheets):
+    """Write DataFrames (sheet name -> table) to .ods/.xlsx, or CSV files without a writer engine."""
+    try:
+        with pd.ExcelWriter(filename) as writer:
+            for name, sheet in sheets.items():
+                sheet.to_excel(writer, sheet_name=name[:31], index=False)
+        print('Wrote', filename)
+    except ImportError as error:
+        stem = os.path.splitext(filename)[0]
+        for name, sheet in sheets.items():
+            sheet.to_csv(f'{stem}_{name}.csv', index=False)
+        print(f'Wrote {stem}_*.csv ({error})')
+
+
+def year_summary(year, summaries, per_seconds):
+    """One StatsSheet row: flights, minutes with chains, temperature/altitude over chain seconds."""
+    row = {'Year': year, 'Flights': len(summaries),
+           'Flights w/ Chains': sum(summary['chainagg_particles'] > 0 for summary in summaries)}
+    row.update(chain_summary(pd.concat(per_seconds, ignore_index=True)))
+    return row
+
+
+def chainagg_stats(inputs, nav_dir=None, outdir='chainagg_stats', window=5, tbin=2.0, habits=None, nproc=None,
+                   legacy_habits=False):
+    """
+    Compute and write the statistics of all flights; returns the flight
+    summaries. 'window' is one width (s) or several; the workbooks hold the
+    tables of the first. legacy_habits: the habit categories of the
+    original match script instead of 'habits'.
+    """
+    windows = [int(width) for width in np.atleast_1d(window)]
+    if legacy_habits:
+        categories, exclusive = LEGACY_CATEGORIES, False
+    else:
+        categories, exclusive = (read_habit_categories(habits) if habits else HABIT_CATEGORIES), True
+    tasks = flight_tasks(inputs, nav_dir)
+    if not tasks:
+        print('No classification files found.')
+        return []
+    os.makedirs(os.path.join(outdir, 'flights'), exist_ok=True)
+
+    results = {}
+    with Pool(nproc) as pool:
+        for date, per_second, windowed, summary in pool.imap_unordered(
+                partial(flight_stats, windows=windows, categories=categories, exclusive=exclusive), tasks):
+            per_second.to_csv(os.path.join(outdir, 'flights', f'{date}_ChainAggs_1s.csv'), index=False)
+            for width, table in windowed.items():
+                table.to_csv(os.path.join(outdir, 'flights', f'{date}_ChainAggs_{width}s.csv'), index=False)
+            results[date] = (per_second, windowed[windows[0]], summary)
+            print(f"{date}: {summary['total_particles']} particles, {summary['chainagg_particles']} chain aggregates"
+                  + ('' if summary['nav_file'] else ' (no MetNav file)'))
+
+    years = defaultdict(list)
+    for date in sorted(results):
+        years[date[:4]].append(date)
+    year_rows, temperature_tables = [], []
+    for year, dates in years.items():
+        summaries = [results[date][2] for date in dates]
+        per_seconds = [results[date][0] for date in dates]
+        binned = temperature_bins(pd.concat(per_seconds, ignore_index=True), tbin)
+        sheets = {'Summary': pd.DataFrame(summaries), 'Temperature': binned}
+        sheets.update({date: results[date][1] for date in dates})
+        write_workbook(os.path.join(outdir, f'{PROJECT}{year}_ChainAggs.ods'), sheets)
+        year_rows.append(year_summary(year, summaries, per_seconds))
+        temperature_tables.append(binned.assign(Year=year))
+
+    all_per_seconds = [results[date][0] for date in sorted(results)]
+    year_rows.append(year_summary('Total', [results[date][2] for date in sorted(results)], all_per_seconds))
+    temperature_tables.append(temperature_bins(pd.concat(all_per_seconds, ignore_index=True), tbin).assign(Year='Total'))
+    span = min(years) if len(years) == 1 else f'{min(years)}-{max(years)}'
+    write_workbook(os.path.join(outdir, f'{PROJECT}{span}_StatsSheet.xlsx'), {
+        'Summary': pd.DataFrame(year_rows),
+        'Flights': pd.DataFrame([results[date][2] for date in sorted(results)]),
+        'Temperature': pd.concat(temperature_tables, ignore_index=True),
+    })
+    return [results[date][2] for date in sorted(results)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Chain aggregate statistics of all flights from Hawkeye-CPI classification files.")
+    parser.add_argument("inputs", nargs='+', help="Classification files or directories searched for them.")
+    parser.add_argument("-nav_dir", type=str, default=None, help="Directory with the P-3 MetNav .ict files (temperature, altitude).")
+    parser.add_argument("-outdir", type=str, default='chainagg_stats', help="Output directory.")
+    parser.add_argument("-window", type=int, nargs='+', default=[5],
+                        help="Seconds per averaging window, one or several (e.g. 1 5 10 30 60).")
+    parser.add_argument("-tbin", type=float, default=2.0, help="Temperature bin width (deg C).")
+    parser.add_argument("-habits", type=str, default=None, help="Derived habit category file ('name = expression' lines).")
+    parser.add_argument("-legacy_habits", action="store_true",
+                        help="Habit categories of the original match script, to regenerate past statistics.")
+    parser.add_argument("-nproc", type=int, default=os.cpu_count(), help="Number of worker processes (default: all CPU cores).")
+    args = parser.parse_args()
+
+    chainagg_stats(args.inputs, nav_dir=args.nav_dir, outdir=args.outdir, window=args.window, tbin=args.tbin,
+                   habits=args.habits, nproc=args.nproc, legacy_habits=args.legacy_habits)
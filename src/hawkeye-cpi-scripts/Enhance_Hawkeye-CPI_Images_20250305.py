@@ -6,6 +6,7 @@ Script for processing images, enhancing contrast, and converting white backgroun
 Purpose:
     - The script takes images from an input directory, applies image processing techniques to enhance contrast,
       and saves the results in an output directory.
+    - Each image is enhanced, made transparent and written exactly once (single pass, no PNG round trips).
 
 Usage:
     python3 Enhance_Hawkeye-CPI_Images_20250227.py -input_dir /path/to/input -output_dir /path/to/output
@@ -14,8 +15,19 @@ Example:
     python3 Enhance_Hawkeye-CPI_Images_20250227.py -input_dir ./raw_images -output_dir ./processed_images
 
 Arguments:
-    -input_dir   : (Required) Path to the directory containing input PNG images.
+    -input_dir   : (Required) Path to the directory containing input PNG images
+                   and/or packed particle archives (*.particles.npz).
     -output_dir  : (Required) Path to the directory where processed images will be saved.
+    -nproc       : (Optional) Number of workers (default: all CPU cores).
+    -max_in_flight : (Optional) Tasks queued at once (default: 4 per worker).
+    -threads     : (Optional) Use worker threads instead of worker processes.
+    -force       : (Optional) Reprocess every input (ignore the manifest).
+    -checksum    : (Optional) Check input contents (SHA-1), not only size and time.
+
+Manifest:
+    enhance_manifest.jsonl in the output directory records each input (size, modification
+    time, enhancement parameters) and its outputs; reruns only process new or changed inputs
+    (see hawkeye_manifest.py).
 
 Help:
     Use the `-h` flag to display this message:
@@ -24,21 +36,46 @@ Help:
 Modifications:
     Christian Nairy <christian.nairy@und.edu> - 2025/02/26:
         Written
+    2026/10/18:
+        Read particles straight from packed particle archives (*.particles.npz).
+        Single pass: build the transparent RGBA image in memory and write each output once
+        (replaces the separate transparency and rename passes).
+        Enhancement steps moved to hawkeye_enhance.py; images are enhanced in batches
+        grouped by shape (vectorized Otsu threshold, hole filling and mask, cached gradients).
+        No more h_particle/w_particle globals; added -threads to run the workers as threads.
+        Resumable/incremental runs through the enhancement manifest; added -force and -checksum.
+        Tasks are generated while walking the input tree with a bounded number in flight, so
+        processing starts immediately; worker count is set with -nproc (was fixed at 28).
+        Archives are opened once per worker and their file state is taken once per archive.
 """
 
 from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+import threading
+from collections import OrderedDict
 import os
-import cv2
-import numpy as np
-import glob
 import argparse
 import matplotlib.pyplot as plt
-from skimage import io, color, filters, exposure
-from scipy import ndimage
+from skimage import io
 from PIL import Image  # For saving with 300 DPI
+from functools import partial
 from tqdm import tqdm
+from hawkeye_archive import ARCHIVE_SUFFIX, ParticleArchive, link_view
+from hawkeye_enhance import ENHANCE_PARAMETERS, enhance_batch, make_transparent
+from hawkeye_manifest import EnhanceManifest, file_state, manifest_key
+
+# Particles per task (PNG files or packed archive entries); each task is
+# enhanced as one batch
+BATCH_SIZE = 64
+
+# Tasks handed to the pool per worker before their results are collected
+IN_FLIGHT_PER_WORKER = 4
 
-global h_particle, w_particle
+# Particle archives kept open per worker (least recently used dropped first)
+ARCHIVE_CACHE_SIZE = 4
+
+_archives = OrderedDict()
+_archives_lock = threading.Lock()
 
 def debug_thresholding(image, step_name):
     plt.figure(figsize=(5, 5), dpi=300)
@@ -47,158 +84,170 @@ def debug_thresholding(image, step_name):
     plt.axis('off')
     plt.show()
 
-def fill_holes_morphologically(binary_image, kernel_size=1, iterations=1):
-    binary_image = (binary_image * 255).astype(np.uint8) if binary_image.dtype != np.uint8 else binary_image
-    adaptive_kernel_size = min(kernel_size, max(binary_image.shape) // 100)
-    kernel = np.ones((adaptive_kernel_size, adaptive_kernel_size), np.uint8)
-    open_image = binary_image.copy()
-    for _ in range(iterations):
-        open_image = cv2.morphologyEx(open_image, cv2.MORPH_CLOSE, kernel)
-    return open_image
-
-def extract_red_mask(original_image, binary_image):
-    filled_image = ndimage.binary_fill_holes(binary_image).astype(np.uint8)
-    mask = filled_image - binary_image
-    mask = (mask * 255).astype(np.uint8)
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.dilate(mask, kernel, iterations=1)
-    return mask
-
-def create_radial_gradient(shape):
-    h, w = shape
-    y, x = np.indices((h, w))
-    center_x, center_y = w // 2, h // 2
-    radius = np.sqrt((x - center_x) ** 2 + (y - center_y) ** 2)
-    radius = radius / np.max(radius)
-    return (255 - (radius * 125)).astype(np.uint8)
-
-def enhance_contrast(image):
-    return exposure.equalize_adapthist(image, clip_limit=0.017) * 255
-
-def apply_mask_and_radial_background(original_image, mask):
-    gradient = create_radial_gradient(original_image.shape)
-    enhanced_image = enhance_contrast(original_image)
-    particle = np.where(mask == 255, enhanced_image, 255)
-    return np.where(mask == 255, particle, gradient)
-
-def pad_to_standard_fov(image, target_size=(1024, 1024)):
-    global h_particle, w_particle
-    h_particle, w_particle = image.shape[:2]
-    pad_y = max((target_size[0] - h_particle) // 2, 0)
-    pad_x = max((target_size[1] - w_particle) // 2, 0)
-    return cv2.copyMakeBorder(image, pad_y, pad_y, pad_x, pad_x, cv2.BORDER_CONSTANT, value=255)
-
-def add_scale_bar(image, binary_mask, microns_per_pixel=2.3, scale_length_microns=500):
-    scale_length_pixels = int(scale_length_microns / microns_per_pixel)
-    bar_height = 10
-    output_image = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_GRAY2RGB)
-    
-    start_y = round((1024 - h_particle) / 2) - 15
-    start_x = round((1024 - w_particle) / 2)
-    end_x = start_x + scale_length_pixels
-    end_y = start_y + bar_height
-    
-    cv2.rectangle(output_image, (start_x, start_y), (end_x, end_y), (255, 0, 0), -1)
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    cv2.putText(output_image, "500 microns", (start_x + 25, start_y - 5), font, 0.8, (255, 0, 0), 2, cv2.LINE_AA)
-    return output_image
+def enhanced_path(image_path, output_folder):
+    return os.path.join(output_folder, os.path.basename(image_path).replace('.png', '_enhanced.png'))
 
 def process_image(image_path, output_folder):
-    global h_particle, w_particle
-    image = io.imread(image_path)
-    gray_image = color.rgb2gray(image) * 255 if len(image.shape) == 3 else image
-    gray_image = gray_image.astype(np.uint8)
-    
-    h_particle, w_particle = gray_image.shape[:2]
-
-    border_size = 10
-    gray_image = cv2.copyMakeBorder(
-        gray_image, border_size, border_size, border_size, border_size, 
-        cv2.BORDER_CONSTANT, value=190
-    )
-
-    thresh = filters.threshold_otsu(gray_image)
-    adjusted_thresh = thresh * 1.05
-    binary_image = gray_image > adjusted_thresh
-
-    closed_binary_image = fill_holes_morphologically(binary_image, iterations=1)
-    mask = extract_red_mask(gray_image, closed_binary_image)
-
-    final_image = apply_mask_and_radial_background(gray_image, mask)
-    final_image_no_scale = final_image[border_size:-border_size, border_size:-border_size]
-
-    padded_image = pad_to_standard_fov(final_image_no_scale)
-    final_image_with_scale = add_scale_bar(padded_image, closed_binary_image)
-    
+    process_image_batch([image_path], output_folder)
+
+def process_image_batch(image_paths, output_folder, checksum=False):
+    """
+    Enhance a batch of PNG files (see hawkeye_enhance.enhance_batch).
+    Returns manifest records (input path, part, input state, outputs).
+    """
+    states = [file_state(image_path, checksum) for image_path in image_paths]
+    final_images = enhance_batch([io.imread(image_path) for image_path in image_paths])
     os.makedirs(output_folder, exist_ok=True)
-    save_path = os.path.join(output_folder, os.path.basename(image_path).replace('.png', '_enhanced.png'))
-    plt.imsave(save_path, final_image_with_scale, cmap='gray', dpi=300)
-
-def process_image_wrapper(args):
-    """Wrapper function to unpack arguments for process_image."""
-    return process_image(*args)
-
-def convert_image_to_transparent(image_path):
-    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
-    if image.shape[-1] != 4:
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2RGBA)
-
-    white_mask = (image[:, :, 0] == 255) & (image[:, :, 1] == 255) & (image[:, :, 2] == 255)
-    image[:, :, 3] = np.where(white_mask, 0, 255)
-
-    pil_image = Image.fromarray(image)
-    pil_image.save(image_path, dpi=(300, 300))
-
-def rename_and_cleanup(file_path):
-    new_name = file_path.replace("_transparent.png", "_enhanced.png")
-    os.rename(file_path, new_name)
-
-def process_images_in_subdirectories(input_root, output_root):
-    all_image_tasks = []
+    records = []
+    for image_path, state, enhanced in zip(image_paths, states, final_images):
+        save_path = enhanced_path(image_path, output_folder)
+        save_enhanced_image(enhanced.image, save_path)
+        records.append((image_path, None, state, [save_path]))
+    return records
+
+def open_archive(archive_path, state):
+    """
+    Packed particle archive, opened once per worker (process) and reused by
+    all its batches; 'state' (file_state) reopens it if the file changed.
+    """
+    key = (archive_path, tuple(sorted(state.items())))
+    with _archives_lock:
+        if key in _archives:
+            _archives.move_to_end(key)
+            return _archives[key]
+        archive = ParticleArchive(archive_path)
+        _archives[key] = archive
+        if len(_archives) > ARCHIVE_CACHE_SIZE:
+            _archives.popitem(last=False)
+        return archive
+
+def process_archive_batch(archive_path, start, stop, output_folder, state):
+    """
+    Enhance particles start:stop of a packed particle archive (hawkeye_archive.py);
+    'state' is the archive's file_state, taken once when its tasks were made.
+    """
+    archive = open_archive(archive_path, state)
+    file_base = os.path.basename(archive_path)[:-len(ARCHIVE_SUFFIX)]
+    rows, images = next(archive.batches(stop - start, range(start, stop)))
+    outputs = []
+    for i, enhanced in zip(rows, enhance_batch(images)):
+        # Enhance once; the other views (_C1/_C2) are links to the first file
+        save_paths = []
+        for view in archive.views:
+            view_folder = os.path.join(output_folder, f"{file_base}_{view}")
+            os.makedirs(view_folder, exist_ok=True)
+            save_paths.append(os.path.join(view_folder, archive.filename(i, view).replace('.png', '_enhanced.png')))
+        save_enhanced_image(enhanced.image, save_paths[0])
+        for save_path in save_paths[1:]:
+            link_view(save_paths[0], save_path)
+        outputs.extend(save_paths)
+    return [(archive_path, archive_part(start, stop), state, outputs)]
+
+def archive_part(start, stop):
+    """Manifest name of an archive batch (particles start:stop)."""
+    return f"{start}:{stop}"
+
+def process_image_wrapper(args, checksum=False):
+    """Wrapper function to unpack arguments for process_image_batch (or process_archive_batch)."""
+    if isinstance(args[0], str) and args[0].endswith(ARCHIVE_SUFFIX):
+        return process_archive_batch(*args)
+    return process_image_batch(*args, checksum=checksum)
+
+def save_enhanced_image(rgb_image, save_path):
+    """Write the final transparent PNG (300 DPI) in one encode."""
+    Image.fromarray(make_transparent(rgb_image)).save(save_path, dpi=(300, 300))
+
+def discover_tasks(input_root, output_root, needs_processing, checksum=False):
+    """
+    Generate enhancement tasks while walking the input tree: batches of up to
+    BATCH_SIZE PNG files from one directory, or BATCH_SIZE-particle slices of
+    a packed archive (with the archive's file state). Inputs for which
+    needs_processing(path, part) is False are left out. Output directories
+    are made by the workers.
+    """
     for root, _, files in os.walk(input_root):
-        for file in files:
+        output_subdir = os.path.normpath(os.path.join(output_root, os.path.relpath(root, input_root)))
+        png_batch = []
+        for file in sorted(files):
+            input_path = os.path.join(root, file)
             if file.lower().endswith('.png'):
-                input_path = os.path.join(root, file)
-                output_subdir = root.replace(input_root, output_root)
-                os.makedirs(output_subdir, exist_ok=True)
-                all_image_tasks.append((input_path, output_subdir))
-        
-        print(f"Processing images in '{root}'...")
-
-    with Pool(processes=28) as pool:
-        for _ in tqdm(pool.imap_unordered(process_image_wrapper, all_image_tasks), 
-                      total=len(all_image_tasks), 
-                      desc="Processing Images"):
-            pass
-
-def convert_white_to_transparent(output_root):
-    image_files = glob.glob(os.path.join(output_root, "**", "*_enhanced.png"), recursive=True)
-    print(f"Converting {len(image_files)} images to transparency...")
-
-    with Pool(processes=28) as pool:
-        for _ in tqdm(pool.imap_unordered(convert_image_to_transparent, image_files), 
-                      total=len(image_files), 
-                      desc="Converting to Transparent"):
-            pass
-
-def cleanup_and_rename(output_root):
-    files_to_cleanup = glob.glob(os.path.join(output_root, "**", "*_transparent.png"), recursive=True)
-    print(f"Cleaning up and renaming {len(files_to_cleanup)} images...")
-
-    with Pool(processes=28) as pool:
-        for _ in tqdm(pool.imap_unordered(rename_and_cleanup, files_to_cleanup), 
-                      total=len(files_to_cleanup), 
-                      desc="Cleaning Up and Renaming"):
-            pass
+                if needs_processing(input_path):
+                    png_batch.append(input_path)
+                    if len(png_batch) == BATCH_SIZE:
+                        yield (png_batch, output_subdir)
+                        png_batch = []
+            elif file.endswith(ARCHIVE_SUFFIX):
+                # Packed particle archive from the Level-1 dumper (-format archive)
+                state = file_state(input_path, checksum)
+                num_particles = len(open_archive(input_path, state))
+                for start in range(0, num_particles, BATCH_SIZE):
+                    stop = min(start + BATCH_SIZE, num_particles)
+                    if needs_processing(input_path, archive_part(start, stop)):
+                        yield (input_path, start, stop, output_subdir, state)
+        if png_batch:
+            yield (png_batch, output_subdir)
+
+def bounded(tasks, slots, stop):
+    """Pass tasks on only while a slot (threading.Semaphore) is free; end once stop is set."""
+    for task in tasks:
+        slots.acquire()
+        if stop.is_set():
+            return
+        yield task
+
+def process_images_in_subdirectories(input_root, output_root, threads=False, force=False, checksum=False,
+                                     processes=None, max_in_flight=None):
+    # Inputs already enhanced with the current parameters (manifest in the
+    # output root) are skipped unless force is set
+    manifest = EnhanceManifest(output_root, ENHANCE_PARAMETERS, checksum=checksum)
+    skipped = 0
+    def needs_processing(input_path, part=None):
+        nonlocal skipped
+        if force or not manifest.up_to_date(manifest_key(input_root, input_path, part), input_path):
+            return True
+        skipped += 1
+        return False
+
+    # Tasks are discovered while the pool works on the first ones. The pool
+    # would otherwise drain the whole generator up front, so at most
+    # max_in_flight tasks are handed out before their results are back.
+    processes = processes or cpu_count()
+    max_in_flight = max_in_flight or IN_FLIGHT_PER_WORKER * processes
+    slots = threading.Semaphore(max_in_flight)
+    stop = threading.Event()
+    tasks = bounded(discover_tasks(input_root, output_root, needs_processing, checksum), slots, stop)
+
+    # Enhancement keeps no global state, so a thread pool (no pickling of
+    # tasks/results) can be used instead of worker processes
+    pool_class = ThreadPool if threads else Pool
+    with manifest, pool_class(processes=processes) as pool:
+        try:
+            for records in tqdm(pool.imap_unordered(partial(process_image_wrapper, checksum=checksum), tasks),
+                                desc="Processing Images", unit="batch"):
+                slots.release()
+                for input_path, part, state, outputs in records:
+                    manifest.record(manifest_key(input_root, input_path, part), state, outputs)
+        finally:
+            # Let task discovery finish if a task failed
+            stop.set()
+            slots.release()
+
+    if skipped:
+        print(f"Skipped {skipped} inputs already up to date in {manifest.path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Enhance PNG images from multiple subdirectories.")
     parser.add_argument("-input_dir", type=str, required=True, help="Path to the root input directory.")
     parser.add_argument("-output_dir", type=str, required=True, help="Path to the root output directory.")
+    parser.add_argument("-nproc", type=int, default=cpu_count(), help="Number of workers (default: all CPU cores).")
+    parser.add_argument("-max_in_flight", type=int, default=None, help=f"Maximum tasks queued at once (default: {IN_FLIGHT_PER_WORKER} per worker).")
+    parser.add_argument("-threads", action="store_true", help="Run the workers as threads in one process instead of separate processes.")
+    parser.add_argument("-force", action="store_true", help="Reprocess every input, even if the manifest says its outputs are up to date.")
+    parser.add_argument("-checksum", action="store_true", help="Compare file contents (SHA-1) when an input's modification time changed.")
     args = parser.parse_args()
 
-    process_images_in_subdirectories(args.input_dir, args.output_dir)
-    convert_white_to_transparent(args.output_dir)
-    cleanup_and_rename(args.output_dir)
+    process_images_in_subdirectories(args.input_dir, args.output_dir, threads=args.threads,
+                                     force=args.force, checksum=args.checksum,
+                                     processes=args.nproc, max_in_flight=args.max_in_flight)
 
     print("All images processed successfully!")
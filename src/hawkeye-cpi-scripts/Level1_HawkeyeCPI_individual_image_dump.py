@@ -19,11 +19,30 @@
 #   Output Files:
 #       IMPACTS_HawkeyeCPI_20230115191319191424206_######.png   
 #           (Where ###### is the image number)
+#       or, with -format archive, one packed archive per roi file:
+#       20230115191319.particles.npz (see hawkeye_archive.py)
 #
 #   Execution Example:
 #       Need to be in the directory where your roi files are located. Then:
 #       ./Level1_HawkeyeCPI_individual_image_dump.py
 #
+#       Only particles from 12:31 to 12:51 UTC that are 75-1000 pixels:
+#       ./Level1_HawkeyeCPI_individual_image_dump.py -start 2022-01-19T12:31:00 \
+#           -end 2022-01-19T12:51:00 -max_px 1000
+#
+#   Options (all optional):
+#       -input_dir, -output_dir : roi and output directories (default: cwd)
+#       -start, -end            : UTC time window
+#       -min_px                 : smallest dimension must exceed this (75)
+#       -max_px                 : largest dimension limit
+#       -max_aspect             : longest/shortest dimension limit
+#       -format                 : png (default) or archive
+#       -nproc                  : worker processes (default: all cores)
+#       -follow FILE            : in-flight mode, export particles of a roi
+#                                 file as the probe writes them (png only)
+#       -poll_interval, -idle_timeout : follow mode polling period and stop
+#                                 after this many seconds without new data
+#
 # Modification History:
 #   2023/09/25 - Christian Nairy <christian.nairy@und.edu>
 #     Written.
@@ -31,6 +50,15 @@
 #     Added muliprocessing capabilities.
 #   2025/03/19 - Christian Nairy <christian.nairy@und.edu>
 #     Fixed '&' 'and' issue that unnessesarily removed good particles.
+#   2026/10/18
+#     Read roi files through the memory-mapped block index in hawkeye_roi.py
+#     instead of walking each file two bytes at a time.
+#     Reuse the per-particle sidecar index (*.roi.idx) between runs.
+#     Added time-window and size-filtered extraction options.
+#     Added packed archive output; _C2 images are hard links to _C1.
+#     Split large roi files across the worker pool; configurable pool size.
+#     Particles are selected once per roi file; each task gets its share.
+#     Added -follow mode for roi files still being written during flight.
 #
 # Copyright 2025 David Delene
 #
@@ -53,138 +81,181 @@
 """
 
 #Imports
-import struct
-import numpy as np
+import argparse
 import os
+from functools import partial
 from PIL import Image
 from multiprocessing import Pool
-
-# Define block types
-IMAGE_BLOCK = 0xB2E6
-METADATA_BLOCK = 0xA3D5
+from hawkeye_roi import SPLIT_SIZE, RoiFile, RoiFollower, find_particles, follow, particle_index, time_codes
+from hawkeye_archive import archive_filename, link_view, write_archive
 
 # Main script
 input_directory = os.getcwd()
 output_base_directory = os.getcwd()
-# Create the output base directory if it doesn't exist
-os.makedirs(output_base_directory, exist_ok=True)
+
+#### PARTICLE THRESHOLD (75 pixels) ESTIMATE ####
+# 2.3 microns * 75 pixels = 172.5 microns
+# Eliminates small particles:
+MIN_PIXELS = 75
+
+# Particles written per pool task; large roi files are split into many tasks
+PARTICLES_PER_TASK = 1000
+
+
+def image_name(date, time, img_num):
+    """Base name of a particle image (without the _C1/_C2 suffix)."""
+    return f'IMPACTS_HawkeyeCPI_{date}{time:09d}_{img_num:06d}'
 
 
+def select_roi_particles(filename, input_directory=input_directory, start=None, end=None,
+                         min_px=MIN_PIXELS, max_px=None, max_aspect=None, pool=None):
+    """
+    Index one roi file (writing its sidecar) and select the particles to
+    export: their particle table records and image numbers.
+    """
+    roi_path = os.path.join(input_directory, filename)
+    with RoiFile(roi_path, pool=pool) as roi_file:
+        table = particle_index(roi_path, roi_file)
+        rows, numbers = find_particles(roi_file, table, start, end, min_px, max_px, max_aspect)
+        return table[rows], numbers
+
 
 # Define the processing function for each .roi file
-def process_roi_file(filename):
+def process_roi_file(filename, input_directory=input_directory,
+                     output_base_directory=output_base_directory,
+                     start=None, end=None, min_px=MIN_PIXELS, max_px=None, max_aspect=None,
+                     output_format='png', selection=None):
     if not filename.endswith(".roi"):
         return
     
     file_base = os.path.splitext(os.path.basename(filename))[0]
+    date = str(file_base)
+    roi_path = os.path.join(input_directory, filename)
+
+    # Particles are selected from the *.roi.idx sidecar index (binary search
+    # on time, then size filters) and only those blocks are read; each image
+    # is a view into the memory-mapped roi file. Image numbers count every
+    # particle in the file, so they match a full dump. Particles with a time
+    # at/below 1000 are not numbered (sampling transition from
+    # 23:59:59 - 00:00:00 UTC the next day). A task's share of a file comes
+    # already selected ('selection': records, image numbers) from
+    # select_roi_particles, so the file is not indexed again per task.
+    if selection is None:
+        selection = select_roi_particles(filename, input_directory, start, end, min_px, max_px, max_aspect)
+    records, numbers = selection
+    names = [image_name(date, time, img_num) for time, img_num in zip(time_codes(records), numbers)]
+
+    with RoiFile(roi_path) as roi_file:
+        if output_format == 'archive':
+            # One packed archive per roi file; _C1/_C2 are index entries
+            archive_path = archive_filename(output_base_directory, file_base)
+            print(f'From file: {filename} - Writing: {os.path.basename(archive_path)} ({len(records)} particles)')
+            write_archive(archive_path, roi_file, records, numbers, names)
+            return
+
+        output_directory1 = os.path.join(output_base_directory, file_base + '_C1')
+        output_directory2 = os.path.join(output_base_directory, file_base + '_C2')
+        os.makedirs(output_directory1, exist_ok=True)
+        os.makedirs(output_directory2, exist_ok=True)
+
+        for name, particle in zip(names, roi_file.particles(records)):
+            print(f'From file: {filename} - Writing: {name}.png')
+            save_particle(particle.image, name, output_directory1, output_directory2)
+
+
+def save_particle(image, name, output_directory1, output_directory2):
+    """Save individual images; the _C2 copy is a hard link to the _C1 file
+    rather than a second PNG encode."""
+    path1 = os.path.join(output_directory1, f'{name}_C1.png')
+    Image.fromarray(image).save(path1)
+    link_view(path1, os.path.join(output_directory2, f'{name}_C2.png'))
+
+
+def follow_roi_file(filename, input_directory=input_directory,
+                    output_base_directory=output_base_directory,
+                    start=None, end=None, min_px=MIN_PIXELS, max_px=None, max_aspect=None,
+                    poll_interval=1.0, idle_timeout=None):
+    """
+    Write the particles of a roi file that is still being written by the
+    probe as they arrive (checked every 'poll_interval' seconds). Stops once
+    the file has not grown for 'idle_timeout' seconds (never if None).
+    """
+    file_base = os.path.splitext(os.path.basename(filename))[0]
+    date = str(file_base)
     output_directory1 = os.path.join(output_base_directory, file_base + '_C1')
     output_directory2 = os.path.join(output_base_directory, file_base + '_C2')
     os.makedirs(output_directory1, exist_ok=True)
     os.makedirs(output_directory2, exist_ok=True)
 
-    count = 0
-    with open(os.path.join(input_directory, filename), 'rb') as file:
-        while True:
-            header_format = "<H"
-            header_size = struct.calcsize(header_format)
-            header_data = file.read(header_size)
-            
-            if len(header_data) != header_size:
-                break
-                
-            block_type = struct.unpack(header_format, header_data)[0]
-
-
- #if Hexdecimal block type equals defined above then format the block information
-            if block_type == METADATA_BLOCK:
-                # Handle metadata block
-                # L = Long, H = int, f = float, B = byte
-                meta_format = "<L H H L B B B B H H H H H H H H L B B H f f L B B H H H L L B B L H"
-                meta_size = struct.calcsize(meta_format)
-                meta_data = file.read(meta_size)
-                if len(meta_data) != meta_size:
-                    break  # Handle incomplete header
-            
-                meta_values = struct.unpack(meta_format, meta_data)
-                blksize2, ver2, numrois, tot, day, hour, minu, sec, msec, typ, starx, stary, endx, endy, bgrate, bgpdsthresh, nframes, ithresh, roierr, roimin, roiaspe, roifill, roifcount, imgmean, bkgmean, spare, roixpad, roiypad, strobecnt, framessav, imgminval, imgmaxval, nroisaved, checksum = meta_values
-                hour = "{:02d}".format(hour)
-                minu = "{:02d}".format(minu)
-                sec = "{:02d}".format(sec)
-                msec = "{:03d}".format(msec)
-                time = str(hour + minu + sec + msec)
-                
-
-            if block_type == IMAGE_BLOCK:
-                image_header_format = "<L H H H H H H H f L L f L L H f f"
-                image_header_size = struct.calcsize(image_header_format)
-                image_header_data = file.read(image_header_size)
-                if len(image_header_data) != image_header_size:
-                    break  # Handle incomplete header
-            
-                image_header_values = struct.unpack(image_header_format, image_header_data)
-                blksize, version, sx, sy, ex, ey, pix, flags, leng, starlen, endlen, width, starwid, endwid, roidepth, area, perim = image_header_values
-                
-                # Check for valid dimensions
-                # leng = leng
-                totx = ex - sx + 1
-                toty = ey - sy + 1
-                if totx <= 0 or toty <= 0:
-                    print(time)
-                    print("Invalid dimensions, skipping block.")
-                    continue
-                
-                if totx > 5000 or version > 5000:
-                    print(time)
-                    print("Invalid dimensions, skipping block.")
-                    continue
-                
-                roi = np.zeros((toty, totx), dtype=np.uint8)
-                
-                cur_ptr = file.tell()
-                
-                # Get the file size
-                file_size = os.fstat(file.fileno()).st_size
-                
-                # Check if there are enough bytes remaining in the file for 'roi'
-                if (file_size - cur_ptr) >= roi.size:
-                    # Read the 'roi' data from the file
-                    roi_data = file.read(roi.size)
-                    roi = np.frombuffer(roi_data, dtype=np.uint8).reshape((toty, totx))
-                else:
-                    # Otherwise, move the file pointer to the end of the file
-                    file.seek(0, os.SEEK_END)
-                
-                array = np.array(roi)
-                img = Image.fromarray(array)
-                
-                # Increment the count for unique image filenames
-                # Helps solve the issue where sampling transitions
-                # from 23:59:59 - 00:00:00 UTC the next day.
-                if int(time) > 1000:
-                    date = str(file_base)
-                    # print(date)
-                    count += 1
-                    # Obtain image time
-                    time = str(hour + minu + sec + msec)
-                    # Obtain image numbers
-                    img_num = "{:06d}".format(count)
-                    
-                    #### PARTICLE THRESHOLD (75 pixels) ESTIMATE ####
-                    # 2.3 microns * 75 pixels = 172.5 microns
-                    # Eliminates small particles:
-                    if int(totx) > 75 and int(toty) > 75:
-
-                        print(f'From file: {filename} - Writing: IMPACTS_HawkeyeCPI_{date}{time}_{img_num}.png')
-                        # Save individual images
-                        img.save(os.path.join(output_directory1, f'IMPACTS_HawkeyeCPI_{date}{time}_{img_num}_C1.png'))
-                        img.save(os.path.join(output_directory2, f'IMPACTS_HawkeyeCPI_{date}{time}_{img_num}_C2.png'))
+    follower = RoiFollower(os.path.join(input_directory, filename), start, end, min_px, max_px, max_aspect)
+    for img_num, particle in follow(follower, poll_interval, idle_timeout):
+        time = (particle.hour * 10000000 + particle.minute * 100000
+                + particle.second * 1000 + particle.msecond)
+        name = image_name(date, time, img_num)
+        print(f'From file: {filename} - Writing: {name}.png')
+        save_particle(particle.image, name, output_directory1, output_directory2)
+
+
+def process_roi_task(task, **options):
+    """Pool wrapper: task is (filename, (records, image numbers))."""
+    filename, selection = task
+    return process_roi_file(filename, selection=selection, **options)
 
 
 
 # Use multiprocessing to process files in parallel
 if __name__ == '__main__':
-    roi_files = [f for f in os.listdir(input_directory) if f.endswith('.roi')]
-    
-    # Use 28 CPU cores
-    with Pool(28) as pool:
-        pool.map(process_roi_file, roi_files)
+    parser = argparse.ArgumentParser(description="Export individual Hawkeye-CPI particle images from roi files.")
+    parser.add_argument("-input_dir", type=str, default=input_directory, help="Directory containing the roi files (default: current directory).")
+    parser.add_argument("-output_dir", type=str, default=output_base_directory, help="Root output directory (default: current directory).")
+    parser.add_argument("-start", type=str, default=None, help="Start of the time window, e.g. 2022-01-19T12:31:00.")
+    parser.add_argument("-end", type=str, default=None, help="End of the time window, e.g. 2022-01-19T12:51:00.")
+    parser.add_argument("-min_px", type=int, default=MIN_PIXELS, help="Particles must be larger than this many pixels in both dimensions.")
+    parser.add_argument("-max_px", type=int, default=None, help="Particles may not be larger than this many pixels in either dimension.")
+    parser.add_argument("-max_aspect", type=float, default=None, help="Maximum ratio of the longest to the shortest particle dimension.")
+    parser.add_argument("-nproc", type=int, default=os.cpu_count(), help="Number of worker processes (default: all CPU cores).")
+    parser.add_argument("-follow", type=str, default=None, help="Follow one roi file that is still being written and export particles as they arrive.")
+    parser.add_argument("-poll_interval", type=float, default=1.0, help="Seconds between checks for new data in -follow mode.")
+    parser.add_argument("-idle_timeout", type=float, default=None, help="Stop -follow mode after the file has not grown for this many seconds.")
+    parser.add_argument("-format", type=str, default='png', choices=['png', 'archive'], help="png: one image per particle in _C1/_C2 directories; archive: one packed .particles.npz per roi file.")
+    args = parser.parse_args()
+    if args.follow is not None and args.format != 'png':
+        parser.error('-follow writes png images only; -format archive needs the complete roi file')
+
+    # Create the output base directory if it doesn't exist
+    os.makedirs(args.output_dir, exist_ok=True)
+    roi_files = [f for f in os.listdir(args.input_dir) if f.endswith('.roi')]
+    filters = dict(start=args.start, end=args.end, min_px=args.min_px,
+                   max_px=args.max_px, max_aspect=args.max_aspect)
+
+    if args.follow is not None:
+        follow_roi_file(args.follow, args.input_dir, args.output_dir, poll_interval=args.poll_interval,
+                        idle_timeout=args.idle_timeout, **filters)
+    else:
+        process = partial(process_roi_task, input_directory=args.input_dir,
+                          output_base_directory=args.output_dir, output_format=args.format, **filters)
+
+        with Pool(args.nproc) as pool:
+            # Index and select the particles of every file once: large files are
+            # scanned in byte ranges on the pool, the rest one file per worker.
+            selections = {}
+            for filename in roi_files:
+                if os.path.getsize(os.path.join(args.input_dir, filename)) > SPLIT_SIZE:
+                    selections[filename] = select_roi_particles(filename, args.input_dir, pool=pool, **filters)
+            small_files = [f for f in roi_files if f not in selections]
+            selections.update(zip(small_files, pool.map(partial(select_roi_particles, input_directory=args.input_dir, **filters), small_files)))
+
+            # Then split each file's particles into tasks so one long file keeps
+            # every core busy; each task gets only its records and image numbers.
+            # Image numbers come from the whole-file index, so they are identical
+            # to a serial run. An archive is written by one task.
+            tasks = []
+            for filename in roi_files:
+                records, numbers = selections[filename]
+                if args.format == 'archive':
+                    tasks.append((filename, (records, numbers)))
+                    continue
+                for first in range(0, len(records), PARTICLES_PER_TASK):
+                    part = slice(first, first + PARTICLES_PER_TASK)
+                    tasks.append((filename, (records[part], numbers[part])))
+            pool.map(process, tasks)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   hawkeye_archive.py
+#
+# Purpose:
+#   Packed particle archive for Hawkeye-CPI images. One archive is written per
+#   roi file instead of one PNG per particle (per _C1/_C2 directory). The
+#   archive is an uncompressed .npz shard holding the raw uint8 ROI pixels
+#   back to back plus a per-particle metadata table (image number, time,
+#   position/size fields from the ROI header and the PNG name the particle
+#   would have had). The _C1/_C2 copies are index entries ('views'), not
+#   extra copies of the pixels.
+#
+# Syntax:
+#   from hawkeye_archive import ParticleArchive
+#
+#   archive = ParticleArchive('20230115191319.particles.npz')
+#   for rows, images in archive.batches(256):
+#       ...                                   # images are uint8 arrays
+#   archive.filename(0, 'C1')  # IMPACTS_HawkeyeCPI_..._000001_C1.png
+#
+#   The pixel array is memory mapped straight out of the .npz file, so
+#   batches are read on demand rather than loading the whole archive.
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import os
+import shutil
+import struct
+import zipfile
+import numpy as np
+from hawkeye_roi import PARTICLE_DTYPE
+
+ARCHIVE_SUFFIX = '.particles.npz'
+VIEWS = ('C1', 'C2')
+
+
+def archive_filename(output_directory, file_base):
+    """Archive path for one roi file (20230115191319.particles.npz)."""
+    return os.path.join(output_directory, file_base + ARCHIVE_SUFFIX)
+
+
+def link_view(source, destination):
+    """
+    Make 'destination' another view of the image file 'source': a hard link
+    where possible, otherwise a plain copy (never a second encode).
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _write_member(archive, name, array):
+    with archive.open(name + '.npy', 'w', force_zip64=True) as member:
+        np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+
+
+def write_archive(path, roi_file, table, image_numbers, names, views=VIEWS):
+    """
+    Write the particles of 'table' (rows of a hawkeye_roi particle table)
+    from an open RoiFile to one archive. Pixels are streamed from the roi
+    file's memory map into the archive without building them in memory.
+    """
+    image_width = (table['endx'].astype(np.int64) - table['startx'] + 1)
+    image_height = (table['endy'].astype(np.int64) - table['starty'] + 1)
+    sizes = image_width * image_height
+    pixel_offset = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+
+    temporary = path + '.tmp'
+    with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name in PARTICLE_DTYPE.names:
+            _write_member(archive, name, table[name])
+        _write_member(archive, 'image_number', np.asarray(image_numbers, dtype=np.int64))
+        _write_member(archive, 'name', np.asarray(names, dtype=str))
+        _write_member(archive, 'image_width', image_width)
+        _write_member(archive, 'image_height', image_height)
+        _write_member(archive, 'pixel_offset', pixel_offset)
+        _write_member(archive, 'views', np.asarray(views, dtype=str))
+
+        with archive.open('pixels.npy', 'w', force_zip64=True) as member:
+            header = {'descr': np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+                      'fortran_order': False, 'shape': (int(sizes.sum()),)}
+            np.lib.format.write_array_header_2_0(member, header)
+            for particle in roi_file.particles(table):
+                member.write(particle.image.tobytes())
+    os.replace(temporary, path)
+
+
+def memmap_member(path, member):
+    """
+    Memory map an uncompressed .npy member of an .npz file, or return None
+    if the member is compressed.
+    """
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, 'rb') as file:
+        file.seek(info.header_offset)
+        local_header = file.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        file.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+class ParticleArchive:
+    """Read access to a packed particle archive written by write_archive."""
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as archive:
+            self.metadata = {name: archive[name] for name in archive.files if name != 'pixels'}
+            self.pixels = memmap_member(path, 'pixels.npy')
+            if self.pixels is None:
+                self.pixels = archive['pixels']
+        self.views = tuple(str(view) for view in self.metadata['views'])
+
+    def __len__(self):
+        return len(self.metadata['image_number'])
+
+    def image(self, i):
+        """Particle i as a (height, width) uint8 array."""
+        start = self.metadata['pixel_offset'][i]
+        height, width = self.metadata['image_height'][i], self.metadata['image_width'][i]
+        return np.asarray(self.pixels[start:start + height * width]).reshape(height, width)
+
+    def filename(self, i, view=VIEWS[0]):
+        """PNG name particle i has in the individual image layout of 'view'."""
+        return f"{self.metadata['name'][i]}_{view}.png"
+
+    def batches(self, batch_size=256, rows=None):
+        """Yield (row numbers, list of images) in batches of 'batch_size'."""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            yield batch, [self.image(i) for i in batch]
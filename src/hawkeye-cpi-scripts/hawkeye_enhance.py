@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hawkeye-CPI particle image enhancement (contrast enhancement, particle mask, radial
+background, standard 1024x1024 field of view and scale bar).
+
+Purpose:
+    - Enhancement steps used by Enhance_Hawkeye-CPI_Images_20250305.py, importable as a library.
+    - enhance_batch() takes a list of particle images (e.g. from hawkeye_roi or a packed
+      particle archive), pads them up to a few shape classes (sides of 32, 48, 64, 96, ...
+      pixels) and runs the Otsu threshold, closing, hole filling and mask dilation for
+      each class as whole-stack array operations. Padding pixels are left out of the Otsu
+      histograms and act as outside the image in the morphology, so the output is identical
+      to enhancing each image on its own. CLAHE runs per image on the cropped image, and
+      only for particles whose mask is not empty. Radial gradients are cached per shape.
+    - Nothing is kept in module state between calls, so batches can run concurrently on
+      a thread pool as well as on a process pool. Each result carries the particle geometry
+      (size and padding inside the standard field of view) alongside the image.
+
+Usage:
+    from hawkeye_enhance import enhance_batch
+    for enhanced in enhance_batch([particle.image for particle in particles]):
+        enhanced.image, enhanced.height, enhanced.width, enhanced.pad_y, enhanced.pad_x
+
+Modifications:
+    2026/10/18:
+        Written, enhancement steps moved out of Enhance_Hawkeye-CPI_Images_20250305.py
+        and batched by image shape.
+        Removed the h_particle/w_particle globals; results are EnhancedParticle tuples
+        holding the image and its geometry.
+        Images grouped by padded shape class instead of exact shape (a batch of CPI
+        particles of different sizes was nearly all one-image groups); closing of small
+        particles vectorized; CLAHE skipped when the particle mask is empty.
+"""
+
+from collections import defaultdict, namedtuple
+import math
+from functools import lru_cache
+import cv2
+import numpy as np
+from skimage import color, exposure
+from scipy import ndimage
+
+# Enhancement parameters
+BORDER_SIZE = 10          # Temporary border added around the particle
+BORDER_VALUE = 190        # Gray level of the temporary border
+THRESHOLD_FACTOR = 1.05   # Otsu threshold multiplier
+CLIP_LIMIT = 0.017        # CLAHE clip limit
+MICRONS_PER_PIXEL = 2.3   # Hawkeye-CPI pixel size
+FOV_SIZE = (1024, 1024)   # Standard field of view of the output images
+SCALE_LENGTH_MICRONS = 500
+
+# Everything that changes the output images; recorded in the enhancement
+# manifest so outputs made with other settings are redone
+ENHANCE_PARAMETERS = {
+    'border_size': BORDER_SIZE,
+    'border_value': BORDER_VALUE,
+    'threshold_factor': THRESHOLD_FACTOR,
+    'clip_limit': CLIP_LIMIT,
+    'microns_per_pixel': MICRONS_PER_PIXEL,
+    'fov_size': list(FOV_SIZE),
+    'scale_length_microns': SCALE_LENGTH_MICRONS,
+}
+
+# Hole filling runs on (batch, y, x) stacks: 4-connected in each image, no
+# connection between images.
+FILL_STRUCTURE = np.zeros((3, 3, 3), dtype=bool)
+FILL_STRUCTURE[1] = ndimage.generate_binary_structure(2, 1)
+DILATE_STRUCTURE = np.ones((1, 3, 3), dtype=bool)
+
+# Bordered images smaller than this (largest side) are closed by
+# fill_holes_morphologically (its kernel is empty, which OpenCV takes as 3x3)
+SMALL_IMAGE = 100
+
+# Smallest side of a shape class; classes grow by 2 and 3/2 in turn
+# (32, 48, 64, 96, 128, ...), so padding at most adds half of each side
+MIN_CLASS_SIDE = 32
+
+# Enhanced RGB image, size of the particle (pixels) and the padding that
+# centres it in the standard field of view
+EnhancedParticle = namedtuple('EnhancedParticle', ['image', 'height', 'width', 'pad_y', 'pad_x'])
+
+def fill_holes_morphologically(binary_image, kernel_size=1, iterations=1):
+    binary_image = (binary_image * 255).astype(np.uint8) if binary_image.dtype != np.uint8 else binary_image
+    adaptive_kernel_size = min(kernel_size, max(binary_image.shape) // 100)
+    kernel = np.ones((adaptive_kernel_size, adaptive_kernel_size), np.uint8)
+    open_image = binary_image.copy()
+    for _ in range(iterations):
+        open_image = cv2.morphologyEx(open_image, cv2.MORPH_CLOSE, kernel)
+    return open_image
+
+def create_radial_gradient(shape):
+    h, w = shape
+    y, x = np.indices((h, w))
+    center_x, center_y = w // 2, h // 2
+    radius = np.sqrt((x - center_x) ** 2 + (y - center_y) ** 2)
+    radius = radius / np.max(radius)
+    return (255 - (radius * 125)).astype(np.uint8)
+
+@lru_cache(maxsize=256)
+def cached_radial_gradient(shape):
+    """create_radial_gradient, computed once per shape (read-only array)."""
+    gradient = create_radial_gradient(shape)
+    gradient.setflags(write=False)
+    return gradient
+
+def enhance_contrast(image):
+    return exposure.equalize_adapthist(image, clip_limit=CLIP_LIMIT) * 255
+
+def shape_class(side):
+    """Side of the shape class an image side is padded up to (32, 48, 64, 96, 128, ...)."""
+    if side <= MIN_CLASS_SIDE:
+        return MIN_CLASS_SIDE
+    power = MIN_CLASS_SIDE << max(math.ceil(math.log2(side / MIN_CLASS_SIDE)) - 1, 0)
+    return power * 3 // 2 if side <= power * 3 // 2 else power * 2
+
+def valid_pixels(stack_shape, shapes):
+    """(batch, y, x) mask of the real pixels of images of 'shapes' (batch, 2) at the top left of a stack."""
+    y = np.arange(stack_shape[1])[None, :, None]
+    x = np.arange(stack_shape[2])[None, None, :]
+    return (y < shapes[:, 0, None, None]) & (x < shapes[:, 1, None, None])
+
+def otsu_thresholds(stack, valid=None):
+    """
+    Otsu threshold of every uint8 image in a (batch, y, x) stack, identical to
+    skimage.filters.threshold_otsu applied image by image. Only the pixels
+    where 'valid' is True (default all) count.
+    """
+    batch = stack.shape[0]
+    flat = stack.reshape(batch, -1)
+    # Padding pixels go to an extra bin 256 that is dropped
+    values = flat if valid is None else np.where(valid.reshape(batch, -1), flat.astype(np.intp), 256)
+    counts = np.bincount((np.arange(batch)[:, None] * 257 + values).ravel(),
+                         minlength=batch * 257).reshape(batch, 257)[:, :256]
+    bin_centers = np.arange(256)
+
+    weight1 = np.cumsum(counts, axis=1)
+    weight2 = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = np.cumsum(counts * bin_centers, axis=1) / weight1
+        mean2 = (np.cumsum((counts * bin_centers)[:, ::-1], axis=1) / weight2[:, ::-1])[:, ::-1]
+        variance12 = weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+    # Thresholds outside each image's own gray range are undefined (0/0)
+    variance12[~np.isfinite(variance12)] = -np.inf
+    thresholds = np.argmax(variance12, axis=1)
+
+    # Single valued images: threshold is that value
+    lowest = (values if valid is None else np.where(values < 256, values, 255)).min(axis=1)
+    highest = (values if valid is None else np.where(values < 256, values, 0)).max(axis=1)
+    uniform = lowest == highest
+    thresholds[uniform] = lowest[uniform]
+    return thresholds
+
+def particle_masks(bordered, shapes=None):
+    """
+    Particle mask of every image in a (batch, y, x) stack of bordered gray
+    images: Otsu background, closed, holes filled and dilated by 3x3. Images
+    smaller than the stack give their (height, width) in 'shapes' and sit at
+    the top left; the pixels around them are left out.
+    """
+    if shapes is None:
+        shapes = np.tile(bordered.shape[1:], (len(bordered), 1))
+    valid = valid_pixels(bordered.shape, shapes)
+    binary = bordered > (otsu_thresholds(bordered, valid) * THRESHOLD_FACTOR)[:, None, None]
+    binary &= valid
+
+    # fill_holes_morphologically: 3x3 closing of small images, none (1x1
+    # kernel) of larger ones. OpenCV ignores pixels outside the image, so the
+    # padding is 0 for the dilation and 1 for the erosion.
+    small = shapes.max(axis=1) < SMALL_IMAGE
+    if small.any():
+        dilated = ndimage.binary_dilation(binary[small], structure=DILATE_STRUCTURE)
+        dilated |= ~valid[small]
+        binary[small] = ndimage.binary_erosion(dilated, structure=DILATE_STRUCTURE,
+                                               border_value=1) & valid[small]
+
+    # Padding is background joined to the stack edge, as the image edge is
+    holes = ndimage.binary_fill_holes(binary, structure=FILL_STRUCTURE) & ~binary
+    return ndimage.binary_dilation(holes, structure=DILATE_STRUCTURE)
+
+def to_gray(image):
+    gray_image = color.rgb2gray(image) * 255 if len(image.shape) == 3 else image
+    return gray_image.astype(np.uint8)
+
+def pad_to_standard_fov(image, target_size=FOV_SIZE):
+    """Centre image in the field of view; returns (padded image, pad_y, pad_x)."""
+    h_particle, w_particle = image.shape[:2]
+    pad_y = max((target_size[0] - h_particle) // 2, 0)
+    pad_x = max((target_size[1] - w_particle) // 2, 0)
+    padded_image = cv2.copyMakeBorder(image, pad_y, pad_y, pad_x, pad_x, cv2.BORDER_CONSTANT, value=255)
+    return padded_image, pad_y, pad_x
+
+def add_scale_bar(image, particle_shape, microns_per_pixel=MICRONS_PER_PIXEL,
+                  scale_length_microns=SCALE_LENGTH_MICRONS):
+    """Draw the scale bar above a particle of particle_shape (height, width)."""
+    h_particle, w_particle = particle_shape
+    scale_length_pixels = int(scale_length_microns / microns_per_pixel)
+    bar_height = 10
+    output_image = cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_GRAY2RGB)
+
+    start_y = round((1024 - h_particle) / 2) - 15
+    start_x = round((1024 - w_particle) / 2)
+    end_x = start_x + scale_length_pixels
+    end_y = start_y + bar_height
+
+    # Blue (RGB): the colour the bar had in the old multi-pass output, which
+    # went through a BGR cv2.imread round trip before the final save
+    bar_color = (0, 0, 255)
+    cv2.rectangle(output_image, (start_x, start_y), (end_x, end_y), bar_color, -1)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    cv2.putText(output_image, f"{scale_length_microns} microns", (start_x + 25, start_y - 5), font, 0.8, bar_color, 2, cv2.LINE_AA)
+    return output_image
+
+def enhance_batch(images):
+    """
+    Enhance a list of particle images (gray or RGB). Returns an
+    EnhancedParticle (RGB 1024x1024 image plus geometry) per input, in order.
+    """
+    gray_images = [to_gray(image) for image in images]
+    b = BORDER_SIZE
+    groups = defaultdict(list)
+    for i, gray_image in enumerate(gray_images):
+        h, w = gray_image.shape
+        groups[shape_class(h + 2 * b), shape_class(w + 2 * b)].append(i)
+
+    outputs = [None] * len(images)
+    for (class_h, class_w), members in groups.items():
+        shapes = np.array([gray_images[i].shape for i in members]) + 2 * b
+        bordered = np.full((len(members), class_h, class_w), BORDER_VALUE, dtype=np.uint8)
+        for k, i in enumerate(members):
+            h, w = gray_images[i].shape
+            bordered[k, b:b + h, b:b + w] = gray_images[i]
+        masks = particle_masks(bordered, shapes)
+
+        for k, i in enumerate(members):
+            h, w = gray_images[i].shape
+            image, mask = bordered[k, :h + 2 * b, :w + 2 * b], masks[k, :h + 2 * b, :w + 2 * b]
+            final_image = cached_radial_gradient(image.shape)
+            if mask.any():
+                final_image = np.where(mask, enhance_contrast(image), final_image)
+            # Cast (as add_scale_bar does) before padding: uint8 field of view, not float64
+            padded_image, pad_y, pad_x = pad_to_standard_fov(final_image[b:-b, b:-b].astype(np.uint8))
+            outputs[i] = EnhancedParticle(add_scale_bar(padded_image, (h, w)), h, w, pad_y, pad_x)
+    return outputs
+
+def enhance_image(image):
+    """Enhance a single particle image (see enhance_batch)."""
+    return enhance_batch([image])[0]
+
+def make_transparent(rgb_image):
+    """Return an RGBA copy of an RGB image with pure white pixels made transparent."""
+    white_mask = np.all(rgb_image == 255, axis=-1)
+    alpha = np.where(white_mask, 0, 255).astype(np.uint8)
+    return np.dstack((rgb_image, alpha))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   hawkeye_manifest.py
+#
+# Purpose:
+#   Manifest of enhanced Hawkeye-CPI images, so reruns of
+#   Enhance_Hawkeye-CPI_Images_20250305.py only process new or changed
+#   inputs. The manifest (enhance_manifest.jsonl in the output root) is an
+#   append-only JSON lines file:
+#
+#     {"parameters": {...}}                        enhancement settings, written
+#                                                  each time the manifest is opened
+#     {"input": ..., "size": ..., "mtime_ns": ..., "outputs": [...]}
+#                                                  one line per finished input
+#
+#   Input paths are relative to the input root, outputs to the output root.
+#   Archive inputs are recorded per batch ('20230115191319.particles.npz#0:64').
+#   An input is up to date when its size and modification time (or, with
+#   checksum=True, its SHA-1) match, it was made with the current parameters
+#   and all of its outputs still exist. Lines are appended as work finishes,
+#   so a crashed run keeps everything it completed.
+#
+# Syntax:
+#   from hawkeye_manifest import EnhanceManifest
+#
+#   with EnhanceManifest(output_root, ENHANCE_PARAMETERS) as manifest:
+#       if not manifest.up_to_date(key, input_path):
+#           ...
+#           manifest.record(key, file_state(input_path), outputs)
+#
+# Modification History:
+#   2026/10/18
+#     Written.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = 'enhance_manifest.jsonl'
+
+# Rewrite the manifest when it holds more than this many lines per entry
+COMPACT_RATIO = 2
+
+
+def file_digest(path):
+    """SHA-1 of a file's contents (hex)."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_state(path, checksum=False):
+    """Size, modification time and optionally SHA-1 of an input file."""
+    status = os.stat(path)
+    state = {'size': status.st_size, 'mtime_ns': status.st_mtime_ns}
+    if checksum:
+        state['sha1'] = file_digest(path)
+    return state
+
+
+def manifest_key(input_root, input_path, part=None):
+    """Manifest key of an input file (or part of one, e.g. an archive batch)."""
+    key = os.path.relpath(input_path, input_root)
+    return key if part is None else f'{key}#{part}'
+
+
+class EnhanceManifest:
+    """Record of the inputs already enhanced into 'output_root'."""
+
+    def __init__(self, output_root, parameters, checksum=False):
+        self.output_root = output_root
+        self.path = os.path.join(output_root, MANIFEST_NAME)
+        self.parameters = json.loads(json.dumps(parameters))
+        self.checksum = checksum
+        self.entries = {}
+        lines = self._load()
+
+        os.makedirs(output_root, exist_ok=True)
+        if lines > COMPACT_RATIO * max(len(self.entries), 1):
+            self._compact()
+        self.file = open(self.path, 'a')
+        self._write({'parameters': self.parameters})
+
+    def _load(self):
+        """Read the manifest; later lines for an input replace earlier ones."""
+        lines = 0
+        parameters = None
+        try:
+            with open(self.path) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Partly written last line of a crashed run
+                        continue
+                    lines += 1
+                    if 'parameters' in record:
+                        parameters = record['parameters']
+                    elif 'input' in record:
+                        record['parameters'] = parameters
+                        self.entries[record['input']] = record
+        except FileNotFoundError:
+            pass
+        return lines
+
+    def _compact(self):
+        """Rewrite the manifest with one line per input."""
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            current = None
+            for record in self.entries.values():
+                if record['parameters'] != current:
+                    current = record['parameters']
+                    file.write(json.dumps({'parameters': current}) + '\n')
+                file.write(json.dumps({k: v for k, v in record.items() if k != 'parameters'}) + '\n')
+        os.replace(temporary, self.path)
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def up_to_date(self, key, input_path):
+        """True if 'input_path' (manifest key 'key') needs no reprocessing."""
+        record = self.entries.get(key)
+        if record is None or record['parameters'] != self.parameters:
+            return False
+        try:
+            status = os.stat(input_path)
+        except OSError:
+            return False
+        if status.st_size != record['size']:
+            return False
+        if status.st_mtime_ns != record['mtime_ns']:
+            # Touched or copied: unchanged only if the contents match
+            if not self.checksum or 'sha1' not in record or file_digest(input_path) != record['sha1']:
+                return False
+        return all(os.path.exists(os.path.join(self.output_root, output)) for output in record['outputs'])
+
+    def record(self, key, state, outputs):
+        """Add a finished input ('state' from file_state) and its output paths."""
+        record = dict(input=key, **state,
+                      outputs=[os.path.relpath(output, self.output_root) for output in outputs])
+        self._write(record)
+        record['parameters'] = self.parameters
+        self.entries[key] = record
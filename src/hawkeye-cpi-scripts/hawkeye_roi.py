@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+#
+# Name:
+#   hawkeye_roi.py
+#
+# Purpose:
+#   Memory-mapped reader for raw binary Hawkeye-CPI (*roi) files. The whole
+#   file is mapped once, every block sync word (file header, 0xA3D5 image
+#   metadata, 0xA1D7/0xA1D9 housekeeping and 0xB2E6 ROI blocks, as laid out
+#   in cpiread.pro and cpi_imagedump.pro) is located with a vectorized scan,
+#   and each particle image is returned as a NumPy view into the mapping so
+#   no per-particle copy or read call is made.
+#
+# Syntax:
+#   from hawkeye_roi import RoiFile
+#
+#   with RoiFile('20230115191319.roi') as roi_file:
+#       blocks = roi_file.index          # offset, type, length of every block
+#       for particle in roi_file.particles():
+#           particle.image               # (toty, totx) uint8 view
+#
+#   table = particle_index('20230115191319.roi')
+#       Per-particle metadata table, cached in 20230115191319.roi.idx and
+#       rebuilt whenever the roi file's size or modification time changes.
+#
+#   for image_number, particle in extract('20230115191319.roi',
+#           start='2023-01-15T19:20:00', end='2023-01-15T19:25:00', min_px=75):
+#       Only the particles inside the time window and size limits are read.
+#
+#   for image_number, particle in follow('20230115191319.roi', poll_interval=1):
+#       Particles of a roi file that is still being written, as they arrive.
+#
+# Modification History:
+#   2026/10/18
+#     Written, block parsing split out of
+#     Level1_HawkeyeCPI_individual_image_dump.py.
+#     Added the per-particle sidecar index (*.roi.idx).
+#     Added time-window and size-filtered extraction.
+#     Added parallel (byte range split) indexing of large roi files.
+#     Added follow mode (RoiFollower) for roi files still being written.
+#
+# Copyright 2026 David Delene
+#
+# This program is distributed under the terms of the GNU General Public License
+#
+# This file is part of Airborne Data Processing and Analysis (ADPAA).
+#
+# ADPAA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ADPAA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ADPAA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+import mmap
+import os
+import time
+from collections import namedtuple
+import numpy as np
+
+# Define block types
+IMAGE_BLOCK = 0xB2E6
+METADATA_BLOCK = 0xA3D5
+HOUSEKEEPING_BLOCK = 0xA1D7
+HOUSEKEEPING2_BLOCK = 0xA1D9
+
+# Block layouts (little endian, packed), same fields as the IDL structures
+# 'fileheader', 'imageblock', 'house', 'house2' and 'roiblock'.
+FILE_HEADER_DTYPE = np.dtype([
+    ('version', '<u2'), ('year', '<u2'), ('month', '<u2'),
+    ('framewidth', '<u2'), ('frameheight', '<u2'), ('info', 'u1', 70)
+])
+
+METADATA_DTYPE = np.dtype([
+    ('blksize', '<u4'), ('version', '<u2'), ('numrois', '<u2'), ('tot', '<u4'),
+    ('day', 'u1'), ('hour', 'u1'), ('minute', 'u1'), ('second', 'u1'),
+    ('msecond', '<u2'), ('type', '<u2'), ('startx', '<u2'), ('starty', '<u2'),
+    ('endx', '<u2'), ('endy', '<u2'), ('bgrate', '<u2'), ('bgpdsthresh', '<u2'),
+    ('nframes', '<u4'), ('ithresh', 'u1'), ('roierr', 'u1'), ('roiminsize', '<u2'),
+    ('roiaspect', '<f4'), ('roifill', '<f4'), ('roifcount', '<u4'),
+    ('imgmean', 'u1'), ('bkgmean', 'u1'), ('spare', '<u2'), ('roixpad', '<u2'),
+    ('roiypad', '<u2'), ('strobecount', '<u4'), ('framessaved', '<u4'),
+    ('imgminval', 'u1'), ('imgmaxval', 'u1'), ('nroisaved', '<u4'),
+    ('checksum', '<u2'), ('pdshead', '<u2', 3), ('time', '<u4'),
+    ('unknown', '<u2', 8)
+])
+
+HOUSEKEEPING_DTYPE = np.dtype([('blksize', '<u4'), ('version', '<u2'), ('info', 'u1', 98)])
+HOUSEKEEPING2_DTYPE = np.dtype([('blksize', '<u4'), ('version', '<u2'), ('info', 'u1', 172)])
+
+ROI_HEADER_DTYPE = np.dtype([
+    ('blksize', '<u4'), ('version', '<u2'), ('startx', '<u2'), ('starty', '<u2'),
+    ('endx', '<u2'), ('endy', '<u2'), ('pixbytes', '<i2'), ('flags', '<u2'),
+    ('length', '<f4'), ('startlen', '<u4'), ('endlen', '<u4'), ('width', '<f4'),
+    ('startwidth', '<u4'), ('endwidth', '<u4'), ('roidepth', '<u2'),
+    ('area', '<f4'), ('perimeter', '<f4')
+])
+
+# Fixed payload size following each two byte sync word. ROI blocks are also
+# followed by (endx - startx + 1) * (endy - starty + 1) bytes of pixels.
+BLOCK_SIZES = {
+    METADATA_BLOCK: METADATA_DTYPE.itemsize,
+    HOUSEKEEPING_BLOCK: HOUSEKEEPING_DTYPE.itemsize,
+    HOUSEKEEPING2_BLOCK: HOUSEKEEPING2_DTYPE.itemsize,
+    IMAGE_BLOCK: ROI_HEADER_DTYPE.itemsize,
+}
+SYNC_WORDS = np.array(sorted(BLOCK_SIZES), dtype='<u2')
+
+# One entry per block: byte offset of the sync word, block type and the total
+# number of bytes (sync word + header + pixels).
+BLOCK_INDEX_DTYPE = np.dtype([('offset', '<i8'), ('type', '<u2'), ('length', '<i8')])
+
+# ROI dimension limits used by the original dumper to reject corrupt blocks
+MAX_ROI_WIDTH = 5000
+MAX_ROI_VERSION = 5000
+
+# Bytes examined per vectorized scan step (bounds the temporary arrays)
+SCAN_CHUNK = 1 << 24
+
+# Byte range scanned by one worker when a file is indexed in parallel
+SPLIT_SIZE = 1 << 28
+
+# Per-particle metadata table kept in the sidecar index (*.roi.idx): offset
+# of the 0xB2E6 sync word, time from the preceding 0xA3D5 block and the
+# position/size fields of the ROI header.
+TIME_FIELDS = ('day', 'hour', 'minute', 'second', 'msecond')
+HEADER_FIELDS = ('startx', 'starty', 'endx', 'endy', 'length', 'width', 'area', 'perimeter')
+PARTICLE_DTYPE = np.dtype(
+    [('offset', '<i8')]
+    + [(name, METADATA_DTYPE[name]) for name in TIME_FIELDS]
+    + [(name, ROI_HEADER_DTYPE[name]) for name in HEADER_FIELDS]
+    + [('valid', '?')]
+)
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+Particle = namedtuple('Particle', [
+    'offset', 'day', 'hour', 'minute', 'second', 'msecond', 'header', 'image'
+])
+Particle.__doc__ = """One ROI block. 'image' is a (toty, totx) uint8 view into the
+memory map, or None when the block has invalid dimensions."""
+
+
+def gather_records(buffer, offsets, dtype):
+    """Read one 'dtype' record at each byte offset of 'buffer' in a single gather."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) == 0:
+        return np.zeros(0, dtype=dtype)
+    byte_index = offsets[:, None] + np.arange(dtype.itemsize)
+    np.clip(byte_index, 0, max(len(buffer) - 1, 0), out=byte_index)
+    return np.ascontiguousarray(buffer[byte_index]).view(dtype).ravel()
+
+
+def roi_dimensions(headers):
+    """Return totx, toty and a validity mask for an array of ROI headers."""
+    totx = headers['endx'].astype(np.int64) - headers['startx'] + 1
+    toty = headers['endy'].astype(np.int64) - headers['starty'] + 1
+    valid = ((totx > 0) & (toty > 0) & (totx <= MAX_ROI_WIDTH)
+             & (headers['version'] <= MAX_ROI_VERSION))
+    return totx, toty, valid
+
+
+def scan_sync_words(buffer, start, stop):
+    """
+    Find every candidate block in buffer[start:stop].
+
+    Returns the candidate offsets, block types and block lengths. A candidate
+    is any two byte word equal to one of the known sync words, at either byte
+    parity; pixel data can contain false candidates, which are discarded when
+    the block chain is walked.
+    """
+    stop = min(stop, len(buffer) - 1)
+    offsets = []
+    for lo in range(start, stop, SCAN_CHUNK):
+        hi = min(lo + SCAN_CHUNK, stop)
+        high_byte = buffer[lo + 1:hi + 1]
+        hits = np.flatnonzero(np.isin(high_byte, np.unique(SYNC_WORDS >> 8)))
+        hits = hits[np.isin(buffer[lo + hits], SYNC_WORDS & 0xFF)]
+        offsets.append(hits + lo)
+    offsets = np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+    offsets = offsets.astype(np.int64)
+    types = buffer[offsets].astype('<u2') | (buffer[offsets + 1].astype('<u2') << 8)
+
+    # Keep only exact sync words (high/low byte pairs can mix across types)
+    keep = np.isin(types, SYNC_WORDS)
+    offsets, types = offsets[keep], types[keep]
+
+    lengths = np.full(len(offsets), 2, dtype=np.int64)
+    for block_type, size in BLOCK_SIZES.items():
+        lengths[types == block_type] += size
+
+    roi = np.flatnonzero(types == IMAGE_BLOCK)
+    totx, toty, valid = roi_dimensions(gather_records(buffer, offsets[roi] + 2, ROI_HEADER_DTYPE))
+    lengths[roi[valid]] += totx[valid] * toty[valid]
+    return offsets, types, lengths
+
+
+def walk_blocks(offsets, lengths, start, size):
+    """
+    Follow the block chain through the candidates starting at byte 'start'.
+
+    Each block points at the first candidate at or after its end, so unknown
+    bytes between blocks are stepped over just like the original reader did.
+    Returns the indices of the candidates that form the chain; a trailing
+    block that runs past 'size' ends the chain.
+    """
+    ends = offsets + lengths
+    next_block = np.searchsorted(offsets, ends).tolist()
+    ends = ends.tolist()
+    i = int(np.searchsorted(offsets, start))
+    chain = []
+    while i < len(ends):
+        if ends[i] > size:
+            break
+        chain.append(i)
+        i = next_block[i]
+    return np.array(chain, dtype=np.int64)
+
+
+def block_index(offsets, types, lengths, size):
+    """Walk the candidates from the end of the file header into a BLOCK_INDEX_DTYPE array."""
+    chain = walk_blocks(offsets, lengths, FILE_HEADER_DTYPE.itemsize, size)
+    index = np.zeros(len(chain), dtype=BLOCK_INDEX_DTYPE)
+    index['offset'] = offsets[chain]
+    index['type'] = types[chain]
+    index['length'] = lengths[chain]
+    return index
+
+
+def scan_range(task):
+    """Pool worker: scan_sync_words over one (filename, start, stop) byte range."""
+    filename, start, stop = task
+    with RoiFile(filename) as roi_file:
+        return scan_sync_words(roi_file.buffer, start, stop)
+
+
+def parallel_block_index(filename, pool, split_size=SPLIT_SIZE):
+    """
+    Block index of one roi file with the sync word scan split into byte
+    ranges of 'split_size' that are scanned on a multiprocessing pool. Every
+    range resynchronizes on the first sync word it contains; the candidates
+    are then merged in file order and walked once, so the index (and all
+    particle numbering derived from it) is identical to a serial scan.
+    """
+    size = os.path.getsize(filename)
+    bounds = list(range(FILE_HEADER_DTYPE.itemsize, size, split_size)) + [size]
+    results = pool.map(scan_range, [(filename, lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])])
+    if not results:
+        return np.zeros(0, dtype=BLOCK_INDEX_DTYPE)
+    offsets, types, lengths = (np.concatenate(column) for column in zip(*results))
+    return block_index(offsets, types, lengths, size)
+
+
+def build_particle_table(buffer, index, meta_offset=-1):
+    """
+    Particle table (PARTICLE_DTYPE) for the ROI blocks of a block index.
+    Time fields come from the most recent 0xA3D5 metadata block; for blocks
+    before the first one in 'index', the metadata block at byte 'meta_offset'
+    is used (zero time if -1).
+    """
+    types = index['type']
+    block_number = np.arange(len(index))
+    # Index of the last metadata block seen before each block
+    last_meta = np.maximum.accumulate(np.where(types == METADATA_BLOCK, block_number, -1))
+
+    roi = np.flatnonzero(types == IMAGE_BLOCK)
+    headers = gather_records(buffer, index['offset'][roi] + 2, ROI_HEADER_DTYPE)
+    meta_offsets = np.where(last_meta[roi] >= 0, index['offset'][np.maximum(last_meta[roi], 0)], meta_offset)
+    meta = gather_records(buffer, meta_offsets + 2, METADATA_DTYPE)
+    meta[meta_offsets < 0] = np.zeros(1, dtype=METADATA_DTYPE)
+
+    table = np.zeros(len(roi), dtype=PARTICLE_DTYPE)
+    table['offset'] = index['offset'][roi]
+    for name in TIME_FIELDS:
+        table[name] = meta[name]
+    for name in HEADER_FIELDS:
+        table[name] = headers[name]
+    table['valid'] = roi_dimensions(headers)[2]
+    return table
+
+
+class RoiFile:
+    """
+    Memory-mapped Hawkeye-CPI roi file with a lazily built block index.
+    If a multiprocessing pool is given, the index is built with
+    parallel_block_index.
+    """
+
+    def __init__(self, filename, pool=None):
+        self.filename = filename
+        self.pool = pool
+        self._file = open(filename, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = np.frombuffer(self._mmap, dtype=np.uint8)
+        else:
+            self._mmap = None
+            self.buffer = np.zeros(0, dtype=np.uint8)
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Particle views are still referenced; the map is released
+                # when the last of them is garbage collected.
+                pass
+            self._mmap = None
+        self._file.close()
+
+    @property
+    def header(self):
+        """File header record (version, year, month, frame size)."""
+        return gather_records(self.buffer, [0], FILE_HEADER_DTYPE)[0]
+
+    @property
+    def index(self):
+        """Structured BLOCK_INDEX_DTYPE array of every complete block in the file."""
+        if self._index is None:
+            if self.pool is not None and self.size > SPLIT_SIZE:
+                self._index = parallel_block_index(self.filename, self.pool)
+            else:
+                offsets, types, lengths = scan_sync_words(self.buffer, FILE_HEADER_DTYPE.itemsize, self.size)
+                self._index = block_index(offsets, types, lengths, self.size)
+        return self._index
+
+    def records(self, block_type, dtype):
+        """Headers of every block of one type, gathered in one vectorized read."""
+        index = self.index
+        return gather_records(self.buffer, index['offset'][index['type'] == block_type] + 2, dtype)
+
+    def particle_table(self):
+        """
+        Per-particle metadata table (PARTICLE_DTYPE) for every ROI block.
+
+        Time fields come from the most recent 0xA3D5 metadata block (zero
+        before the first one).
+        """
+        return build_particle_table(self.buffer, self.index)
+
+    def particles(self, table=None):
+        """
+        Yield a Particle for every row of a particle table, in table order.
+
+        By default every ROI block in the file is returned; pass a (filtered)
+        table from particle_table() or read_index() to seek straight to those
+        particles. Images are read-only views into the map, so copy them if
+        they must outlive this RoiFile.
+        """
+        if table is None:
+            table = self.particle_table()
+        headers = gather_records(self.buffer, table['offset'] + 2, ROI_HEADER_DTYPE)
+        totx, toty, valid = roi_dimensions(headers)
+        pixel_start = table['offset'] + 2 + ROI_HEADER_DTYPE.itemsize
+        for i in range(len(table)):
+            image = None
+            if valid[i]:
+                start = pixel_start[i]
+                image = self.buffer[start:start + totx[i] * toty[i]].reshape(toty[i], totx[i])
+            row = table[i]
+            yield Particle(int(row['offset']), int(row['day']), int(row['hour']), int(row['minute']),
+                           int(row['second']), int(row['msecond']), headers[i], image)
+
+
+def index_filename(filename):
+    """Sidecar index path for a roi file (20230115191319.roi.idx)."""
+    return filename + INDEX_SUFFIX
+
+
+def read_index(filename):
+    """
+    Return the particle table stored in the sidecar index of 'filename', or
+    None if there is no sidecar or it no longer matches the roi file's size
+    and modification time.
+    """
+    try:
+        status = os.stat(filename)
+        with np.load(index_filename(filename)) as sidecar:
+            if (int(sidecar['index_version']) != INDEX_VERSION
+                    or int(sidecar['source_size']) != status.st_size
+                    or int(sidecar['source_mtime_ns']) != status.st_mtime_ns):
+                return None
+            table = np.zeros(len(sidecar['offset']), dtype=PARTICLE_DTYPE)
+            for name in PARTICLE_DTYPE.names:
+                table[name] = sidecar[name]
+            return table
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def write_index(filename, table):
+    """Write a particle table as a columnar sidecar index next to 'filename'."""
+    status = os.stat(filename)
+    sidecar = index_filename(filename)
+    temporary = sidecar + '.tmp'
+    with open(temporary, 'wb') as file:
+        np.savez(file, index_version=INDEX_VERSION, source_size=status.st_size,
+                 source_mtime_ns=status.st_mtime_ns,
+                 **{name: table[name] for name in PARTICLE_DTYPE.names})
+    os.replace(temporary, sidecar)
+
+
+def particle_index(filename, roi_file=None):
+    """
+    Particle table for 'filename', read from its sidecar index when that is
+    up to date, otherwise built from the roi file and saved for next time.
+    """
+    table = read_index(filename)
+    if table is not None:
+        return table
+    if roi_file is None:
+        with RoiFile(filename) as roi_file:
+            table = roi_file.particle_table()
+    else:
+        table = roi_file.particle_table()
+    try:
+        write_index(filename, table)
+    except OSError as error:
+        print(f"Could not write index for {filename}: {error}")
+    return table
+
+
+def time_codes(table):
+    """HHMMSSmmm integer time of each particle, as used in the image file names."""
+    return (table['hour'].astype(np.int64) * 10000000 + table['minute'].astype(np.int64) * 100000
+            + table['second'].astype(np.int64) * 1000 + table['msecond'])
+
+
+def image_numbers(table):
+    """
+    Image number of each particle as assigned by the Level-1 dumper: valid
+    particles with a time code above 1000 are numbered 1, 2, ... in file
+    order, everything else gets 0.
+    """
+    numbered = table['valid'] & (time_codes(table) > 1000)
+    return np.where(numbered, np.cumsum(numbered), 0)
+
+
+def file_start_day(table):
+    """Day of month of the first particle with a day set (1 if none)."""
+    day = table['day']
+    return int(day[day > 0][0]) if np.any(day > 0) else 1
+
+
+def particle_times(table, year, month, start_day=None):
+    """
+    Particle times as datetime64[ms], from the table's day/time fields and the
+    year/month of the file header. Days numbered below the first particle's
+    day ('start_day', default the first in 'table') are taken to be in the
+    following month (flights across month end).
+    """
+    day = table['day'].astype(np.int64)
+    if start_day is None:
+        start_day = file_start_day(table)
+    month_start = np.datetime64(f'{int(year):04d}-{int(month):02d}', 'M')
+    month_start = (month_start + (day < start_day).astype('timedelta64[M]')).astype('datetime64[ms]')
+    milliseconds = ((day - 1) * 86400 + table['hour'].astype(np.int64) * 3600
+                    + table['minute'].astype(np.int64) * 60 + table['second']) * 1000 + table['msecond']
+    return month_start + milliseconds.astype('timedelta64[ms]')
+
+
+def select_particles(table, times, start=None, end=None, min_px=None, max_px=None, max_aspect=None):
+    """
+    Row numbers of the particles in [start, end) that pass the size filters.
+
+    The time window is located with a binary search when the times are in
+    order (the normal case), so only the rows inside the window are looked at.
+    min_px: both ROI dimensions must be larger than this (dumper uses 75).
+    max_px: neither ROI dimension may be larger than this.
+    max_aspect: longest over shortest ROI dimension may not exceed this.
+    """
+    lo, hi = 0, len(table)
+    rows = None
+    if start is not None or end is not None:
+        if np.all(times[1:] >= times[:-1]):
+            if start is not None:
+                lo = int(np.searchsorted(times, np.datetime64(start, 'ms'), side='left'))
+            if end is not None:
+                hi = int(np.searchsorted(times, np.datetime64(end, 'ms'), side='left'))
+        else:
+            in_window = np.ones(len(table), dtype=bool)
+            if start is not None:
+                in_window &= times >= np.datetime64(start, 'ms')
+            if end is not None:
+                in_window &= times < np.datetime64(end, 'ms')
+            rows = np.flatnonzero(in_window)
+    if rows is None:
+        rows = np.arange(lo, max(lo, hi))
+
+    subset = table[rows]
+    totx = subset['endx'].astype(np.int64) - subset['startx'] + 1
+    toty = subset['endy'].astype(np.int64) - subset['starty'] + 1
+    keep = subset['valid'].copy()
+    if min_px is not None:
+        keep &= (totx > min_px) & (toty > min_px)
+    if max_px is not None:
+        keep &= (totx <= max_px) & (toty <= max_px)
+    if max_aspect is not None:
+        keep &= np.maximum(totx, toty) <= max_aspect * np.maximum(np.minimum(totx, toty), 1)
+    return rows[keep]
+
+
+def find_particles(roi_file, table, start=None, end=None, min_px=None, max_px=None, max_aspect=None):
+    """
+    Rows of 'table' (the particle table of the open 'roi_file') inside the
+    time window that pass the size filters, and their image numbers.
+    Particles the dumper does not number (image number 0) are left out.
+    """
+    header = roi_file.header
+    times = particle_times(table, header['year'], header['month'])
+    rows = select_particles(table, times, start, end, min_px, max_px, max_aspect)
+    numbers = image_numbers(table)[rows]
+    return rows[numbers > 0], numbers[numbers > 0]
+
+
+def extract(filename, start=None, end=None, min_px=None, max_px=None, max_aspect=None):
+    """
+    Yield (image_number, Particle) for the particles of one roi file inside
+    the time window [start, end) that pass the size filters (see
+    select_particles). Times are anything np.datetime64 accepts, e.g.
+    '2022-01-19T12:31:00'. Only the selected blocks are touched in the file;
+    the particle table comes from the sidecar index.
+    """
+    with RoiFile(filename) as roi_file:
+        table = particle_index(filename, roi_file)
+        rows, numbers = find_particles(roi_file, table, start, end, min_px, max_px, max_aspect)
+        for number, particle in zip(numbers, roi_file.particles(table[rows])):
+            yield int(number), particle
+
+
+class RoiFollower:
+    """
+    Incremental reader for a roi file that is still being written by the
+    probe. Each poll() maps the file again, parses only the bytes added since
+    the last complete block and returns the new particles. A partially
+    written trailing block is left for the next poll, and particle times and
+    image numbers carry over between polls exactly as in a full read.
+    """
+
+    def __init__(self, filename, start=None, end=None, min_px=None, max_px=None, max_aspect=None):
+        self.filename = filename
+        self.filters = (start, end, min_px, max_px, max_aspect)
+        self.consumed = FILE_HEADER_DTYPE.itemsize  # end of the last complete block
+        self.meta_offset = -1                       # last 0xA3D5 block seen
+        self.count = 0                              # last image number handed out
+        self.start_day = None                       # day of the file's first particle
+        self.header = None
+
+    def poll(self):
+        """Return [(image_number, Particle), ...] for particles completed since the last poll."""
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return []
+        if size <= self.consumed:
+            return []
+
+        with RoiFile(self.filename) as roi_file:
+            if self.header is None:
+                self.header = roi_file.header
+            offsets, types, lengths = scan_sync_words(roi_file.buffer, self.consumed, size)
+            chain = walk_blocks(offsets, lengths, self.consumed, size)
+            if len(chain) == 0:
+                return []
+            index = np.zeros(len(chain), dtype=BLOCK_INDEX_DTYPE)
+            index['offset'] = offsets[chain]
+            index['type'] = types[chain]
+            index['length'] = lengths[chain]
+
+            table = build_particle_table(roi_file.buffer, index, self.meta_offset)
+            numbers = image_numbers(table)
+            numbers[numbers > 0] += self.count
+            self.count += int(np.count_nonzero(numbers))
+            meta_blocks = index['offset'][index['type'] == METADATA_BLOCK]
+            if len(meta_blocks):
+                self.meta_offset = int(meta_blocks[-1])
+            self.consumed = int(index['offset'][-1] + index['length'][-1])
+
+            start, end, min_px, max_px, max_aspect = self.filters
+            # Month rollover from the file's first particle, as in a full read
+            if self.start_day is None and np.any(table['day'] > 0):
+                self.start_day = file_start_day(table)
+            times = particle_times(table, self.header['year'], self.header['month'], self.start_day)
+            rows = select_particles(table, times, start, end, min_px, max_px, max_aspect)
+            rows = rows[numbers[rows] > 0]
+            # Copy the images: the map is replaced on the next poll
+            return [(int(number), particle._replace(image=particle.image.copy()))
+                    for number, particle in zip(numbers[rows], roi_file.particles(table[rows]))]
+
+    def run(self, callback, poll_interval=1.0, idle_timeout=None, stop_event=None):
+        """
+        Poll every 'poll_interval' seconds and call callback(image_number,
+        particle) for each new particle (use queue.put for a queue). Stops when
+        'stop_event' is set or the file has not grown for 'idle_timeout'
+        seconds.
+        """
+        for number, particle in follow(self, poll_interval, idle_timeout, stop_event):
+            callback(number, particle)
+
+
+def follow(follower, poll_interval=1.0, idle_timeout=None, stop_event=None):
+    """
+    Generator form of RoiFollower.run: yield (image_number, Particle) as
+    particles are written. 'follower' is a RoiFollower or a roi filename.
+    """
+    if not isinstance(follower, RoiFollower):
+        follower = RoiFollower(follower)
+    last_growth = time.monotonic()
+    while stop_event is None or not stop_event.is_set():
+        consumed = follower.consumed
+        for number, particle in follower.poll():
+            yield number, particle
+        if follower.consumed != consumed:
+            last_growth = time.monotonic()
+        elif idle_timeout is not None and time.monotonic() - last_growth > idle_timeout:
+            return
+        if stop_event is not None:
+            stop_event.wait(poll_interval)
+        else:
+            time.sleep(poll_interval)